@@ -0,0 +1,375 @@
+"""Offline backtest на стратегията върху записан корпус от мачове.
+
+Корпусът е JSON Lines (по желание .gz) - по един мач на ред, с финалния резултат:
+
+    {"fixture": {...API fixture...}, "prediction": {...}, "odds": {...}}
+
+или директория, записана от бота с API_MODE=record (виж ApiRecordStore).
+С --export корпусът се записва като JSON Lines за по-бързо зареждане.
+
+Мачовете минават през AdvancedBetSelector и ResultChecker._check_bet_result
+със симулиран часовник, без мрежа. Всяка стойност от --set е списък, а
+комбинациите от стойности се пускат като отделни прогони (parameter sweep):
+
+    python backtest.py corpus.jsonl --bankroll 100
+    python backtest.py corpus.jsonl --set MARTINGALE_MULTIPLIER=2.0,2.2 --set TARGET_ODD_MAX=2.5,3.0
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta, time as dt_time
+from typing import Dict, List, Optional, Iterable, Iterator
+
+import main
+from main import (AdvancedBetSelector, BettingStrategy, Calibration, ResultChecker, ApiRecordStore,
+                  BG_TZ, FINISHED_STATUSES, SEARCH_HOURS, SETTLE_DELAY)
+
+def _kickoff(fixture: Dict) -> datetime:
+    return datetime.fromisoformat(
+        fixture['fixture']['date'].replace('Z', '+00:00')
+    ).astimezone(BG_TZ)
+
+def open_corpus(path: str):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') \
+        else open(path, encoding='utf-8')
+
+class ReplayCorpus:
+    """Корпусът в паметта, индексиран по fixture id и по BG дата"""
+    
+    def __init__(self, records: List[Dict]):
+        self.final: Dict[int, Dict] = {}
+        self.pre_match: Dict[int, Dict] = {}
+        self.predictions: Dict[int, Dict] = {}
+        self.odds: Dict[int, Dict] = {}
+        self.kickoffs: Dict[int, datetime] = {}
+        self.by_date: Dict[str, List[int]] = {}
+        
+        for record in records:
+            fixture = record['fixture']
+            fixture_id = fixture['fixture']['id']
+            
+            self.final[fixture_id] = fixture
+            # Преди мача API-то връща NS и без голове
+            self.pre_match[fixture_id] = dict(
+                fixture,
+                fixture=dict(fixture['fixture'], status={'short': 'NS', 'long': 'Not Started'}),
+                goals={'home': None, 'away': None}
+            )
+            if record.get('prediction'):
+                self.predictions[fixture_id] = record['prediction']
+            if record.get('odds'):
+                self.odds[fixture_id] = record['odds']
+            
+            kickoff = _kickoff(fixture)
+            self.kickoffs[fixture_id] = kickoff
+            self.by_date.setdefault(kickoff.strftime('%Y-%m-%d'), []).append(fixture_id)
+    
+    @classmethod
+    def load(cls, path: str) -> 'ReplayCorpus':
+        if os.path.isdir(path):
+            return cls(records_from_store(ApiRecordStore(path)))
+        with open_corpus(path) as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+    
+    def date_range(self):
+        dates = sorted(self.by_date)
+        return (datetime.strptime(dates[0], '%Y-%m-%d').date(),
+                datetime.strptime(dates[-1], '%Y-%m-%d').date())
+
+def records_from_store(store: ApiRecordStore) -> List[Dict]:
+    """Сглобява корпус от записания live трафик (API_MODE=record).
+    
+    Взима последното състояние на всеки мач, прогнозата и последните
+    коефициенти, записани преди началото му. Влизат само завършени мачове.
+    """
+    fixtures, predictions, odds = {}, {}, {}
+    
+    for record in store.records():
+        response = record['d'].get('response', [])
+        if record['e'] == 'fixtures':
+            for fixture in response:
+                fixtures[fixture['fixture']['id']] = fixture
+        elif record['e'] == 'predictions' and response:
+            predictions[int(record['p']['fixture'])] = response[0]
+        elif record['e'] == 'odds' and response:
+            odds.setdefault(int(record['p']['fixture']), []).append((record['t'], response[0]))
+    
+    records = []
+    for fixture_id, fixture in fixtures.items():
+        if fixture['fixture']['status']['short'] not in FINISHED_STATUSES:
+            continue
+        kickoff = _kickoff(fixture).timestamp()
+        pre_match_odds = [data for recorded_at, data in odds.get(fixture_id, []) if recorded_at <= kickoff]
+        records.append({
+            'fixture': fixture,
+            'prediction': predictions.get(fixture_id),
+            'odds': pre_match_odds[-1] if pre_match_odds else None
+        })
+    return records
+
+class UnlimitedQuota:
+    def remaining_today(self) -> int:
+        return 10 ** 9
+
+class BacktestAPI:
+    """Интерфейсът на FootballAPI, обслужван от корпуса спрямо симулирания часовник"""
+    
+    def __init__(self, corpus: ReplayCorpus, clock):
+        self.corpus = corpus
+        self.clock = clock
+        self.limiter = UnlimitedQuota()
+    
+    def fixture_cost(self, fixture_id: int) -> int:
+        return 0
+    
+    def _snapshot(self, fixture_id: int) -> Dict:
+        if self.corpus.kickoffs[fixture_id] + SETTLE_DELAY <= self.clock():
+            return self.corpus.final[fixture_id]
+        return self.corpus.pre_match[fixture_id]
+    
+    async def get_live_fixtures(self, excluded_ids: Optional[List[int]] = None,
+                                days: Iterable[int] = (0, 1)) -> List[Dict]:
+        now = self.clock()
+        excluded = set(excluded_ids or [])
+        fixtures = []
+        for days_offset in days:
+            date = (now + timedelta(days=days_offset)).strftime('%Y-%m-%d')
+            fixtures.extend(self._snapshot(fid) for fid in self.corpus.by_date.get(date, [])
+                            if fid not in excluded)
+        return fixtures
+    
+    async def get_predictions(self, fixture_id: int) -> Optional[Dict]:
+        return self.corpus.predictions.get(fixture_id, {})
+    
+    async def get_odds(self, fixture_id: int) -> Optional[Dict]:
+        return self.corpus.odds.get(fixture_id)
+    
+    async def get_fixture_results(self, fixture_ids: List[int]) -> Dict[int, Dict]:
+        return {fid: self._snapshot(fid) for fid in fixture_ids if fid in self.corpus.final}
+
+@contextmanager
+def overrides(values: Dict[str, float]) -> Iterator[None]:
+    """Временно подменя константите в main (TARGET_ODD_MIN, MARTINGALE_MULTIPLIER, ...).
+    
+    Както при профилите, нов прозорец на коефициента мести и разтяга бонуса
+    (ODD_SWEET_SPOT, ODD_BONUS_RANGE), освен ако той не е зададен изрично.
+    """
+    values = dict(values)
+    if 'TARGET_ODD_MIN' in values or 'TARGET_ODD_MAX' in values:
+        odd_min = float(values.get('TARGET_ODD_MIN', main.TARGET_ODD_MIN))
+        odd_max = float(values.get('TARGET_ODD_MAX', main.TARGET_ODD_MAX))
+        if not 1.0 <= odd_min < odd_max:
+            raise ValueError(f"Invalid odds window {odd_min}-{odd_max}")
+        sweet_spot, bonus_range = main.BettingProfile.scaled_bonus(odd_min, odd_max)
+        values.setdefault('ODD_SWEET_SPOT', sweet_spot)
+        values.setdefault('ODD_BONUS_RANGE', bonus_range)
+    
+    saved = {}
+    try:
+        for name, value in values.items():
+            if not name.isupper() or not hasattr(main, name):
+                raise ValueError(f"Unknown setting: {name}")
+            saved[name] = getattr(main, name)
+            setattr(main, name, type(saved[name])(value))
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+
+class Backtester:
+    def __init__(self, corpus: ReplayCorpus, bankroll: float = 100.0,
+                 calibration: Optional[Calibration] = None):
+        self.corpus = corpus
+        self.initial_bankroll = bankroll
+        self.calibration = calibration
+        self.now: Optional[datetime] = None
+    
+    def run(self, settings: Optional[Dict[str, float]] = None) -> Dict:
+        with overrides(settings or {}):
+            return asyncio.run(self._run())
+    
+    async def _run(self) -> Dict:
+        clock = lambda: self.now
+        api = BacktestAPI(self.corpus, clock)
+        selector = AdvancedBetSelector(api, clock=clock)
+        selector.calibration = self.calibration
+        strategy = BettingStrategy(None)
+        checker = ResultChecker(api, None)
+        
+        self.bankroll = self.initial_bankroll
+        self.peak = self.bankroll
+        self.max_drawdown = 0.0
+        self.max_stake = 0.0
+        self.curve = []
+        self.bets = []
+        self.pending = []
+        self.skipped = 0
+        
+        start, end = self.corpus.date_range()
+        day = start
+        while day <= end:
+            strategy.reset_daily()
+            used_fixture_ids = []
+            
+            for hour in SEARCH_HOURS:
+                self.now = BG_TZ.localize(datetime.combine(day, dt_time(hour)))
+                self._settle(checker, strategy)
+                
+                if len(strategy.bets_today) >= main.MAX_BETS_PER_DAY:
+                    continue
+                
+                combination = await selector.find_smart_combination(used_fixture_ids)
+                if combination:
+                    self._place(combination, strategy, used_fixture_ids)
+            
+            self.now = BG_TZ.localize(datetime.combine(day, dt_time(23, 59)))
+            self._settle(checker, strategy)
+            day += timedelta(days=1)
+        
+        # Доизчакваме последните мачове
+        self.now = BG_TZ.localize(datetime.combine(end + timedelta(days=2), dt_time(0)))
+        self._settle(checker, strategy)
+        
+        return self._report()
+    
+    def _place(self, combination: Dict, strategy: BettingStrategy, used_fixture_ids: List[int]):
+        amount = strategy.current_bet
+        if amount > self.bankroll:
+            self.skipped += 1
+            return
+        
+        legs = combination['bets']
+        settle_at = max(self.corpus.kickoffs[b.fixture_id] for b in legs) + SETTLE_DELAY
+        
+        self.bankroll -= amount
+        self.max_stake = max(self.max_stake, amount)
+        self.pending.append({
+            'placed': self.now,
+            'settle_at': settle_at,
+            'amount': amount,
+            'odd': combination['total_odd'],
+            'legs': [(b.fixture_id, {'prediction_key': b.prediction_key}) for b in legs]
+        })
+        strategy.bets_today.append(combination)
+        used_fixture_ids.extend(b.fixture_id for b in legs)
+        self._record()
+    
+    def _settle(self, checker: ResultChecker, strategy: BettingStrategy):
+        due = sorted((b for b in self.pending if b['settle_at'] <= self.now),
+                     key=lambda b: b['settle_at'])
+        if not due:
+            return
+        
+        for bet in due:
+            self.pending.remove(bet)
+            won = True
+            for fixture_id, leg in bet['legs']:
+                result = self.corpus.final[fixture_id]
+                if result['fixture']['status']['short'] not in FINISHED_STATUSES:
+                    won = False  # отложен/прекратен мач - броим като загуба
+                    break
+                if not checker._check_bet_result(result, leg):
+                    won = False
+            
+            payout = bet['amount'] * bet['odd'] if won else 0.0
+            self.bankroll += payout
+            bet['result'] = 'won' if won else 'lost'
+            bet['profit'] = payout - bet['amount']
+            self.bets.append(bet)
+            strategy.calculate_next_bet(won)
+        
+        self._record()
+    
+    def _record(self):
+        # Залогът се вади при поставяне, затова кривата показва и парите "в игра"
+        self.peak = max(self.peak, self.bankroll)
+        self.max_drawdown = max(self.max_drawdown, self.peak - self.bankroll)
+        self.curve.append((self.now.isoformat(), round(self.bankroll, 2)))
+    
+    def _report(self) -> Dict:
+        won = sum(1 for b in self.bets if b['result'] == 'won')
+        staked = sum(b['amount'] for b in self.bets)
+        return {
+            'bets': len(self.bets),
+            'won': won,
+            'lost': len(self.bets) - won,
+            'skipped': self.skipped,
+            'hit_rate': round(won / len(self.bets) * 100, 1) if self.bets else 0,
+            'staked': round(staked, 2),
+            'profit': round(self.bankroll - self.initial_bankroll, 2),
+            'roi': round((self.bankroll - self.initial_bankroll) / staked * 100, 1) if staked else 0,
+            'final_bankroll': round(self.bankroll, 2),
+            'max_drawdown': round(self.max_drawdown, 2),
+            'max_drawdown_pct': round(self.max_drawdown / self.peak * 100, 1) if self.peak else 0,
+            'max_stake': round(self.max_stake, 2),
+            'curve': self.curve
+        }
+
+def parse_sweep(items: List[str]) -> List[Dict[str, float]]:
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        grid[name.strip()] = [float(v) for v in values.split(',') if v.strip()]
+    names = list(grid)
+    return [dict(zip(names, combo)) for combo in itertools.product(*grid.values())] or [{}]
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Offline backtest of the betting strategy')
+    parser.add_argument('corpus', help='JSON Lines corpus (optionally .gz) or a record store directory')
+    parser.add_argument('--bankroll', type=float, default=100.0)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=V1,V2',
+                        help='override a main.py setting; several values = sweep')
+    parser.add_argument('--curve', help='write the bankroll curve of the first run to CSV')
+    parser.add_argument('--json', action='store_true', help='print full results as JSON')
+    parser.add_argument('--export', help='write the loaded corpus as gzipped JSON Lines and exit')
+    parser.add_argument('--calibration', help='score with a calibration table from calibrate.py')
+    args = parser.parse_args()
+    
+    # Логовете на селектора са за live режима и забавят прогона многократно
+    logging.getLogger('main').setLevel(logging.ERROR)
+    
+    if args.export:
+        records = records_from_store(ApiRecordStore(args.corpus)) if os.path.isdir(args.corpus) \
+            else [json.loads(line) for line in open_corpus(args.corpus) if line.strip()]
+        with gzip.open(args.export, 'wt', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n')
+        print(f"Exported {len(records)} fixtures to {args.export}")
+        return
+    
+    corpus = ReplayCorpus.load(args.corpus)
+    calibration = None
+    if args.calibration:
+        calibration = Calibration.load(args.calibration)
+        if calibration is None:
+            parser.error(f"cannot load calibration from {args.calibration}")
+    backtester = Backtester(corpus, bankroll=args.bankroll, calibration=calibration)
+    
+    results = []
+    for settings in parse_sweep(args.set):
+        report = backtester.run(settings)
+        results.append((settings, report))
+        if not args.json:
+            print(f"{settings or 'defaults'}: bets {report['bets']} (hit {report['hit_rate']}%), "
+                  f"profit {report['profit']:.2f}, max DD {report['max_drawdown']:.2f} "
+                  f"({report['max_drawdown_pct']}%), max stake {report['max_stake']:.2f}, "
+                  f"skipped {report['skipped']}")
+    
+    if args.curve and results:
+        with open(args.curve, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'bankroll'])
+            writer.writerows(results[0][1]['curve'])
+    
+    if args.json:
+        print(json.dumps([{'settings': s, **{k: v for k, v in r.items() if k != 'curve'}}
+                          for s, r in results], indent=2))
+
+if __name__ == '__main__':
+    main_cli()
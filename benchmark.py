@@ -0,0 +1,368 @@
+"""Бенчмарк на горещите пътища: извличане на опциите, търсене на комбинации,
+проверка на резултатите и дневните статистики.
+
+Данните се генерират детерминистично (по seed) във формата на api-sports -
+fixtures, predictions и odds с няколко букмейкъра и финални резултати. По
+подразбиране размерите са 100, 1 000 и 3 000 мача (няколко секунди общо),
+по-големи се задават с --sizes. За всеки етап се пази медианата на времето от
+--repeat изпълнения и пиковата памет (tracemalloc, отделно изпълнение). Резултатът е
+JSON baseline; с --compare текущото изпълнение се сравнява с него и командата
+излиза с код 1 при регресия. Времената зависят от машината - сравнявайте
+baseline, записан на същата машина.
+
+    python benchmark.py --out benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json
+    python benchmark.py --sizes 100,1000 --stages extract,settle --repeat 5 --json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+import main
+from main import (AdvancedBetSelector, BetOption, DatabaseManager, FixtureInfo, ResultChecker,
+                  FINISHED_STATUSES)
+
+SIZES = [100, 1_000, 3_000]
+REPEAT = 3
+SEED = 0
+TOLERANCE = 0.25  # допустимо забавяне спрямо baseline
+MEMORY_TOLERANCE = 0.10
+MIN_DELTA = 0.002  # сек.; по-малки разлики са шум
+MIN_MEMORY_DELTA = 64  # KB
+STAGES = ['extract', 'combination', 'settle', 'daily_stats']
+
+BOOKMAKERS = [(8, 'Bet365'), (6, 'Bwin'), (11, '1xBet'), (16, 'Unibet'), (32, 'Betway')]
+LEAGUES = 60
+TEAMS_PER_LEAGUE = 20
+GOAL_LINES = [0.5, 1.5, 2.5, 3.5, 4.5]
+TOTAL_GOALS = np.add.outer(np.arange(11), np.arange(11))
+START = datetime(2026, 1, 1, 12, 0)
+
+@dataclass
+class Dataset:
+    """Генерираните API отговори за n мача"""
+    fixtures: List[Dict]
+    predictions: Dict[int, Dict]
+    odds: Dict[int, Dict]
+    finals: Dict[int, Dict]
+
+def _poisson(lam: float, max_goals: int = 10) -> np.ndarray:
+    """P(0..max_goals гола)"""
+    return np.exp(-lam) * np.cumprod(np.concatenate(([1.0], lam / np.arange(1, max_goals + 1))))
+
+def _price(probability: float, margin: float, noise: float) -> str:
+    return f"{max(1.01, 1 / (probability * margin) * noise):.2f}"
+
+def generate(n: int, seed: int = SEED, bookmakers: int = 3) -> Dataset:
+    """n мача в рамките на 24 часа с predictions, odds и финален резултат.
+    Силите на отборите определят очакваните голове (Поасон), от тях - процентите
+    на API-то и коефициентите (с марж и шум за всеки букмейкър)"""
+    rng = np.random.default_rng(seed)
+    strength = rng.normal(1.0, 0.25, LEAGUES * TEAMS_PER_LEAGUE).clip(0.4, 1.8)
+    
+    data = Dataset([], {}, {}, {})
+    for i in range(n):
+        fixture_id = 1_000_000 + i
+        league = int(rng.integers(LEAGUES))
+        home, away = (league * TEAMS_PER_LEAGUE + rng.choice(TEAMS_PER_LEAGUE, 2, replace=False)).tolist()
+        kickoff = START + timedelta(minutes=15 * int(rng.integers(96)))
+        
+        lam_home = 1.45 * strength[home] / strength[away] ** 0.5
+        lam_away = 1.15 * strength[away] / strength[home] ** 0.5
+        grid = np.outer(_poisson(lam_home), _poisson(lam_away))  # [голове домакин, голове гост]
+        p_home = float(np.tril(grid, -1).sum())
+        p_draw = float(np.trace(grid))
+        p_away = float(np.triu(grid, 1).sum())
+        p_btts = float(grid[1:, 1:].sum())
+        
+        # API-то закръгля процентите и им добавя собствена грешка
+        percent = np.array([p_home, p_draw, p_away]) * rng.normal(1.0, 0.08, 3)
+        percent = np.round(percent / percent.sum() * 100).astype(int)
+        
+        league_info = {'id': 1000 + league, 'name': f"League {league}", 'country': f"Country {league % 25}",
+                       'logo': f"https://media.api-sports.io/football/leagues/{1000 + league}.png",
+                       'flag': None, 'season': 2026, 'round': f"Regular Season - {1 + i % 38}"}
+        teams = {side: {'id': team, 'name': f"Team {team}",
+                        'logo': f"https://media.api-sports.io/football/teams/{team}.png", 'winner': None}
+                 for side, team in (('home', home), ('away', away))}
+        fixture = {
+            'fixture': {'id': fixture_id, 'referee': None, 'timezone': 'UTC',
+                        'date': kickoff.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+                        'timestamp': int(kickoff.timestamp()), 'periods': {'first': None, 'second': None},
+                        'venue': {'id': home, 'name': f"Stadium {home}", 'city': f"City {home}"},
+                        'status': {'long': 'Not Started', 'short': 'NS', 'elapsed': None}},
+            'league': league_info,
+            'teams': teams,
+            'goals': {'home': None, 'away': None},
+            'score': {'halftime': {'home': None, 'away': None}, 'fulltime': {'home': None, 'away': None},
+                      'extratime': {'home': None, 'away': None}, 'penalty': {'home': None, 'away': None}}
+        }
+        data.fixtures.append(fixture)
+        
+        favourite = 'home' if p_home >= p_away else 'away'
+        data.predictions[fixture_id] = {
+            'predictions': {
+                'winner': {'id': teams[favourite]['id'], 'name': teams[favourite]['name'], 'comment': None},
+                'win_or_draw': True,
+                'under_over': '-2.5' if lam_home + lam_away < 2.5 else '+2.5',
+                'goals': {'home': f"-{lam_home + 1:.1f}", 'away': f"-{lam_away + 1:.1f}"},
+                'advice': f"Double chance : {teams[favourite]['name']} or draw",
+                'percent': {'home': f"{percent[0]}%", 'draw': f"{percent[1]}%", 'away': f"{percent[2]}%"}
+            },
+            'league': league_info,
+            'teams': {side: {'id': team['id'], 'name': team['name'], 'logo': team['logo']}
+                      for side, team in teams.items()},
+            'comparison': {key: {'home': f"{percent[0]}%", 'away': f"{percent[2]}%"}
+                           for key in ('form', 'att', 'def', 'poisson_distribution', 'h2h', 'goals', 'total')}
+        }
+        
+        books = []
+        for bookmaker_id, name in (BOOKMAKERS[j] for j in rng.choice(len(BOOKMAKERS), bookmakers, replace=False)):
+            margin = rng.uniform(1.04, 1.09)
+            noise = rng.normal(1.0, 0.03, 16)
+            over_under = []
+            for line_idx, line in enumerate(GOAL_LINES):
+                p_over = float(grid[TOTAL_GOALS > line].sum())
+                over_under.append({'value': f"Over {line}", 'odd': _price(p_over, margin, noise[3 + line_idx])})
+                over_under.append({'value': f"Under {line}", 'odd': _price(1 - p_over, margin, noise[8 + line_idx])})
+            books.append({'id': bookmaker_id, 'name': name, 'bets': [
+                {'id': 1, 'name': 'Match Winner', 'values': [
+                    {'value': 'Home', 'odd': _price(p_home, margin, noise[0])},
+                    {'value': 'Draw', 'odd': _price(p_draw, margin, noise[1])},
+                    {'value': 'Away', 'odd': _price(p_away, margin, noise[2])}]},
+                {'id': 5, 'name': 'Goals Over/Under', 'values': over_under},
+                {'id': 8, 'name': 'Both Teams Score', 'values': [
+                    {'value': 'Yes', 'odd': _price(p_btts, margin, noise[13])},
+                    {'value': 'No', 'odd': _price(1 - p_btts, margin, noise[14])}]},
+                {'id': 12, 'name': 'Double Chance', 'values': [
+                    {'value': 'Home/Draw', 'odd': _price(p_home + p_draw, margin, noise[15])},
+                    {'value': 'Draw/Away', 'odd': _price(p_draw + p_away, margin, noise[15])},
+                    {'value': 'Home/Away', 'odd': _price(p_home + p_away, margin, noise[15])}]}
+            ]})
+        data.odds[fixture_id] = {
+            'league': league_info,
+            'fixture': {'id': fixture_id, 'timezone': 'UTC', 'date': fixture['fixture']['date'],
+                        'timestamp': fixture['fixture']['timestamp']},
+            'update': (kickoff - timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+            'bookmakers': books
+        }
+        
+        # ~1% отложени мачове, останалите приключват с голове по Поасон
+        if rng.random() < 0.01:
+            status = {'long': 'Match Postponed', 'short': 'PST', 'elapsed': None}
+            score = {'home': None, 'away': None}
+        else:
+            status = {'long': 'Match Finished', 'short': 'FT', 'elapsed': 90}
+            score = {'home': int(rng.poisson(lam_home)), 'away': int(rng.poisson(lam_away))}
+        data.finals[fixture_id] = dict(fixture, fixture=dict(fixture['fixture'], status=status),
+                                       goals=score, score=dict(fixture['score'], fulltime=score))
+    return data
+
+def extract_options(data: Dataset) -> List[BetOption]:
+    selector = AdvancedBetSelector(None)
+    return [option for fixture in data.fixtures
+            for option in selector._extract_all_bet_types(data.predictions[fixture['fixture']['id']],
+                                                           data.odds[fixture['fixture']['id']],
+                                                           FixtureInfo.from_api(fixture))]
+
+def stats_db(directory: str, data: Dataset, options: List[BetOption]) -> Tuple[DatabaseManager, List[str]]:
+    """База с по един залог на мач, по MAX_BETS_PER_DAY на ден"""
+    db = DatabaseManager(os.path.join(directory, f"bench_{len(data.fixtures)}.db"))
+    db.autocommit = False
+    by_fixture = {}
+    for option in options:
+        by_fixture.setdefault(option.fixture_id, option)
+    dates = []
+    checker = ResultChecker(None, None)
+    for i, fixture in enumerate(data.fixtures):
+        date = str((START + timedelta(days=i // main.MAX_BETS_PER_DAY)).date())
+        if not dates or dates[-1] != date:
+            dates.append(date)
+        option = by_fixture.get(fixture['fixture']['id'])
+        if option is None:
+            continue
+        db.save_bet({'bet_number': i % main.MAX_BETS_PER_DAY + 1, 'date': date, 'amount': 1.0,
+                     'odd': option.odd, 'potential_win': option.odd, 'bet_type': option.bet_category,
+                     'fixtures': [{'fixture_id': option.fixture_id, 'prediction_key': option.prediction_key}]})
+        final = data.finals[option.fixture_id]
+        if final['fixture']['status']['short'] not in FINISHED_STATUSES:
+            continue  # отложеният мач остава чакащ
+        won = checker._check_bet_result(final, {'prediction_key': option.prediction_key})
+        db.update_bet_result(db.conn.execute("SELECT last_insert_rowid()").fetchone()[0],
+                             'won' if won else 'lost', option.odd - 1 if won else -1.0)
+    db.conn.commit()
+    return db, dates
+
+def stages(data: Dataset, directory: str) -> Dict[str, Tuple[Callable[[], object], int]]:
+    """Етап -> (функция за измерване, брой елементи, които обработва)"""
+    selector = AdvancedBetSelector(None)
+    infos = [FixtureInfo.from_api(f) for f in data.fixtures]
+    for info in infos:
+        selector.fixture_table[info.id] = info
+    options = extract_options(data)
+    checker = ResultChecker(None, None)
+    # Както в check_pending_bets - проверяват се само приключилите мачове
+    legs = [(data.finals[o.fixture_id], {'prediction_key': o.prediction_key}) for o in options
+            if data.finals[o.fixture_id]['fixture']['status']['short'] in FINISHED_STATUSES]
+    db, dates = stats_db(directory, data, options)
+    
+    def extract():
+        for info in infos:
+            selector._extract_all_bet_types(data.predictions[info.id], data.odds[info.id], info)
+    
+    def combination():
+        # Търсенето сортира списъка - всяко изпълнение получава копие в изходния ред
+        return selector._find_best_combination(list(options))
+    
+    def settle():
+        for result, leg in legs:
+            checker._check_bet_result(result, leg)
+    
+    def daily_stats():
+        for date in dates:
+            db.get_daily_stats(date)
+    
+    return {
+        'extract': (extract, len(infos)),
+        'combination': (combination, len(options)),
+        'settle': (settle, len(legs)),
+        'daily_stats': (daily_stats, len(dates))
+    }
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return {'seconds': statistics.median(timings), 'min_seconds': min(timings), 'peak_kb': peak / 1024}
+
+def run(sizes: List[int], selected: List[str], repeat: int = REPEAT, seed: int = SEED) -> Dict:
+    results: Dict[str, Dict[str, Dict]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            data = generate(n, seed)
+            for name, (fn, items) in stages(data, directory).items():
+                if name not in selected:
+                    continue
+                result = measure(fn, repeat)
+                result['items'] = items
+                result['per_item_us'] = result['seconds'] / max(items, 1) * 1e6
+                results.setdefault(name, {})[str(n)] = {k: round(v, 6) if isinstance(v, float) else v
+                                                        for k, v in result.items()}
+    return {
+        'version': 1,
+        'created': datetime.now(main.BG_TZ).isoformat(),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()}",
+        'numpy': np.__version__,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results
+    }
+
+def compare(current: Dict, baseline: Dict, tolerance: float = TOLERANCE,
+            memory_tolerance: float = MEMORY_TOLERANCE) -> List[Dict]:
+    """Етапите и размерите, измерени и в двата отчета; regression = по-бавно или
+    с повече памет от допуснатото (и над прага на шума)"""
+    rows = []
+    for name, sizes in current['results'].items():
+        for n, now in sizes.items():
+            before = baseline['results'].get(name, {}).get(n)
+            if before is None:
+                continue
+            slower = now['seconds'] > before['seconds'] * (1 + tolerance) \
+                and now['seconds'] - before['seconds'] > MIN_DELTA
+            heavier = now['peak_kb'] > before['peak_kb'] * (1 + memory_tolerance) \
+                and now['peak_kb'] - before['peak_kb'] > MIN_MEMORY_DELTA
+            rows.append({
+                'stage': name,
+                'size': int(n),
+                'seconds': now['seconds'],
+                'baseline_seconds': before['seconds'],
+                'time_ratio': round(now['seconds'] / before['seconds'], 3) if before['seconds'] else None,
+                'peak_kb': now['peak_kb'],
+                'baseline_peak_kb': before['peak_kb'],
+                'regression': slower or heavier
+            })
+    return rows
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark the selection and settlement hot paths')
+    parser.add_argument('--sizes', default=','.join(str(n) for n in SIZES),
+                        help='comma-separated fixture counts')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--out', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline to compare against; exits 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown, e.g. 0.25 = 25%%')
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    
+    logging.getLogger('main').setLevel(logging.ERROR)
+    
+    selected = args.stages.split(',')
+    unknown = set(selected) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    
+    baseline = None
+    if args.compare:
+        if not os.path.exists(args.compare):
+            parser.error(f"baseline {args.compare} not found")
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    
+    report = run([int(n) for n in args.sizes.split(',')], selected, args.repeat, args.seed)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    
+    rows = compare(report, baseline, args.tolerance, args.memory_tolerance) if baseline else []
+    regressions = [row for row in rows if row['regression']]
+    
+    if args.json:
+        print(json.dumps({**report, 'comparison': rows} if baseline else report, indent=2))
+    else:
+        print(f"{'stage':24} {'fixtures':>8} {'items':>7} {'median':>11} {'per item':>12} {'peak':>10}")
+        for name, sizes in report['results'].items():
+            for n, result in sizes.items():
+                print(f"{name:24} {n:>8} {result['items']:>7} {result['seconds'] * 1000:>8.2f} ms "
+                      f"{result['per_item_us']:>9.2f} us {result['peak_kb']:>7.0f} KB")
+        if baseline:
+            print(f"\nAgainst {args.compare} (tolerance {args.tolerance:.0%} time, "
+                  f"{args.memory_tolerance:.0%} memory):")
+            for row in rows:
+                print(f"  {row['stage']:24} {row['size']:>6}  time x{row['time_ratio']}  "
+                      f"peak {row['baseline_peak_kb']:.0f} -> {row['peak_kb']:.0f} KB"
+                      + ("  REGRESSION" if row['regression'] else ""))
+    
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main_cli()
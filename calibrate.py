@@ -0,0 +1,170 @@
+"""Калибрация на увереността по лига, пазар и bucket на суровия процент.
+
+Емпиричните hit rates се учат от приключилите залози в bets таблицата и от
+записаните резултати (корпус или API_MODE=record директория, виж backtest.py).
+Всяка клетка се свива към общата за пазара стойност, а тя - към суровия
+процент, така че редките лиги не скачат до 0% или 100%. Резултатът е малка
+JSON таблица, която ботът зарежда при старт (Calibration.load).
+
+    python calibrate.py
+    python calibrate.py --records corpus.jsonl.gz --records api_records --bucket 10
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from main import (AdvancedBetSelector, Calibration, DatabaseManager, FixtureInfo, ResultChecker,
+                  API_RECORD_DIR, BG_TZ, CALIBRATION_PATH, DB_PATH, FINISHED_STATUSES)
+from backtest import ReplayCorpus
+
+BUCKET = 5
+PRIOR_WEIGHT = 20
+MIN_LEAGUE_SAMPLES = 30
+
+# (league_id, пазар, суров процент, спечелен)
+Sample = Tuple[int, str, float, bool]
+
+def samples_from_corpus(corpus: ReplayCorpus) -> Iterator[Sample]:
+    """Всички опции, които селекторът би извлякъл за завършените мачове"""
+    selector = AdvancedBetSelector(None)
+    checker = ResultChecker(None, None)
+    for fixture_id, final in corpus.final.items():
+        if final['fixture']['status']['short'] not in FINISHED_STATUSES:
+            continue
+        prediction = corpus.predictions.get(fixture_id)
+        odds = corpus.odds.get(fixture_id)
+        if not prediction or not odds:
+            continue
+        
+        info = FixtureInfo.from_api(final)
+        for option in selector._extract_all_bet_types(prediction, odds, info):
+            won = checker._check_bet_result(final, {'prediction_key': option.prediction_key})
+            yield info.league_id, Calibration.market_key(option), option.confidence, won
+
+def samples_from_bets(db: DatabaseManager, finals: Dict[int, Dict], covered: Set[int]) -> Iterator[Sample]:
+    """Мачовете от приключилите залози. Залог с един мач носи резултата си, а залог
+    с няколко се брои само ако всичките му мачове имат записан краен резултат.
+    
+    Без тях резултатът на отделния мач е известен само при спечелен залог - ако
+    броим само тях, всеки мач от комбинация излиза 100% спечелен.
+    """
+    checker = ResultChecker(None, None)
+    for result, legs in db.get_settled_legs():
+        if len(legs) > 1 and any(leg['fixture_id'] not in finals for leg in legs):
+            continue
+        
+        for leg in legs:
+            if 'confidence' not in leg or leg['fixture_id'] in covered:
+                continue  # стар залог без увереност или мачът вече е броен от записите
+            
+            final = finals.get(leg['fixture_id'])
+            won = checker._check_bet_result(final, leg) if final is not None else result == 'won'
+            
+            market = f"{leg['bet_category']}:{leg['prediction_key']}"
+            yield leg.get('league_id', 0), market, leg['confidence'], won
+
+def fit(samples: List[Sample], bucket: int = BUCKET, prior_weight: float = PRIOR_WEIGHT,
+        min_league_samples: int = MIN_LEAGUE_SAMPLES) -> Dict[str, float]:
+    pooled: Dict[Tuple[str, int], List] = {}
+    leagues: Dict[Tuple[int, str, int], List] = {}
+    for league_id, market, confidence, won in samples:
+        b = int(confidence // bucket)
+        for table, key in ((pooled, (market, b)), (leagues, (league_id, market, b))):
+            cell = table.setdefault(key, [0, 0, 0.0])  # hits, n, сума на суровите проценти
+            cell[0] += won
+            cell[1] += 1
+            cell[2] += confidence
+    
+    table = {}
+    pooled_rate = {}
+    for (market, b), (hits, n, confidence_sum) in pooled.items():
+        prior = confidence_sum / n / 100
+        rate = pooled_rate[(market, b)] = (hits + prior_weight * prior) / (n + prior_weight)
+        table[f"{Calibration.POOLED}|{market}|{b}"] = round(rate * 100, 1)
+    
+    for (league_id, market, b), (hits, n, _) in leagues.items():
+        if n < min_league_samples:
+            continue
+        rate = (hits + prior_weight * pooled_rate[(market, b)]) / (n + prior_weight)
+        table[f"{league_id}|{market}|{b}"] = round(rate * 100, 1)
+    return table
+
+def brier(samples: List[Sample], calibration: Optional[Calibration] = None) -> float:
+    """Среден квадрат на грешката на вероятностите (по-малко е по-добре)"""
+    if not samples:
+        return 0.0
+    total = 0.0
+    for league_id, market, confidence, won in samples:
+        probability = confidence
+        if calibration is not None:
+            value = calibration.lookup(league_id, market, confidence)
+            if value is not None:
+                probability = value
+        total += (probability / 100 - won) ** 2
+    return total / len(samples)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Fit per-league/per-market confidence calibration')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--records', action='append', default=None,
+                        help='corpus file or record directory (repeatable); defaults to API_RECORD_DIR')
+    parser.add_argument('--out', default=CALIBRATION_PATH)
+    parser.add_argument('--bucket', type=int, default=BUCKET, help='confidence bucket width in %%')
+    parser.add_argument('--prior', type=float, default=PRIOR_WEIGHT,
+                        help='pseudo-samples pulling each cell towards its parent rate')
+    parser.add_argument('--min-league', type=int, default=MIN_LEAGUE_SAMPLES)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    
+    paths = args.records if args.records is not None else \
+        [API_RECORD_DIR] if os.path.isdir(API_RECORD_DIR) else []
+    samples: List[Sample] = []
+    finals: Dict[int, Dict] = {}
+    covered: Set[int] = set()
+    for path in paths:
+        corpus = ReplayCorpus.load(path)
+        samples.extend(samples_from_corpus(corpus))
+        finals.update(corpus.final)
+        covered.update(f for f in corpus.final if f in corpus.predictions and f in corpus.odds)
+    from_records = len(samples)
+    
+    if os.path.exists(args.db):
+        samples.extend(samples_from_bets(DatabaseManager(args.db, readonly=True), finals, covered))
+    
+    if not samples:
+        parser.error('no settled bets or recorded results to learn from')
+    
+    table = fit(samples, args.bucket, args.prior, args.min_league)
+    calibration = Calibration.from_table(table, args.bucket, len(samples))
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': 1,
+            'fitted_at': datetime.now(BG_TZ).isoformat(),
+            'bucket': args.bucket,
+            'samples': len(samples),
+            'table': table
+        }, f, separators=(',', ':'))
+    
+    report = {
+        'samples': len(samples),
+        'from_records': from_records,
+        'from_bets': len(samples) - from_records,
+        'cells': len(table),
+        'league_cells': sum(1 for k in table if not k.startswith(f"{Calibration.POOLED}|")),
+        'brier_raw': round(brier(samples), 4),
+        'brier_calibrated': round(brier(samples, calibration), 4),
+        'out': args.out
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    
+    print(f"{report['samples']:,} legs ({report['from_records']:,} from records, "
+          f"{report['from_bets']:,} from bets) -> {report['cells']} cells "
+          f"({report['league_cells']} per league) in {args.out}")
+    print(f"Brier score (in-sample): raw {report['brier_raw']}, calibrated {report['brier_calibrated']}")
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,17 +1,33 @@
 import os
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timedelta, time as dt_time
+from typing import List, Dict, Optional, Tuple, Iterator, Iterable, Callable, Awaitable
 import aiohttp
+import numpy as np
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter, NetworkError, BadRequest
 import pytz
 from aiohttp import web
 import traceback
 import sqlite3
 import json
+import codecs
+import gzip
+import heapq
+import sys
+from dataclasses import dataclass
+from operator import attrgetter
+import itertools
+import bisect
+from contextlib import contextmanager
+import time
+import queue
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 
 # Конфигурация
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8354673661:AAGaSRxyHa2WGFkyMjoTWg5qrC2Lxcf7s6M')
@@ -19,6 +35,19 @@ TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID', '-1003114970901')
 API_FOOTBALL_KEY = os.getenv('API_FOOTBALL_KEY', '2589b526b382f3528eb485c95eac5080')
 PORT = int(os.getenv('PORT', 10000))
 
+# Изходяща опашка към Telegram: канал/група приема ~20 съобщения в минута
+TELEGRAM_CHAT_INTERVAL = 3.0
+TELEGRAM_MAX_ATTEMPTS = 8
+TELEGRAM_MAX_BACKOFF = 600
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Входящи команди/бутони: webhook през същия aiohttp сървър, polling при локално пускане
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', os.getenv('RENDER_EXTERNAL_URL', ''))
+TELEGRAM_WEBHOOK_PATH = '/telegram'
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+TELEGRAM_UPDATES = os.getenv('TELEGRAM_UPDATES', 'webhook' if TELEGRAM_WEBHOOK_URL else 'polling')  # 'webhook', 'polling' или 'off'
+TELEGRAM_ALLOWED_UPDATES = ['message', 'callback_query']
+
 BG_TZ = pytz.timezone('Europe/Sofia')
 
 # Настройки
@@ -27,6 +56,114 @@ TARGET_ODD_MIN = 2.0
 TARGET_ODD_MAX = 2.5
 MAX_BETS_PER_DAY = 8  # Увеличихме от 5 на 8
 MARTINGALE_MULTIPLIER = 2.2
+SEARCH_HOURS = [8, 10, 12, 14, 16, 18, 20]
+
+# Профили канал/стратегия (JSON списък); без файл - един профил с настройките по-горе
+PROFILES_PATH = os.getenv('PROFILES_PATH', 'profiles.json')
+DEFAULT_PROFILE = 'default'
+
+# Резултатите се проверяват SETTLE_DELAY след началото на последния мач от залога
+SETTLE_DELAY = timedelta(hours=2)
+SETTLE_RETRY = timedelta(minutes=30)
+# Всеки неуспешен нов опит удвоява паузата до този таван
+SETTLE_RETRY_MAX = timedelta(hours=6)
+# Отложен мач, който не е изигран толкова след първоначалния си час, се анулира
+POSTPONED_VOID_AFTER = timedelta(hours=48)
+
+# Търсене на комбинации
+COMBO_MAX_LEGS = int(os.getenv('COMBO_MAX_LEGS', 5))
+COMBO_TOP_K = 5
+COMBO_MAX_EXPANSIONS = 200_000  # таван на обходените възли при търсенето
+COMBO_EPSILON = 1e-9
+# Граници на търсенето: стъпка на кофите по log-коефициент и брой пазени таблици
+COMBO_BOUND_STEP = 0.001
+COMBO_BOUND_TABLES = 256
+# Комбинация се пуска, щом никоя неизследвана не може да я надмине с повече от толкова
+# точки score - иначе почти равните (2.199 срещу 2.2) се доказват с пълно обхождане
+COMBO_SCORE_TOLERANCE = 0.01
+ODD_SWEET_SPOT = 2.2
+ODD_BONUS_RANGE = 0.5
+
+# Едновременните търсения с едни и същи изключени мачове се обединяват,
+# а резултатът се връща наготово още SEARCH_CACHE_TTL
+SEARCH_CACHE_TTL = timedelta(minutes=2)
+SEARCH_CACHE_SIZE = 16
+
+# HTTP връзки към API-Football
+API_CONNECTION_LIMIT = int(os.getenv('API_CONNECTION_LIMIT', 10))
+API_KEEPALIVE_TIMEOUT = int(os.getenv('API_KEEPALIVE_TIMEOUT', 60))
+API_DNS_CACHE_TTL = int(os.getenv('API_DNS_CACHE_TTL', 600))
+
+# Квоти на API-Football (free tier: 10/мин, 100/ден)
+API_REQUESTS_PER_MINUTE = int(os.getenv('API_REQUESTS_PER_MINUTE', 10))
+API_REQUESTS_PER_DAY = int(os.getenv('API_REQUESTS_PER_DAY', 100))
+MAX_FIXTURES_PER_SEARCH = 30
+
+# Кеш на API отговорите (TTL в секунди)
+DB_PATH = os.getenv('DB_PATH', 'bets.db')
+CACHE_PERSIST = os.getenv('CACHE_PERSIST', '1') == '1'
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2000))
+CACHE_TTL_PREDICTIONS = 6 * 3600
+CACHE_TTL_ODDS = 10 * 60
+CACHE_TTL_FIXTURES = 30 * 60
+CACHE_TTL_LIVE = 2 * 60
+CACHE_TTL_FINISHED = 24 * 3600
+
+# База данни: една writer нишка + optional reader нишки (WAL)
+DB_READER_THREADS = int(os.getenv('DB_READER_THREADS', 0))
+DB_COMMIT_BATCH = 20
+
+# Режим на API-то: live, record (live + запис на отговорите) или replay (само от записа)
+API_MODE = os.getenv('API_MODE', 'live')
+API_RECORD_DIR = os.getenv('API_RECORD_DIR', 'api_records')
+# В replay режим часовникът тръгва от този BG час (ISO, напр. 2026-03-14T10:00) - записът
+# се обслужва такъв, какъвто е бил тогава; без него replay върви по текущото време
+API_REPLAY_START = os.getenv('API_REPLAY_START')
+
+# fixtures?ids= приема до 20 мача в една заявка
+API_MAX_IDS_PER_REQUEST = 20
+
+# Големите fixtures отговори се четат поточно на парчета
+API_STREAM_CHUNK = 64 * 1024
+
+# Фонов pipeline: predictions веднъж на мач, odds се опресняват по-често към началото
+PIPELINE_ENABLED = os.getenv('PIPELINE_ENABLED', '1') == '1'
+PIPELINE_HORIZON_HOURS = 26
+# Списъците с мачове по дата ползват до този дял от дневната квота - по една заявка на
+# опресняване, защото днешният списък се тегли само при старт (после е вчерашният "утре")
+PIPELINE_FIXTURES_QUOTA_SHARE = float(os.getenv('PIPELINE_FIXTURES_QUOTA_SHARE', 0.1))
+PIPELINE_FIXTURES_REFRESH = timedelta(days=1) / max(1, int(API_REQUESTS_PER_DAY * PIPELINE_FIXTURES_QUOTA_SHARE))
+PIPELINE_QUOTA_RESERVE = int(os.getenv('PIPELINE_QUOTA_RESERVE', 15))
+PIPELINE_MAX_DELAY = 600
+# Неуспешна заявка за predictions (грешка, изчерпана квота) се повтаря след толкова
+PIPELINE_RETRY_DELAY = timedelta(minutes=15)
+# (часове до мача, максимална възраст на odds)
+PIPELINE_ODDS_MAX_AGE = [
+    (3, timedelta(minutes=30)),
+    (12, timedelta(hours=2)),
+    (PIPELINE_HORIZON_HOURS, timedelta(hours=6))
+]
+
+# История на коефициентите: пазят се само промените; след 2 дни - по една точка на час
+ODDS_HISTORY_MARKETS = ['Match Winner', 'Goals Over/Under', 'Both Teams Score']
+ODDS_HISTORY_DOWNSAMPLE_AFTER = timedelta(days=2)
+ODDS_HISTORY_BUCKET = timedelta(hours=1)
+ODDS_HISTORY_RETENTION = timedelta(days=int(os.getenv('ODDS_HISTORY_DAYS', 90)))
+# Опции, чийто коефициент е нараснал с повече от ODDS_DRIFT_LIMIT за прозореца, отпадат
+ODDS_DRIFT_WINDOW = timedelta(hours=6)
+ODDS_DRIFT_LIMIT = float(os.getenv('ODDS_DRIFT_LIMIT', 0.15))
+
+# Калибрация на увереността (виж calibrate.py); без файл се ползват суровите проценти
+CALIBRATION_PATH = os.getenv('CALIBRATION_PATH', 'calibration.json')
+# С калибрация залагаме само на комбинации с очаквана стойност поне толкова
+CALIBRATION_MIN_EV = float(os.getenv('CALIBRATION_MIN_EV', 0.0))
+CALIBRATION_MAX_CANDIDATES = 50
+
+FINISHED_STATUSES = ['FT', 'AET', 'PEN']
+# Отменени, прекратени и служебно присъдени мачове - при букмейкърите мачът се анулира (коеф. 1)
+VOID_STATUSES = ['CANC', 'ABD', 'AWD', 'WO']
+POSTPONED_STATUSES = ['PST']
+LIVE_STATUSES = ['1H', 'HT', '2H', 'ET', 'BT', 'P', 'LIVE', 'INT']
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -34,15 +171,141 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class Metrics:
+    """Минимален registry в Prometheus текстов формат: counters, gauges и histograms с етикети"""
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}  # име -> (тип, описание)
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._values: Dict[str, Dict[Tuple, float]] = {}
+        # histogram: етикети -> [брой по bucket (без кумулиране)..., +Inf, сума]
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}
+    
+    def describe(self, name: str, kind: str, help_text: str,
+                 buckets: Optional[Tuple[float, ...]] = None):
+        self._meta[name] = (kind, help_text)
+        if kind == 'histogram':
+            self._buckets[name] = buckets or self.DEFAULT_BUCKETS
+            self._histograms[name] = {}
+        else:
+            self._values[name] = {}
+    
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0.0) + value
+    
+    def set(self, name: str, value: float, **labels):
+        self._values[name][tuple(sorted(labels.items()))] = float(value)
+    
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._buckets[name]
+        with self._lock:
+            counts = self._histograms[name].get(key)
+            if counts is None:
+                counts = self._histograms[name][key] = [0.0] * (len(buckets) + 2)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+    
+    @contextmanager
+    def time(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    @staticmethod
+    def _labels(key: Tuple, le: Optional[str] = None) -> str:
+        pairs = list(key) if le is None else list(key) + [('le', le)]
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind != 'histogram':
+                    for key, value in self._values[name].items():
+                        lines.append(f"{name}{self._labels(key)} {value!r}")
+                    continue
+                
+                buckets = self._buckets[name]
+                for key, counts in self._histograms[name].items():
+                    cumulative = 0.0
+                    for bound, count in zip(buckets, counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels(key, f'{bound:g}')} {cumulative!r}")
+                    total = cumulative + counts[-2]
+                    lines.append(f"{name}_bucket{self._labels(key, '+Inf')} {total!r}")
+                    lines.append(f"{name}_sum{self._labels(key)} {counts[-1]!r}")
+                    lines.append(f"{name}_count{self._labels(key)} {total!r}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+METRICS.describe('api_request_seconds', 'histogram', 'API-Football request latency by endpoint')
+METRICS.describe('api_requests_total', 'counter',
+                 'API-Football requests sent, by endpoint and status (HTTP code, api_error, timeout, error)')
+METRICS.describe('api_quota_remaining', 'gauge', 'Requests left today according to the local rate limiter')
+METRICS.describe('api_quota_reported_remaining', 'gauge', 'Requests left today according to the API requests field')
+METRICS.describe('api_cache_hits_total', 'counter', 'API response cache hits')
+METRICS.describe('api_cache_misses_total', 'counter', 'API response cache misses')
+METRICS.describe('api_cache_hit_ratio', 'gauge', 'API response cache hit ratio')
+METRICS.describe('bet_search_seconds', 'histogram', 'Duration of a bet search',
+                 (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0))
+METRICS.describe('bet_search_shared_total', 'counter', 'Bet searches answered by a running search or the result cache')
+METRICS.describe('bet_options_evaluated_total', 'counter', 'Bet options passed to the combination search')
+METRICS.describe('bet_combinations_evaluated_total', 'counter', 'Partial and complete combinations scored')
+METRICS.describe('db_query_seconds', 'histogram', 'SQLite operation time by operation',
+                 (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+METRICS.describe('telegram_send_seconds', 'histogram', 'Telegram send latency by message kind')
+METRICS.describe('telegram_queue_size', 'gauge', 'Messages waiting in the Telegram outbox')
+METRICS.describe('telegram_updates_total', 'counter', 'Telegram updates received through the webhook')
+
 # Database Manager
 class DatabaseManager:
-    def __init__(self, db_path='bets.db'):
+    DAILY_STATS_SELECT = '''SELECT date,
+                                  COUNT(*),
+                                  SUM(result = 'won'),
+                                  SUM(result = 'lost'),
+                                  SUM(status = 'pending'),
+                                  SUM(amount),
+                                  COALESCE(SUM(profit), 0),
+                                  SUM(result = 'won') * 100.0 / COUNT(*)
+                           FROM bets'''
+    
+    def __init__(self, db_path=DB_PATH, readonly: bool = False):
         self.db_path = db_path
-        self.init_db()
+        self.autocommit = True
+        # Кеш на writer нишката за record_odds: (fixture, market, outcome) -> id и последна точка
+        self._series_ids: Dict[Tuple[int, str, str], int] = {}
+        self._last_odds: Dict[int, Optional[int]] = {}
+        # Една постоянна връзка за целия процес; sqlite3 кешира prepared statements
+        self.conn = sqlite3.connect(db_path, check_same_thread=False,
+                                    cached_statements=128)
+        self._configure()
+        if not readonly:
+            self.init_db()
+    
+    def _configure(self):
+        c = self.conn.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA temp_store=MEMORY")
+        c.execute("PRAGMA cache_size=-8000")  # ~8MB page cache
+        c.execute("PRAGMA busy_timeout=5000")
     
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.conn.cursor()
         
         # Таблица за залози
         c.execute('''CREATE TABLE IF NOT EXISTS bets
@@ -59,6 +322,10 @@ class DatabaseManager:
                       profit REAL,
                       timestamp TEXT)''')
         
+        # Профил на залога; добавя се и в по-старите бази - залозите им са на профила по подразбиране
+        if 'profile' not in {row[1] for row in c.execute("PRAGMA table_info(bets)")}:
+            c.execute(f"ALTER TABLE bets ADD COLUMN profile TEXT DEFAULT '{DEFAULT_PROFILE}'")
+        
         # Таблица за статистики
         c.execute('''CREATE TABLE IF NOT EXISTS daily_stats
                      (date TEXT PRIMARY KEY,
@@ -70,74 +337,344 @@ class DatabaseManager:
                       total_profit REAL,
                       success_rate REAL)''')
         
-        conn.commit()
-        conn.close()
+        # Последен изпълнен слот на всяка cron задача (Scheduler)
+        c.execute('''CREATE TABLE IF NOT EXISTS scheduler_state
+                     (job TEXT PRIMARY KEY,
+                      last_run TEXT)''')
+        
+        # История на коефициентите: серия = мач/пазар/изход, точки в минути и стотни
+        c.execute('''CREATE TABLE IF NOT EXISTS odds_series
+                     (id INTEGER PRIMARY KEY,
+                      fixture_id INTEGER,
+                      market TEXT,
+                      outcome TEXT,
+                      kickoff INTEGER,
+                      UNIQUE (fixture_id, market, outcome))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS odds_samples
+                     (series_id INTEGER,
+                      ts INTEGER,
+                      odd INTEGER,
+                      PRIMARY KEY (series_id, ts)) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_odds_series_kickoff ON odds_series(kickoff)")
+        
+        # Неизпратени Telegram съобщения - оцеляват рестарт
+        c.execute('''CREATE TABLE IF NOT EXISTS outbox
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      chat_id TEXT,
+                      kind TEXT,
+                      text TEXT,
+                      created TEXT,
+                      attempts INTEGER DEFAULT 0,
+                      next_attempt REAL DEFAULT 0)''')
+        
+        # Персистентен кеш на API отговорите (ResponseCache)
+        c.execute('''CREATE TABLE IF NOT EXISTS api_cache
+                     (key TEXT PRIMARY KEY,
+                      expires REAL,
+                      data TEXT)''')
+        
+        # Индекси за get_pending_bets и get_daily_stats
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bets_status ON bets(status)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bets_date ON bets(date)")
+        
+        # daily_stats е материализиран изглед - възстановяваме го от bets при старт
+        c.execute(f"INSERT OR REPLACE INTO daily_stats {self.DAILY_STATS_SELECT} GROUP BY date")
+        
+        self.conn.commit()
         logger.info("Database initialized")
     
+    def close(self):
+        self.conn.close()
+    
+    def _commit(self):
+        # AsyncDatabase изключва autocommit и прави групови commit-и
+        if self.autocommit:
+            self.conn.commit()
+    
     def save_bet(self, bet_data: Dict):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.conn.cursor()
         
         c.execute('''INSERT INTO bets 
                      (bet_number, date, amount, odd, potential_win, bet_type, 
-                      fixtures, status, timestamp)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      fixtures, status, timestamp, profile)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                   (bet_data['bet_number'], bet_data['date'], bet_data['amount'],
                    bet_data['odd'], bet_data['potential_win'], bet_data['bet_type'],
                    json.dumps(bet_data['fixtures']), 'pending',
-                   datetime.now(BG_TZ).isoformat()))
+                   datetime.now(BG_TZ).isoformat(), bet_data.get('profile', DEFAULT_PROFILE)))
+        self._refresh_daily_stats(bet_data['date'])
         
-        conn.commit()
-        conn.close()
+        self._commit()
     
     def update_bet_result(self, bet_id: int, result: str, profit: float):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.conn.cursor()
         
         c.execute('''UPDATE bets SET result = ?, profit = ?, status = 'completed'
                      WHERE id = ?''', (result, profit, bet_id))
         
-        conn.commit()
-        conn.close()
+        c.execute("SELECT date FROM bets WHERE id = ?", (bet_id,))
+        row = c.fetchone()
+        if row:
+            self._refresh_daily_stats(row[0])
+        
+        self._commit()
+    
+    def _refresh_daily_stats(self, date: str):
+        """Преизчислява реда в daily_stats само за дадената дата (по индекса на date)"""
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO daily_stats {self.DAILY_STATS_SELECT} "
+            f"WHERE date = ? GROUP BY date", (date,)
+        )
     
     def get_pending_bets(self) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self.conn.cursor()
         
-        c.execute("SELECT * FROM bets WHERE status = 'pending'")
-        rows = c.fetchall()
+        c.execute('''SELECT id, bet_number, fixtures, amount, odd, profile
+                     FROM bets WHERE status = 'pending' ''')
         
         bets = []
-        for row in rows:
+        for row in c.fetchall():
             bets.append({
                 'id': row[0],
                 'bet_number': row[1],
-                'fixtures': json.loads(row[7]),
+                'fixtures': json.loads(row[2]),
                 'amount': row[3],
-                'odd': row[4]
+                'odd': row[4],
+                'profile': row[5]
             })
         
-        conn.close()
         return bets
     
-    def get_daily_stats(self, date: str) -> Dict:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+    def get_daily_fixture_ids(self, date: str, profile: Optional[str] = None) -> List[int]:
+        """Мачовете от залозите за деня; с profile - само от неговите залози"""
+        c = self.conn.cursor()
+        c.execute("SELECT fixtures FROM bets WHERE date = ? AND profile = COALESCE(?, profile)",
+                  (date, profile))
+        return [f['fixture_id'] for row in c.fetchall() for f in json.loads(row[0])]
+    
+    def get_job_runs(self) -> Dict[str, str]:
+        c = self.conn.cursor()
+        c.execute("SELECT job, last_run FROM scheduler_state")
+        return dict(c.fetchall())
+    
+    def set_job_run(self, job: str, last_run: str):
+        self.conn.execute("INSERT OR REPLACE INTO scheduler_state (job, last_run) VALUES (?, ?)",
+                          (job, last_run))
+        self._commit()
+    
+    def get_settled_legs(self) -> List[Tuple[str, List[Dict]]]:
+        """(резултат, мачове) на приключилите залози - за калибрацията"""
+        c = self.conn.cursor()
+        c.execute("SELECT result, fixtures FROM bets WHERE status = 'completed'")
+        return [(result, json.loads(fixtures)) for result, fixtures in c.fetchall()]
+    
+    def get_settled_bets(self) -> List[Tuple[float, str]]:
+        """(коефициент, резултат) на всички приключили залози - за калибриране на симулации"""
+        c = self.conn.cursor()
+        c.execute("SELECT odd, result FROM bets WHERE status = 'completed'")
+        return c.fetchall()
+    
+    def record_odds(self, fixture_id: int, kickoff: int, ts: int,
+                    samples: List[Tuple[str, str, float]]):
+        """Записва (market, outcome, odd) точките, които се различават от последната в серията"""
+        c = self.conn.cursor()
+        minute = ts // 60
         
-        c.execute("SELECT * FROM bets WHERE date = ?", (date,))
-        bets = c.fetchall()
+        for market, outcome, odd in samples:
+            key = (fixture_id, market, outcome)
+            series_id = self._series_ids.get(key)
+            if series_id is None:
+                c.execute('''INSERT OR IGNORE INTO odds_series (fixture_id, market, outcome, kickoff)
+                             VALUES (?, ?, ?, ?)''', (fixture_id, market, outcome, kickoff // 60))
+                c.execute('''SELECT id FROM odds_series
+                             WHERE fixture_id = ? AND market = ? AND outcome = ?''', key)
+                series_id = self._series_ids[key] = c.fetchone()[0]
+                c.execute("SELECT odd FROM odds_samples WHERE series_id = ? ORDER BY ts DESC LIMIT 1",
+                          (series_id,))
+                last = c.fetchone()
+                self._last_odds[series_id] = last[0] if last else None
+            
+            value = round(odd * 100)
+            if self._last_odds.get(series_id) == value:
+                continue
+            c.execute("INSERT OR REPLACE INTO odds_samples (series_id, ts, odd) VALUES (?, ?, ?)",
+                      (series_id, minute, value))
+            self._last_odds[series_id] = value
         
-        total_bets = len(bets)
-        won_bets = sum(1 for b in bets if b[9] == 'won')
-        lost_bets = sum(1 for b in bets if b[9] == 'lost')
-        pending_bets = sum(1 for b in bets if b[8] == 'pending')
+        self._commit()
+    
+    def compact_odds_history(self, now: int) -> Tuple[int, int]:
+        """Downsampling на старите точки и изтриване на мачовете извън retention периода"""
+        c = self.conn.cursor()
+        minute = now // 60
+        cutoff = minute - int(ODDS_HISTORY_DOWNSAMPLE_AFTER.total_seconds()) // 60
+        bucket = int(ODDS_HISTORY_BUCKET.total_seconds()) // 60
         
-        total_staked = sum(b[3] for b in bets)
-        total_profit = sum(b[10] if b[10] else 0 for b in bets)
+        # Последната точка във всеки bucket + първата (opening) на серията остават
+        c.execute('''DELETE FROM odds_samples
+                     WHERE ts < ? AND (series_id, ts) NOT IN (
+                         SELECT series_id, MAX(ts) FROM odds_samples
+                         WHERE ts < ? GROUP BY series_id, ts / ?
+                         UNION
+                         SELECT series_id, MIN(ts) FROM odds_samples GROUP BY series_id)''',
+                  (cutoff, cutoff, bucket))
+        downsampled = c.rowcount
         
-        success_rate = (won_bets / total_bets * 100) if total_bets > 0 else 0
+        expired = minute - int(ODDS_HISTORY_RETENTION.total_seconds()) // 60
+        c.execute('''DELETE FROM odds_samples WHERE series_id IN
+                     (SELECT id FROM odds_series WHERE kickoff < ?)''', (expired,))
+        removed = c.rowcount
+        c.execute("DELETE FROM odds_series WHERE kickoff < ?", (expired,))
+        if c.rowcount:
+            self._series_ids.clear()
+            self._last_odds.clear()
+        
+        self._commit()
+        return downsampled, removed
+    
+    def get_odds_series(self, fixture_id: int, market: str, outcome: str) -> List[Tuple[int, float]]:
+        """(unix време, коефициент) на една серия по реда на записване"""
+        c = self.conn.cursor()
+        c.execute('''SELECT s.ts, s.odd FROM odds_series r
+                     JOIN odds_samples s ON s.series_id = r.id
+                     WHERE r.fixture_id = ? AND r.market = ? AND r.outcome = ?
+                     ORDER BY s.ts''', (fixture_id, market, outcome))
+        return [(ts * 60, odd / 100) for ts, odd in c.fetchall()]
+    
+    def get_odds_drift(self, fixture_ids: List[int], since: int) -> Dict[Tuple[int, str, str], float]:
+        """Относителна промяна от коефициента към since до последния (> 0 = коефициентът расте)"""
+        if not fixture_ids:
+            return {}
+        c = self.conn.cursor()
+        c.execute(f'''SELECT r.fixture_id, r.market, r.outcome, s.ts, s.odd FROM odds_series r
+                      JOIN odds_samples s ON s.series_id = r.id
+                      WHERE r.fixture_id IN ({','.join('?' * len(fixture_ids))})
+                      ORDER BY r.id, s.ts''', list(fixture_ids))
+        
+        since_minute = since // 60
+        base, last = {}, {}
+        for fixture_id, market, outcome, ts, odd in c.fetchall():
+            key = (fixture_id, market, outcome)
+            # Без точка преди since сравняваме с първата
+            if key not in base or ts <= since_minute:
+                base[key] = odd
+            last[key] = odd
+        return {key: last[key] / base[key] - 1 for key in last}
+    
+    def get_closing_odds(self, fixture_id: int) -> Dict[Tuple[str, str], float]:
+        """Последният коефициент преди началото на мача за всеки пазар/изход"""
+        c = self.conn.cursor()
+        c.execute('''SELECT r.market, r.outcome, s.odd FROM odds_series r
+                     JOIN odds_samples s ON s.series_id = r.id
+                     WHERE r.fixture_id = ? AND s.ts = (
+                         SELECT MAX(ts) FROM odds_samples WHERE series_id = r.id AND ts <= r.kickoff)''',
+                  (fixture_id,))
+        return {(market, outcome): odd / 100 for market, outcome, odd in c.fetchall()}
+    
+    def get_bet_clv(self, bet_id: int) -> Optional[float]:
+        """Closing-line value: коефициентът на залога спрямо closing коефициентите на мачовете"""
+        c = self.conn.cursor()
+        c.execute("SELECT odd, fixtures FROM bets WHERE id = ?", (bet_id,))
+        row = c.fetchone()
+        if row is None:
+            return None
         
-        conn.close()
+        closing = 1.0
+        for leg in json.loads(row[1]):
+            if 'market' not in leg:
+                return None  # стари залози без пазар
+            odd = self.get_closing_odds(leg['fixture_id']).get((leg['market'], leg['outcome']))
+            if odd is None:
+                return None
+            closing *= odd
+        return row[0] / closing - 1
+    
+    def enqueue_messages(self, messages: List[Tuple[str, str, str]]):
+        """(chat_id, kind, text) в изходящата опашка, в този ред"""
+        created = datetime.now(BG_TZ).isoformat()
+        self.conn.executemany(
+            "INSERT INTO outbox (chat_id, kind, text, created) VALUES (?, ?, ?, ?)",
+            [(chat_id, kind, text, created) for chat_id, kind, text in messages]
+        )
+        self._commit()
+    
+    def get_outbox(self) -> List[Dict]:
+        c = self.conn.cursor()
+        c.execute("SELECT id, chat_id, kind, text, attempts, next_attempt FROM outbox ORDER BY id")
+        return [{'id': row[0], 'chat_id': row[1], 'kind': row[2], 'text': row[3],
+                 'attempts': row[4], 'next_attempt': row[5]} for row in c.fetchall()]
+    
+    def delete_messages(self, ids: List[int]):
+        self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self._commit()
+    
+    def defer_messages(self, ids: List[int], attempts: int, next_attempt: float):
+        self.conn.executemany("UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                              [(attempts, next_attempt, i) for i in ids])
+        self._commit()
+    
+    def load_api_cache(self, now: float, limit: int) -> List[Tuple[str, float, str]]:
+        """Изтрива изтеклите записи и връща до limit от останалите, най-новите първи"""
+        self.conn.execute("DELETE FROM api_cache WHERE expires < ?", (now,))
+        self._commit()
+        return self.conn.execute(
+            "SELECT key, expires, data FROM api_cache ORDER BY expires DESC LIMIT ?", (limit,)
+        ).fetchall()
+    
+    def save_api_cache(self, key: str, expires: float, data: Dict):
+        self.conn.execute("INSERT OR REPLACE INTO api_cache (key, expires, data) VALUES (?, ?, ?)",
+                          (key, expires, json.dumps(data)))
+        self._commit()
+    
+    def get_daily_stats(self, date: str, profile: Optional[str] = None) -> Dict:
+        """Общо от daily_stats; за един профил - направо от залозите за деня (по индекса на date)"""
+        c = self.conn.cursor()
+        
+        if profile is None:
+            c.execute('''SELECT total_bets, won_bets, lost_bets, pending_bets,
+                                total_staked, total_profit
+                         FROM daily_stats WHERE date = ?''', (date,))
+        else:
+            c.execute('''SELECT COUNT(*), SUM(result = 'won'), SUM(result = 'lost'),
+                                SUM(status = 'pending'), SUM(amount), SUM(profit)
+                         FROM bets WHERE date = ? AND profile = ?''', (date, profile))
+        
+        return self._stats_dict(c.fetchone())
+    
+    def get_stats_range(self, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None) -> Dict:
+        """Сумира daily_stats за периода (включително); None = без граница"""
+        c = self.conn.cursor()
+        
+        c.execute('''SELECT SUM(total_bets), SUM(won_bets), SUM(lost_bets), SUM(pending_bets),
+                            SUM(total_staked), SUM(total_profit)
+                     FROM daily_stats
+                     WHERE date >= COALESCE(?, date) AND date <= COALESCE(?, date)''',
+                  (start_date, end_date))
+        
+        return self._stats_dict(c.fetchone())
+    
+    def get_weekly_stats(self, date: str) -> Dict:
+        """Статистики за седмицата (понеделник - неделя), в която е date"""
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+        start = day - timedelta(days=day.weekday())
+        return self.get_stats_range(str(start), str(start + timedelta(days=6)))
+    
+    def get_monthly_stats(self, date: str) -> Dict:
+        month = date[:7]
+        return self.get_stats_range(f"{month}-01", f"{month}-31")
+    
+    def get_all_time_stats(self) -> Dict:
+        return self.get_stats_range()
+    
+    @staticmethod
+    def _stats_dict(row: Optional[Tuple]) -> Dict:
+        if row is None:
+            row = (0, 0, 0, 0, 0.0, 0.0)
+        total_bets, won_bets, lost_bets, pending_bets, total_staked, total_profit = \
+            [value or 0 for value in row]
+        
+        success_rate = (won_bets / total_bets * 100) if total_bets > 0 else 0
         
         return {
             'total_bets': total_bets,
@@ -149,49 +686,777 @@ class DatabaseManager:
             'success_rate': success_rate
         }
 
+class AsyncDatabase:
+    """Async фасада над DatabaseManager: записите минават през една writer нишка
+    с групови commit-и, четенията - през writer-а или отделни reader нишки"""
+    
+    def __init__(self, db: DatabaseManager, readers: int = DB_READER_THREADS):
+        self.db = db
+        self.db.autocommit = False
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+        self._writer.start()
+        
+        self._reader_local = threading.local()
+        self._readers = None
+        if readers > 0:
+            self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+    
+    def _writer_loop(self):
+        waiting = []  # (loop, future, result) чакащи следващия commit
+        
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._flush(waiting)
+                break
+            
+            fn, args, loop, future, is_write = job
+            started = time.perf_counter()
+            try:
+                result = fn(*args)
+                error = None
+            except Exception as e:
+                result, error = None, e
+            METRICS.observe('db_query_seconds', time.perf_counter() - started, op=fn.__name__)
+            
+            if error is not None and future is None:
+                logger.error(f"DB background write error: {error}")
+            elif is_write and error is None:
+                waiting.append((loop, future, result))
+            elif future is not None:
+                loop.call_soon_threadsafe(self._resolve, future, result, error)
+            
+            # Group commit: при натоварване записваме на партиди, иначе веднага
+            if waiting and (len(waiting) >= DB_COMMIT_BATCH or self._queue.empty()):
+                self._flush(waiting)
+                waiting = []
+    
+    def _flush(self, waiting: List):
+        error = None
+        try:
+            with METRICS.time('db_query_seconds', op='commit'):
+                self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"DB commit error: {e}")
+            error = e
+        
+        for loop, future, result in waiting:
+            if future is not None:
+                loop.call_soon_threadsafe(self._resolve, future, result, error)
+    
+    @staticmethod
+    def _resolve(future: asyncio.Future, result, error: Optional[Exception]):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def _reader_db(self) -> DatabaseManager:
+        if not hasattr(self._reader_local, 'db'):
+            self._reader_local.db = DatabaseManager(self.db.db_path, readonly=True)
+        return self._reader_local.db
+    
+    def _timed_read(self, method_name: str, args: Tuple):
+        with METRICS.time('db_query_seconds', op=method_name):
+            return getattr(self._reader_db(), method_name)(*args)
+    
+    async def _write(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, args, loop, future, True))
+        return await future
+    
+    def write_nowait(self, fn, *args):
+        """Запис без изчакване (напр. кеш), грешките само се логват"""
+        self._queue.put((fn, args, None, None, True))
+    
+    async def _read(self, method_name: str, *args):
+        loop = asyncio.get_running_loop()
+        if self._readers is not None:
+            return await loop.run_in_executor(self._readers, self._timed_read, method_name, args)
+        
+        future = loop.create_future()
+        self._queue.put((getattr(self.db, method_name), args, loop, future, False))
+        return await future
+    
+    async def save_bet(self, bet_data: Dict):
+        return await self._write(self.db.save_bet, bet_data)
+    
+    async def update_bet_result(self, bet_id: int, result: str, profit: float):
+        return await self._write(self.db.update_bet_result, bet_id, result, profit)
+    
+    async def get_pending_bets(self) -> List[Dict]:
+        return await self._read('get_pending_bets')
+    
+    async def get_daily_stats(self, date: str, profile: Optional[str] = None) -> Dict:
+        return await self._read('get_daily_stats', date, profile)
+    
+    async def get_daily_fixture_ids(self, date: str, profile: Optional[str] = None) -> List[int]:
+        return await self._read('get_daily_fixture_ids', date, profile)
+    
+    async def get_job_runs(self) -> Dict[str, str]:
+        return await self._read('get_job_runs')
+    
+    async def set_job_run(self, job: str, last_run: str):
+        return await self._write(self.db.set_job_run, job, last_run)
+    
+    async def record_odds(self, fixture_id: int, kickoff: int, ts: int,
+                          samples: List[Tuple[str, str, float]]):
+        return await self._write(self.db.record_odds, fixture_id, kickoff, ts, samples)
+    
+    async def compact_odds_history(self, now: int) -> Tuple[int, int]:
+        return await self._write(self.db.compact_odds_history, now)
+    
+    async def get_odds_series(self, fixture_id: int, market: str, outcome: str) -> List[Tuple[int, float]]:
+        return await self._read('get_odds_series', fixture_id, market, outcome)
+    
+    async def get_odds_drift(self, fixture_ids: List[int], since: int) -> Dict[Tuple[int, str, str], float]:
+        return await self._read('get_odds_drift', fixture_ids, since)
+    
+    async def get_closing_odds(self, fixture_id: int) -> Dict[Tuple[str, str], float]:
+        return await self._read('get_closing_odds', fixture_id)
+    
+    async def get_bet_clv(self, bet_id: int) -> Optional[float]:
+        return await self._read('get_bet_clv', bet_id)
+    
+    async def enqueue_messages(self, messages: List[Tuple[str, str, str]]):
+        return await self._write(self.db.enqueue_messages, messages)
+    
+    async def get_outbox(self) -> List[Dict]:
+        return await self._read('get_outbox')
+    
+    async def delete_messages(self, ids: List[int]):
+        return await self._write(self.db.delete_messages, ids)
+    
+    async def defer_messages(self, ids: List[int], attempts: int, next_attempt: float):
+        return await self._write(self.db.defer_messages, ids, attempts, next_attempt)
+    
+    async def get_stats_range(self, start_date: Optional[str] = None,
+                              end_date: Optional[str] = None) -> Dict:
+        return await self._read('get_stats_range', start_date, end_date)
+    
+    async def get_weekly_stats(self, date: str) -> Dict:
+        return await self._read('get_weekly_stats', date)
+    
+    async def get_monthly_stats(self, date: str) -> Dict:
+        return await self._read('get_monthly_stats', date)
+    
+    async def get_all_time_stats(self) -> Dict:
+        return await self._read('get_all_time_stats')
+    
+    async def load_api_cache(self, now: float, limit: int) -> List[Tuple[str, float, str]]:
+        return await self._write(self.db.load_api_cache, now, limit)
+    
+    async def close(self):
+        self._queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+        self.db.close()
+
+class RateLimiter:
+    """Token bucket за API-Football: лимит на минута + дневна квота"""
+    
+    def __init__(self, per_minute: int = API_REQUESTS_PER_MINUTE,
+                 per_day: int = API_REQUESTS_PER_DAY):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.tokens = float(per_minute)
+        self.used_today = 0
+        self._day = datetime.now(pytz.utc).date()
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute,
+                          self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+    
+    def _roll_day(self):
+        # Квотата на api-sports се нулира в 00:00 UTC
+        today = datetime.now(pytz.utc).date()
+        if today != self._day:
+            self._day = today
+            self.used_today = 0
+    
+    def remaining_today(self) -> int:
+        self._roll_day()
+        return max(0, self.per_day - self.used_today)
+    
+    async def acquire(self) -> bool:
+        """Изчаква свободен token; връща False ако дневната квота е изчерпана"""
+        async with self._lock:
+            if self.remaining_today() <= 0:
+                return False
+            
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) * 60 / self.per_minute)
+                self._refill()
+            
+            self.tokens -= 1
+            self.used_today += 1
+            return True
+    
+    def throttle(self):
+        """API-то върна rateLimit грешка - изпразваме bucket-а"""
+        self._refill()
+        self.tokens = 0
+    
+    def update_from_headers(self, headers):
+        """Синхронизира броячите с x-ratelimit-* headers от отговора"""
+        try:
+            if 'x-ratelimit-requests-limit' in headers:
+                self.per_day = int(headers['x-ratelimit-requests-limit'])
+            if 'x-ratelimit-requests-remaining' in headers:
+                remaining = int(headers['x-ratelimit-requests-remaining'])
+                self.used_today = max(0, self.per_day - remaining)
+            if 'X-RateLimit-Remaining' in headers:
+                self._refill()
+                self.tokens = min(self.tokens, float(headers['X-RateLimit-Remaining']))
+        except (ValueError, TypeError) as e:
+            logger.debug(f"Bad rate limit headers: {e}")
+
+class ResponseCache:
+    """LRU кеш на API отговорите с отделен TTL за всеки endpoint"""
+    
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES,
+                 db: Optional[AsyncDatabase] = None):
+        self.max_entries = max_entries
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+    
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> str:
+        return endpoint + '?' + '&'.join(f"{k}={params[k]}" for k in sorted(params))
+    
+    def ttl_for(self, endpoint: str, params: Dict, data: Dict) -> float:
+        if endpoint == 'predictions':
+            return CACHE_TTL_PREDICTIONS
+        if endpoint == 'odds':
+            return CACHE_TTL_ODDS
+        if endpoint == 'fixtures':
+            if 'date' in params:
+                # До следващото планирано опресняване - повторните заявки между тях са от кеша
+                return max(CACHE_TTL_FIXTURES, PIPELINE_FIXTURES_REFRESH.total_seconds() - 60)
+            
+            # Отделни мачове: завършените не се променят, live-ите - постоянно
+            statuses = [f['fixture']['status']['short'] for f in data.get('response', [])]
+            if statuses and all(s in FINISHED_STATUSES for s in statuses):
+                return CACHE_TTL_FINISHED
+            if any(s in LIVE_STATUSES for s in statuses):
+                return CACHE_TTL_LIVE
+            return CACHE_TTL_FIXTURES
+        return 0
+    
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def contains(self, key: str) -> bool:
+        """Проверка без да променя броячите и LRU реда"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] >= time.time()
+    
+    def set(self, key: str, data: Dict, ttl: float):
+        if ttl <= 0:
+            return
+        
+        expires = time.time() + ttl
+        self._entries[key] = (expires, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        
+        if self.db is not None:
+            self.db.write_nowait(self.db.db.save_api_cache, key, expires, data)
+    
+    def warm(self, records: Iterator[Dict]) -> int:
+        """Възстановява кеша от ApiRecordStore записи, които още не са изтекли"""
+        now = time.time()
+        warmed = 0
+        for record in records:
+            key = self.make_key(record['e'], record['p'])
+            expires = record['t'] + self.ttl_for(record['e'], record['p'], record['d'])
+            if expires > now and not self.contains(key):
+                self._entries[key] = (expires, record['d'])
+                self._entries.move_to_end(key)
+                warmed += 1
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return warmed
+    
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total > 0 else 0
+        }
+    
+    async def load(self):
+        """Зарежда валидните записи след рестарт, за да не харчим квота отново.
+        SQL-ът минава през writer нишката на AsyncDatabase."""
+        if self.db is None:
+            return
+        try:
+            rows = await self.db.load_api_cache(time.time(), self.max_entries)
+            for key, expires, data in reversed(rows):
+                self._entries[key] = (expires, json.loads(data))
+            logger.info(f"API cache loaded {len(rows)} entries from {self.db.db.db_path}")
+        except Exception as e:
+            logger.error(f"Cache load error: {e}")
+
+class ApiRecordStore:
+    """Append-only запис на API отговорите в gzip-нати JSON Lines сегменти (по един на ден).
+    
+    В record режим FootballAPI добавя всеки успешен отговор, в replay режим
+    обслужва заявките само от тук - последния отговор за същия endpoint + params.
+    """
+    
+    def __init__(self, directory: str = API_RECORD_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._segment = None
+        self._index: Optional[Dict[str, List[Tuple[float, Dict]]]] = None
+    
+    def _segment_path(self, day: str) -> str:
+        return os.path.join(self.directory, f"api-{day}.jsonl.gz")
+    
+    def append(self, endpoint: str, params: Dict, data: Dict):
+        now = time.time()
+        day = datetime.fromtimestamp(now, pytz.utc).strftime('%Y%m%d')
+        try:
+            if day != self._segment:
+                self.close()
+                self._file = gzip.open(self._segment_path(day), 'at', encoding='utf-8')
+                self._segment = day
+            
+            record = {'t': round(now, 3), 'e': endpoint, 'p': params, 'd': data}
+            self._file.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n')
+            self._file.flush()  # sync flush - записът е четим дори при срив
+            
+            if self._index is not None:
+                self._index.setdefault(ResponseCache.make_key(endpoint, params), []).append((now, data))
+        except Exception as e:
+            logger.error(f"Record store write error: {e}")
+    
+    def records(self) -> Iterator[Dict]:
+        """Всички записи по реда на записване"""
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('api-') and name.endswith('.jsonl.gz')):
+                continue
+            try:
+                with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        yield json.loads(line)
+            except (EOFError, OSError, json.JSONDecodeError) as e:
+                # Недописан последен ред/член след срив - пропускаме остатъка
+                logger.warning(f"Truncated record segment {name}: {e}")
+    
+    def _build_index(self):
+        self._index = {}
+        for record in self.records():
+            key = ResponseCache.make_key(record['e'], record['p'])
+            self._index.setdefault(key, []).append((record['t'], record['d']))
+        logger.info(f"Record store indexed {len(self._index)} keys from {self.directory}")
+    
+    def lookup(self, endpoint: str, params: Dict, at: Optional[float] = None) -> Optional[Dict]:
+        """Последният отговор за endpoint + params (записан не по-късно от at)"""
+        if self._index is None:
+            self._build_index()
+        
+        entries = self._index.get(ResponseCache.make_key(endpoint, params), [])
+        for recorded_at, data in reversed(entries):
+            if at is None or recorded_at <= at:
+                return data
+        return None
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._segment = None
+
+class StreamingJsonParser:
+    """Инкрементален парсер на JSON обект: елементите на масива array_key минават през
+    item_filter един по един, без целият отговор да се материализира в паметта"""
+    
+    NUMBER_CHARS = frozenset('0123456789+-.eE')
+    
+    def __init__(self, array_key: str = 'response',
+                 item_filter: Optional[Callable[[Dict], Optional[Dict]]] = None):
+        self.array_key = array_key
+        self.item_filter = item_filter
+        self.result: Dict = {}
+        self._items: List = []
+        self._key: Optional[str] = None
+        self._state = 'start'
+        self._buf = ''
+        self._pos = 0
+        self._chunks: List[str] = []
+        self._chunks_len = 0
+        # След непълна стойност чакаме поне двойно повече данни - линейно време и при малки парчета
+        self._retry_at = 0
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+    
+    def feed(self, chunk: bytes):
+        text = self._utf8.decode(chunk)
+        self._chunks.append(text)
+        self._chunks_len += len(text)
+        if len(self._buf) - self._pos + self._chunks_len >= self._retry_at:
+            self._join()
+            self._parse(final=False)
+    
+    def close(self) -> Dict:
+        self._feed_final()
+        if self._state != 'done':
+            raise ValueError(f"Truncated JSON (state {self._state})")
+        return self.result
+    
+    def _feed_final(self):
+        self._chunks.append(self._utf8.decode(b'', final=True))
+        self._join()
+        self._parse(final=True)
+    
+    def _join(self):
+        self._buf = self._buf[self._pos:] + ''.join(self._chunks)
+        self._pos = 0
+        self._chunks = []
+        self._chunks_len = 0
+    
+    def _peek(self) -> Optional[str]:
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        self._pos = pos
+        return buf[pos] if pos < len(buf) else None
+    
+    def _expect(self, char: str):
+        if self._buf[self._pos] != char:
+            raise ValueError(f"Expected {char!r} at {self._pos}, got {self._buf[self._pos]!r}")
+        self._pos += 1
+    
+    def _decode(self, final: bool):
+        """Следващата JSON стойност или None ако буферът още не я съдържа цялата"""
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            self._retry_at = 2 * (len(self._buf) - self._pos)
+            return None
+        # Число може да продължава в следващото парче (и след '.' или 'e') - приемаме го
+        # само ако след него вече има символ, който не може да е част от число
+        if (not final and isinstance(value, (int, float)) and not isinstance(value, bool)
+                and (end == len(self._buf) or self._buf[end] in self.NUMBER_CHARS)):
+            self._retry_at = 2 * (len(self._buf) - self._pos)
+            return None
+        self._pos = end
+        self._retry_at = 0
+        return (value,)
+    
+    def _parse(self, final: bool):
+        while self._state != 'done':
+            char = self._peek()
+            if char is None:
+                return
+            state = self._state
+            
+            if state == 'start':
+                self._expect('{')
+                self._state = 'key'
+            elif state == 'key':
+                if char == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                    continue
+                decoded = self._decode(final)
+                if decoded is None:
+                    return
+                self._key = decoded[0]
+                self._state = 'colon'
+            elif state == 'colon':
+                self._expect(':')
+                self._state = 'array' if self._key == self.array_key else 'value'
+            elif state == 'array':
+                if char != '[':
+                    self._state = 'value'  # напр. грешка с обект вместо масив
+                    continue
+                self._pos += 1
+                self._items = []
+                self._state = 'item'
+            elif state in ('item', 'item_sep'):
+                if char == ']':
+                    self._pos += 1
+                    self.result[self._key] = self._items
+                    self._state = 'sep'
+                    continue
+                if state == 'item_sep':
+                    self._expect(',')
+                    self._state = 'item'
+                    continue
+                decoded = self._decode(final)
+                if decoded is None:
+                    return
+                # None от филтъра изхвърля елемента; без филтър и null остава
+                item = decoded[0] if self.item_filter is None else self.item_filter(decoded[0])
+                if item is not None or self.item_filter is None:
+                    self._items.append(item)
+                self._state = 'item_sep'
+            elif state == 'value':
+                decoded = self._decode(final)
+                if decoded is None:
+                    return
+                self.result[self._key] = decoded[0]
+                self._state = 'sep'
+            elif state == 'sep':
+                self._pos += 1
+                if char == '}':
+                    self._state = 'done'
+                elif char == ',':
+                    self._state = 'key'
+                else:
+                    raise ValueError(f"Unexpected {char!r} at {self._pos - 1}")
+
 class FootballAPI:
     BASE_URL = "https://v3.football.api-sports.io"
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, connection_limit: int = API_CONNECTION_LIMIT,
+                 cache: Optional[ResponseCache] = None, mode: str = 'live',
+                 store: Optional[ApiRecordStore] = None,
+                 clock: Optional[Callable[[], datetime]] = None):
+        if mode not in ('live', 'record', 'replay'):
+            raise ValueError(f"Unknown API mode: {mode}")
+        if mode != 'live' and store is None:
+            raise ValueError(f"API mode '{mode}' needs a record store")
+        
         self.api_key = api_key
         self.headers = {'x-apisports-key': api_key}
+        self.connection_limit = connection_limit
+        self.limiter = RateLimiter()
+        self.cache = cache
+        self.mode = mode
+        self.store = store
+        # Часовник с BG време - по него се избират датите на списъците и записите в replay
+        self.clock = clock or (lambda: datetime.now(BG_TZ))
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def start(self):
+        """Отваря една обща сесия с pool от връзки (keep-alive + DNS кеш)"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit,
+            keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=API_DNS_CACHE_TTL,
+            enable_cleanup_closed=True
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+        logger.info(f"API session started (limit {self.connection_limit})")
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("API session closed")
+        self._session = None
+        if self.store is not None:
+            self.store.close()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    def is_cached(self, endpoint: str, params: Dict) -> bool:
+        return self.cache is not None and self.cache.contains(ResponseCache.make_key(endpoint, params))
+    
+    def fixture_cost(self, fixture_id: int) -> int:
+        """Колко реални заявки струва анализът на един мач (predictions + odds)"""
+        if self.mode == 'replay':
+            return 0
+        return (int(not self.is_cached('predictions', {'fixture': fixture_id})) +
+                int(not self.is_cached('odds', self._odds_params(fixture_id))))
+    
+    @staticmethod
+    def _odds_params(fixture_id: int) -> Dict:
+        # Без bookmaker - една заявка връща всички букмейкъри
+        return {'fixture': fixture_id}
+    
+    @staticmethod
+    def best_prices(odds_data: Dict) -> Dict[str, Dict[str, Tuple[float, str]]]:
+        """Индекс market -> outcome -> (най-добър коефициент, букмейкър) през всички букмейкъри"""
+        book: Dict[str, Dict[str, Tuple[float, str]]] = {}
+        for bookmaker in odds_data.get('bookmakers', []):
+            name = sys.intern(str(bookmaker.get('name', bookmaker.get('id', ''))))
+            for bet in bookmaker.get('bets', []):
+                market = book.setdefault(bet['name'], {})
+                for value in bet.get('values', []):
+                    try:
+                        odd = float(value['odd'])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    outcome = str(value['value'])
+                    if outcome not in market or odd > market[outcome][0]:
+                        market[outcome] = (odd, name)
+        return book
+    
+    @staticmethod
+    def _filter_response(data: Dict, item_filter: Callable[[Dict], Optional[Dict]]) -> Dict:
+        """Записан (пълен) отговор с 'response', минал през item_filter"""
+        return dict(data, response=[item for item in map(item_filter, data.get('response', []))
+                                    if item is not None])
     
-    async def get_live_fixtures(self) -> List[Dict]:
-        """Взима всички налични мачове (днес + утре)"""
+    async def _request(self, endpoint: str, params: Dict,
+                       item_filter: Optional[Callable[[Dict], Optional[Dict]]] = None) -> Optional[Dict]:
+        """Общ GET към API-Football през кеша и rate limiter-а.
+        
+        С item_filter отговорът се парсва поточно и в кеша влизат само елементите
+        на 'response', които филтърът връща. В record режим записът е на целия
+        отговор - от него backtest-ът взима и финалните резултати на мачовете.
+        """
+        if self.mode == 'replay':
+            data = self.store.lookup(endpoint, params, at=self.clock().timestamp())
+            if data is None:
+                logger.info(f"Replay miss: /{endpoint} {params}")
+            elif item_filter is not None:
+                data = self._filter_response(data, item_filter)
+            return data
+        
+        key = ResponseCache.make_key(endpoint, params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        if not await self.limiter.acquire():
+            logger.warning(f"⚠️ Daily API quota exhausted, skipping /{endpoint} {params}")
+            return None
+        
+        session = await self._get_session()
+        started = time.perf_counter()
+        status = 'error'  # изключение - мрежа или повреден отговор
+        try:
+            async with session.get(f"{self.BASE_URL}/{endpoint}", params=params) as response:
+                self.limiter.update_from_headers(response.headers)
+                
+                if response.status != 200:
+                    status = response.status
+                    error_text = await response.text()
+                    logger.error(f"API error {response.status}: {error_text}")
+                    return None
+                
+                if item_filter is None or self.mode == 'record':
+                    data = await response.json()
+                else:
+                    parser = StreamingJsonParser('response', item_filter)
+                    async for chunk in response.content.iter_chunked(API_STREAM_CHUNK):
+                        parser.feed(chunk)
+                    data = parser.close()
+            status = 'api_error' if data.get('errors') else response.status
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            METRICS.inc('api_requests_total', endpoint=endpoint, status=status)
+            METRICS.observe('api_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+        
+        # Квотата, която самото API отчита
+        quota = data.get('requests')
+        if isinstance(quota, dict) and 'current' in quota and 'limit_day' in quota:
+            METRICS.set('api_quota_reported_remaining', quota['limit_day'] - quota['current'])
+        
+        # Проверка за API errors
+        errors = data.get('errors')
+        if errors:
+            logger.error(f"API errors: {errors}")
+            if isinstance(errors, dict) and 'rateLimit' in errors:
+                self.limiter.throttle()
+        else:
+            if self.mode == 'record':
+                self.store.append(endpoint, params, data)
+                if item_filter is not None:
+                    data = self._filter_response(data, item_filter)
+            if self.cache is not None:
+                self.cache.set(key, data, self.cache.ttl_for(endpoint, params, data))
+        
+        return data
+    
+    @staticmethod
+    def _slim_upcoming_fixture(now: datetime) -> Callable[[Dict], Optional[Dict]]:
+        """Филтър за поточното парсване: само незапочнали мачове и само нужните полета"""
+        def slim(fixture: Dict) -> Optional[Dict]:
+            try:
+                info = fixture['fixture']
+                status = info['status']['short']
+                if status not in ['NS', 'TBD']:
+                    return None
+                if datetime.fromisoformat(info['date'].replace('Z', '+00:00')) <= now:
+                    return None
+                league = fixture.get('league', {})
+                return {
+                    'fixture': {'id': info['id'], 'date': info['date'], 'status': {'short': status}},
+                    'teams': {'home': {'name': fixture['teams']['home']['name']},
+                              'away': {'name': fixture['teams']['away']['name']}},
+                    'league': {'id': league.get('id', 0), 'name': league.get('name', '')}
+                }
+            except (KeyError, TypeError, ValueError):
+                return None
+        return slim
+    
+    async def get_live_fixtures(self, excluded_ids: Optional[List[int]] = None,
+                                days: Iterable[int] = (0, 1)) -> List[Dict]:
+        """Взима предстоящите мачове (по подразбиране днес + утре) в олекотен вид"""
         fixtures = []
+        excluded = set(excluded_ids or [])
+        now = self.clock()
+        slim = self._slim_upcoming_fixture(now)
         
-        for days_offset in [0, 1]:
-            date = (datetime.now(BG_TZ) + timedelta(days=days_offset)).strftime('%Y-%m-%d')
-            url = f"{self.BASE_URL}/fixtures"
+        for days_offset in days:
+            date = (now + timedelta(days=days_offset)).strftime('%Y-%m-%d')
             params = {'date': date, 'timezone': 'Europe/Sofia'}
             
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=self.headers, params=params, 
-                                          timeout=aiohttp.ClientTimeout(total=30)) as response:
-                        logger.info(f"API fixtures request for {date}: status {response.status}")
-                        
-                        if response.status == 200:
-                            data = await response.json()
-                            results = data.get('response', [])
-                            
-                            # DEBUG: Проверка на API response
-                            api_info = data.get('results', 0)
-                            logger.info(f"API returned {api_info} fixtures for {date}")
-                            
-                            # Проверка за API errors
-                            if 'errors' in data and data['errors']:
-                                logger.error(f"API errors: {data['errors']}")
-                            
-                            # Проверка за rate limit
-                            if 'requests' in data:
-                                logger.info(f"API quota: {data['requests']}")
-                            
-                            fixtures.extend(results)
-                        else:
-                            error_text = await response.text()
-                            logger.error(f"API error {response.status}: {error_text}")
-                            
+                data = await self._request('fixtures', params, item_filter=slim)
+                if data is None:
+                    continue
+                
+                # DEBUG: Проверка на API response
+                api_info = data.get('results', 0)
+                logger.info(f"API returned {api_info} fixtures for {date}, "
+                            f"{len(data.get('response', []))} upcoming")
+                
+                # Проверка за rate limit
+                if 'requests' in data:
+                    logger.info(f"API quota: {data['requests']}")
+                
+                fixtures.extend(f for f in data.get('response', [])
+                                if f['fixture']['id'] not in excluded)
+                    
             except Exception as e:
                 logger.error(f"Exception getting fixtures: {e}")
                 logger.error(traceback.format_exc())
@@ -199,92 +1464,342 @@ class FootballAPI:
         return fixtures
     
     async def get_predictions(self, fixture_id: int) -> Optional[Dict]:
-        url = f"{self.BASE_URL}/predictions"
-        params = {'fixture': fixture_id}
-        
+        """Прогнозата за мача; {} ако API-то няма прогноза, None ако заявката не е минала"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers, params=params,
-                                      timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        results = data.get('response', [])
-                        return results[0] if results else None
+            data = await self._request('predictions', {'fixture': fixture_id})
+            if data and not data.get('errors'):
+                results = data.get('response', [])
+                return results[0] if results else {}
         except Exception as e:
             logger.error(f"Error getting predictions: {e}")
         return None
     
     async def get_odds(self, fixture_id: int) -> Optional[Dict]:
-        url = f"{self.BASE_URL}/odds"
-        params = {'fixture': fixture_id, 'bookmaker': 8}
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers, params=params,
-                                      timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        results = data.get('response', [])
-                        return results[0] if results else None
+            data = await self._request('odds', self._odds_params(fixture_id))
+            if data:
+                results = data.get('response', [])
+                return results[0] if results else None
         except Exception as e:
             logger.error(f"Error getting odds: {e}")
         return None
     
     async def get_fixture_result(self, fixture_id: int) -> Optional[Dict]:
         """Проверява резултат на завършен мач"""
-        url = f"{self.BASE_URL}/fixtures"
-        params = {'id': fixture_id}
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers, params=params,
-                                      timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        fixtures = data.get('response', [])
-                        if fixtures:
-                            return fixtures[0]
+            data = await self._request('fixtures', {'id': fixture_id})
+            if data:
+                fixtures = data.get('response', [])
+                if fixtures:
+                    return fixtures[0]
         except Exception as e:
             logger.error(f"Error getting result: {e}")
         return None
+    
+    async def get_fixture_results(self, fixture_ids: List[int]) -> Dict[int, Dict]:
+        """Взима много мачове наведнъж през fixtures?ids=, на групи по API лимита"""
+        results = {}
+        ids = sorted(set(fixture_ids))
+        
+        for i in range(0, len(ids), API_MAX_IDS_PER_REQUEST):
+            chunk = ids[i:i + API_MAX_IDS_PER_REQUEST]
+            try:
+                data = await self._request('fixtures', {'ids': '-'.join(str(fid) for fid in chunk)})
+                if data:
+                    for fixture in data.get('response', []):
+                        results[fixture['fixture']['id']] = fixture
+            except Exception as e:
+                logger.error(f"Error getting results for {chunk}: {e}")
+        
+        return results
+
+@dataclass(frozen=True, slots=True)
+class BettingProfile:
+    """Канал със своя стратегия: прозорец на коефициента, прогресия на залога и дневен лимит"""
+    name: str
+    channel_id: str
+    odd_min: float
+    odd_max: float
+    initial_bet: float
+    multiplier: float
+    max_bets_per_day: int
+    # Коефициентът с пълен бонус и разстоянието, на което бонусът пада до 0
+    sweet_spot: float
+    bonus_range: float
+    
+    @property
+    def window(self) -> Tuple[float, float, float, float]:
+        """Всичко, от което зависи score-ът на комбинацията"""
+        return self.odd_min, self.odd_max, self.sweet_spot, self.bonus_range
+    
+    @classmethod
+    def default(cls) -> 'BettingProfile':
+        """От глобалните настройки - четат се при извикване, backtest-ът ги подменя"""
+        return cls(DEFAULT_PROFILE, TELEGRAM_CHANNEL_ID, TARGET_ODD_MIN, TARGET_ODD_MAX,
+                   INITIAL_BET, MARTINGALE_MULTIPLIER, MAX_BETS_PER_DAY,
+                   ODD_SWEET_SPOT, ODD_BONUS_RANGE)
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BettingProfile':
+        """Липсващите полета идват от глобалните настройки; бонусът за коефициента
+        се мести и разтяга заедно с прозореца"""
+        odd_min = float(data.get('odd_min', TARGET_ODD_MIN))
+        odd_max = float(data.get('odd_max', TARGET_ODD_MAX))
+        if not 1.0 <= odd_min < odd_max:
+            raise ValueError(f"Profile {data.get('name')}: invalid odds window {odd_min}-{odd_max}")
+        sweet_spot, bonus_range = cls.scaled_bonus(odd_min, odd_max)
+        return cls(
+            name=str(data['name']),
+            channel_id=str(data.get('channel_id', TELEGRAM_CHANNEL_ID)),
+            odd_min=odd_min,
+            odd_max=odd_max,
+            initial_bet=float(data.get('initial_bet', INITIAL_BET)),
+            multiplier=float(data.get('multiplier', MARTINGALE_MULTIPLIER)),
+            max_bets_per_day=int(data.get('max_bets_per_day', MAX_BETS_PER_DAY)),
+            sweet_spot=float(data.get('sweet_spot', sweet_spot)),
+            bonus_range=float(data.get('bonus_range', bonus_range))
+        )
+    
+    @staticmethod
+    def scaled_bonus(odd_min: float, odd_max: float) -> Tuple[float, float]:
+        """ODD_SWEET_SPOT и ODD_BONUS_RANGE, преместени и разтегнати от глобалния
+        прозорец TARGET_ODD_MIN-TARGET_ODD_MAX към odd_min-odd_max"""
+        scale = (odd_max - odd_min) / (TARGET_ODD_MAX - TARGET_ODD_MIN)
+        return odd_min + (ODD_SWEET_SPOT - TARGET_ODD_MIN) * scale, ODD_BONUS_RANGE * scale
+    
+    @classmethod
+    def load_all(cls, path: str = PROFILES_PATH) -> List['BettingProfile']:
+        """Профилите от JSON файла; без файл - само профилът по подразбиране.
+        Грешна конфигурация спира старта, вместо да залага в грешен канал"""
+        if not os.path.exists(path):
+            return [cls.default()]
+        with open(path, encoding='utf-8') as f:
+            profiles = [cls.from_dict(item) for item in json.load(f)]
+        names = [profile.name for profile in profiles]
+        if not profiles or len(set(names)) != len(names):
+            raise ValueError(f"{path}: expected a non-empty list of profiles with unique names")
+        return profiles
 
 class BettingStrategy:
-    def __init__(self, db: DatabaseManager):
+    def __init__(self, db: AsyncDatabase, profile: Optional[BettingProfile] = None):
         self.db = db
-        self.current_bet = INITIAL_BET
+        self.profile = profile or BettingProfile.default()
+        self.current_bet = self.profile.initial_bet
         self.bets_today = []
         self.last_result = None
     
     def calculate_next_bet(self, won: bool) -> float:
         if won:
-            self.current_bet = INITIAL_BET
+            self.current_bet = self.profile.initial_bet
         else:
-            self.current_bet = round(self.current_bet * MARTINGALE_MULTIPLIER, 2)
+            self.current_bet = round(self.current_bet * self.profile.multiplier, 2)
         return self.current_bet
     
     def reset_daily(self):
-        self.current_bet = INITIAL_BET
+        self.current_bet = self.profile.initial_bet
         self.bets_today = []
         self.last_result = None
 
+@dataclass(slots=True)
+class FixtureInfo:
+    """Само полетата от API fixture-а, които ползваме след филтрирането"""
+    id: int
+    date: str
+    home: str
+    away: str
+    league_id: int
+    league: str
+    
+    @classmethod
+    def from_api(cls, fixture: Dict) -> 'FixtureInfo':
+        league = fixture.get('league', {})
+        return cls(
+            id=fixture['fixture']['id'],
+            date=fixture['fixture']['date'],
+            home=sys.intern(fixture['teams']['home']['name']),
+            away=sys.intern(fixture['teams']['away']['name']),
+            league_id=league.get('id', 0),
+            league=sys.intern(league.get('name', ''))
+        )
+
+@dataclass(slots=True)
+class BetOption:
+    """Една опция за залог; мачът се намира по fixture_id в таблицата на селектора"""
+    type: str
+    bet_category: str
+    odd: float
+    confidence: float
+    fixture_id: int
+    prediction_key: str
+    # Букмейкърът с най-добрия коефициент
+    bookmaker: str = ''
+    # Увереността от API-то преди калибрацията (None = не е калибрирана)
+    raw_confidence: Optional[float] = None
+    # Промяна на коефициента за ODDS_DRIFT_WINDOW (попълва се от FixturePipeline)
+    drift: float = 0.0
+    
+    def series_key(self) -> Tuple[str, str]:
+        """(market, outcome) както са в odds отговора на API-то - ключ в историята на коефициентите"""
+        market = {'Match Winner': 'Match Winner', 'Over/Under': 'Goals Over/Under',
+                  'BTTS': 'Both Teams Score'}.get(self.bet_category, self.bet_category)
+        outcome = {'home': 'Home', 'draw': 'Draw', 'away': 'Away',
+                   'btts_yes': 'Yes'}.get(self.prediction_key, self.prediction_key)
+        return market, outcome
+
+class Calibration:
+    """Предварително изчислени hit rates по лига, пазар и bucket на увереността"""
+    
+    POOLED = -1  # league_id на редовете, обединени за всички лиги
+    
+    def __init__(self, table: Dict[Tuple[int, str, int], float], bucket: int, samples: int = 0):
+        self.table = table
+        self.bucket = bucket
+        self.samples = samples
+    
+    @staticmethod
+    def market_key(option: BetOption) -> str:
+        return f"{option.bet_category}:{option.prediction_key}"
+    
+    def lookup(self, league_id: int, market: str, confidence: float) -> Optional[float]:
+        """Калибрираната вероятност в % или None, ако няма ред за този пазар и bucket"""
+        bucket = int(confidence // self.bucket)
+        value = self.table.get((league_id, market, bucket))
+        if value is None:
+            value = self.table.get((self.POOLED, market, bucket))
+        return value
+    
+    def apply(self, league_id: int, options: List[BetOption]):
+        for option in options:
+            value = self.lookup(league_id, self.market_key(option), option.confidence)
+            if value is not None:
+                option.raw_confidence = option.confidence
+                option.confidence = value
+    
+    @classmethod
+    def load(cls, path: str = CALIBRATION_PATH) -> Optional['Calibration']:
+        """Зарежда таблицата от calibrate.py; None ако файлът липсва или е невалиден"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            return cls.from_table(data['table'], data['bucket'], data.get('samples', 0))
+        except Exception as e:
+            logger.error(f"Calibration load error: {e}")
+            return None
+    
+    @classmethod
+    def from_table(cls, table: Dict[str, float], bucket: int, samples: int = 0) -> 'Calibration':
+        """От записания вид 'league|market|bucket' към tuple ключове"""
+        parsed = {}
+        for key, value in table.items():
+            league_id, market, b = key.split('|')
+            parsed[(int(league_id), sys.intern(market), int(b))] = value
+        return cls(parsed, bucket, samples)
+
 class AdvancedBetSelector:
-    def __init__(self, api: FootballAPI):
+    def __init__(self, api: FootballAPI, clock: Optional[Callable[[], datetime]] = None):
         self.api = api
+        # Часовник с BG време; backtest-ът подава симулиран
+        self.clock = clock or (lambda: datetime.now(BG_TZ))
+        # Обща таблица fixture_id -> FixtureInfo; опциите пазят само id
+        self.fixture_table: Dict[int, FixtureInfo] = {}
+        # FixturePipeline с предварително извлечени опции (bot_loop го закача)
+        self.pipeline: Optional['FixturePipeline'] = None
+        # Калибрирани вероятности вместо суровите проценти на API-то
+        self.calibration: Optional[Calibration] = None
+        # Single-flight: ключ на търсенето (изключените мачове) -> текущо търсене / (кога, резултат)
+        self._searches: Dict[Tuple, asyncio.Future] = {}
+        self._results: 'OrderedDict[Tuple, Tuple[datetime, object]]' = OrderedDict()
+        self._search_lock = asyncio.Lock()
+    
+    def _register_fixture(self, fixture: Dict) -> FixtureInfo:
+        info = FixtureInfo.from_api(fixture)
+        self.fixture_table[info.id] = info
+        return info
     
     async def find_smart_combination(self, excluded_ids: List[int] = None) -> Optional[Dict]:
-        if excluded_ids is None:
-            excluded_ids = []
+        """Заявките със същите изключени мачове чакат вече пуснатото търсене,
+        а скорошният резултат се връща от кеша (бутонът и bot_loop делят селектора)"""
+        excluded = frozenset(excluded_ids or ())
+        return await self._shared_search((None, excluded), lambda: self._smart_search(list(excluded)))
+    
+    async def find_profile_combinations(self, profiles: List[BettingProfile],
+                                        used: Dict[str, Iterable[int]]) -> Dict[str, Optional[Dict]]:
+        """Комбинация за всеки профил от едно извличане на опциите и едно обхождане
+        на комбинациите; used са използваните днес мачове на всеки профил"""
+        key = tuple((profile, frozenset(used.get(profile.name, ()))) for profile in profiles)
+        return await self._shared_search(key, lambda: self._profile_search(key))
+    
+    async def _shared_search(self, key: Tuple, search: Callable[[], Awaitable]):
+        cached = self._results.get(key)
+        if cached is not None and self.clock() - cached[0] < SEARCH_CACHE_TTL:
+            METRICS.inc('bet_search_shared_total', source='cache')
+            return cached[1]
         
+        running = self._searches.get(key)
+        if running is None:
+            running = self._searches[key] = asyncio.ensure_future(self._single_search(key, search))
+        else:
+            METRICS.inc('bet_search_shared_total', source='inflight')
+        # Прекъснат чакащ не спира търсенето за останалите
+        return await asyncio.shield(running)
+    
+    async def _single_search(self, key: Tuple, search: Callable[[], Awaitable]):
+        try:
+            # Търсенето подменя fixture_table, затова различните ключове вървят едно след друго
+            async with self._search_lock:
+                with METRICS.time('bet_search_seconds'):
+                    result = await search()
+            self._results[key] = (self.clock(), result)
+            self._results.move_to_end(key)
+            while len(self._results) > SEARCH_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return result
+        finally:
+            del self._searches[key]
+    
+    async def _smart_search(self, excluded_ids: List[int] = None) -> Optional[Dict]:
+        all_bet_options = await self._collect_options(excluded_ids or [])
+        if not all_bet_options:
+            return None
+        # Търсенето е чиста CPU работа - в нишка, за да не спира event loop-а
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._find_best_combination, all_bet_options
+        )
+    
+    async def _profile_search(self, key: Tuple) -> Dict[str, Optional[Dict]]:
+        profiles = [profile for profile, _ in key]
+        used = {profile.name: excluded for profile, excluded in key}
+        # Мачовете, използвани от всички профили, не трябват на никого
+        shared = frozenset.intersection(*used.values()) if used else frozenset()
+        all_bet_options = await self._collect_options(list(shared))
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._find_profile_combinations, all_bet_options, profiles, used
+        )
+    
+    async def _collect_options(self, excluded_ids: List[int]) -> List[BetOption]:
+        """Опциите за залог от предстоящите мачове - от pipeline-а или с нови заявки"""
         logger.info("🔍 Smart search starting...")
-        fixtures = await self.api.get_live_fixtures()
+        
+        if self.pipeline is not None and self.pipeline.ready:
+            all_bet_options = self.pipeline.options_for(excluded_ids)
+            if all_bet_options:
+                self.fixture_table = self.pipeline.fixture_table
+                logger.info(f"⚡ {len(all_bet_options)} prefetched bet options from the pipeline")
+                return all_bet_options
+            logger.info("Pipeline has no options yet - falling back to a full search")
+        
+        self.fixture_table = {}
+        fixtures = await self.api.get_live_fixtures(excluded_ids)
         logger.info(f"📊 Found {len(fixtures)} total fixtures from API")
         
         if len(fixtures) == 0:
             logger.warning("⚠️ API returned 0 fixtures - possible rate limit or API issue")
             logger.warning("💡 Tip: Free tier has 100 requests/day limit")
-            return None
+            return []
         
-        now = datetime.now(BG_TZ)
+        now = self.clock()
         future_fixtures = []
         
         for fixture in fixtures:
@@ -310,235 +1825,677 @@ class AdvancedBetSelector:
         
         if not future_fixtures:
             logger.warning("⚠️ No upcoming fixtures found (all started or outside time range)")
-            return None
+            return []
         
-        all_bet_options = []
+        # Всеки мач струва до 2 заявки (predictions + odds) - не излизаме от дневната квота
+        budget = self.api.limiter.remaining_today()
+        candidates = []
+        for fixture in future_fixtures[:MAX_FIXTURES_PER_SEARCH]:
+            cost = self.api.fixture_cost(fixture['fixture']['id'])
+            if cost > budget:
+                break
+            budget -= cost
+            candidates.append(fixture)
+        logger.info(f"🚀 Analyzing {len(candidates)} fixtures (quota left: "
+                    f"{self.api.limiter.remaining_today()})")
         
-        for fixture in future_fixtures[:30]:
-            try:
-                fixture_id = fixture['fixture']['id']
-                
-                prediction = await self.api.get_predictions(fixture_id)
-                await asyncio.sleep(1.5)
-                
-                if not prediction:
-                    logger.info(f"  ⚠️ No predictions for fixture {fixture_id}")
-                    continue
-                
-                odds_data = await self.api.get_odds(fixture_id)
-                await asyncio.sleep(1.5)
-                
-                if not odds_data:
-                    logger.info(f"  ⚠️ No odds for fixture {fixture_id}")
-                    continue
-                
-                options = self._extract_all_bet_types(prediction, odds_data, fixture)
-                if options:
-                    all_bet_options.extend(options)
-                    logger.info(f"  ✅ Found {len(options)} bet options")
-                
-            except Exception as e:
-                logger.error(f"❌ Analysis error: {e}")
-                logger.error(traceback.format_exc())
-                continue
+        # Заявките се пускат паралелно, темпото се определя от rate limiter-а на API-то
+        analyzed = await asyncio.gather(*(self._analyze_fixture(f) for f in candidates))
+        all_bet_options = [option for options in analyzed for option in options]
         
         logger.info(f"📈 Total {len(all_bet_options)} bet options found")
         
         if not all_bet_options:
             logger.warning("⚠️ No valid bet options found (low confidence or no data)")
-            return None
-        
-        return self._find_best_combination(all_bet_options)
+        return all_bet_options
+    
+    async def _analyze_fixture(self, fixture: Dict) -> List[BetOption]:
+        """Взима predictions + odds за един мач и връща опциите за залог"""
+        try:
+            info = self._register_fixture(fixture)
+            fixture_id = info.id
+            
+            prediction = await self.api.get_predictions(fixture_id)
+            if not prediction:
+                logger.info(f"  ⚠️ No predictions for fixture {fixture_id}")
+                return []
+            
+            odds_data = await self.api.get_odds(fixture_id)
+            if not odds_data:
+                logger.info(f"  ⚠️ No odds for fixture {fixture_id}")
+                return []
+            
+            options = self._extract_all_bet_types(prediction, odds_data, info)
+            if options:
+                logger.info(f"  ✅ Found {len(options)} bet options")
+            return options
+            
+        except Exception as e:
+            logger.error(f"❌ Analysis error: {e}")
+            logger.error(traceback.format_exc())
+            return []
     
     def _extract_all_bet_types(self, prediction: Dict, odds_data: Dict, 
-                               fixture: Dict) -> List[Dict]:
+                               fixture: FixtureInfo) -> List[BetOption]:
         options = []
         
         try:
             predictions = prediction.get('predictions', {})
             win_percent = predictions.get('percent', {})
             
-            bookmaker = odds_data.get('bookmakers', [{}])[0]
-            bets = bookmaker.get('bets', [])
+            # Всяка опция се оценява по най-добрия коефициент сред букмейкърите
+            book = FootballAPI.best_prices(odds_data)
             
             # Match Winner
-            for bet in bets:
-                if bet['name'] == 'Match Winner':
-                    values = bet.get('values', [])
-                    if len(values) >= 3:
-                        # Home
-                        home_pct = float(win_percent.get('home', '0').rstrip('%'))
-                        if home_pct >= 35:
-                            options.append({
-                                'type': f"🏠 {fixture['teams']['home']['name']} wins",
-                                'bet_category': 'Match Winner',
-                                'odd': float(values[0]['odd']),
-                                'confidence': home_pct,
-                                'fixture': fixture,
-                                'fixture_id': fixture['fixture']['id'],
-                                'prediction_key': 'home'
-                            })
-                        
-                        # Draw
-                        draw_pct = float(win_percent.get('draw', '0').rstrip('%'))
-                        if draw_pct >= 20:
-                            options.append({
-                                'type': f"🤝 Draw",
-                                'bet_category': 'Match Winner',
-                                'odd': float(values[1]['odd']),
-                                'confidence': draw_pct,
-                                'fixture': fixture,
-                                'fixture_id': fixture['fixture']['id'],
-                                'prediction_key': 'draw'
-                            })
-                        
-                        # Away
-                        away_pct = float(win_percent.get('away', '0').rstrip('%'))
-                        if away_pct >= 35:
-                            options.append({
-                                'type': f"✈️ {fixture['teams']['away']['name']} wins",
-                                'bet_category': 'Match Winner',
-                                'odd': float(values[2]['odd']),
-                                'confidence': away_pct,
-                                'fixture': fixture,
-                                'fixture_id': fixture['fixture']['id'],
-                                'prediction_key': 'away'
-                            })
-                
-                # Over/Under Goals
-                elif bet['name'] == 'Goals Over/Under':
-                    values = bet.get('values', [])
-                    goals_pred = predictions.get('goals', {})
-                    
-                    for val in values:
-                        if 'Over' in val['value']:
-                            over_pct = 50  # Default, API doesn't give exact %
-                            if over_pct >= 40:
-                                options.append({
-                                    'type': f"⚽ {val['value']}",
-                                    'bet_category': 'Over/Under',
-                                    'odd': float(val['odd']),
-                                    'confidence': over_pct,
-                                    'fixture': fixture,
-                                    'fixture_id': fixture['fixture']['id'],
-                                    'prediction_key': val['value']
-                                })
-                
-                # Both Teams Score
-                elif bet['name'] == 'Both Teams Score':
-                    values = bet.get('values', [])
-                    btts = predictions.get('comparison', {}).get('att', {})
-                    
-                    if len(values) >= 1:
-                        btts_yes_pct = 45  # Default estimate
-                        if btts_yes_pct >= 35:
-                            options.append({
-                                'type': f"🎯 Both Teams Score - Yes",
-                                'bet_category': 'BTTS',
-                                'odd': float(values[0]['odd']),
-                                'confidence': btts_yes_pct,
-                                'fixture': fixture,
-                                'fixture_id': fixture['fixture']['id'],
-                                'prediction_key': 'btts_yes'
-                            })
+            prices = book.get('Match Winner', {})
+            for outcome, key, threshold, label in (
+                ('Home', 'home', 35, f"🏠 {fixture.home} wins"),
+                ('Draw', 'draw', 20, "🤝 Draw"),
+                ('Away', 'away', 35, f"✈️ {fixture.away} wins")
+            ):
+                if outcome not in prices:
+                    continue
+                pct = float(win_percent.get(key, '0').rstrip('%'))
+                if pct >= threshold:
+                    odd, bookmaker = prices[outcome]
+                    options.append(BetOption(
+                        type=label,
+                        bet_category='Match Winner',
+                        odd=odd,
+                        confidence=pct,
+                        fixture_id=fixture.id,
+                        prediction_key=key,
+                        bookmaker=bookmaker
+                    ))
+            
+            # Over/Under Goals
+            for outcome, (odd, bookmaker) in book.get('Goals Over/Under', {}).items():
+                if 'Over' in outcome:
+                    over_pct = 50  # Default, API doesn't give exact %
+                    if over_pct >= 40:
+                        options.append(BetOption(
+                            type=f"⚽ {outcome}",
+                            bet_category='Over/Under',
+                            odd=odd,
+                            confidence=over_pct,
+                            fixture_id=fixture.id,
+                            prediction_key=outcome,
+                            bookmaker=bookmaker
+                        ))
+            
+            # Both Teams Score
+            if 'Yes' in book.get('Both Teams Score', {}):
+                btts_yes_pct = 45  # Default estimate
+                if btts_yes_pct >= 35:
+                    odd, bookmaker = book['Both Teams Score']['Yes']
+                    options.append(BetOption(
+                        type=f"🎯 Both Teams Score - Yes",
+                        bet_category='BTTS',
+                        odd=odd,
+                        confidence=btts_yes_pct,
+                        fixture_id=fixture.id,
+                        prediction_key='btts_yes',
+                        bookmaker=bookmaker
+                    ))
+            
+            if self.calibration is not None:
+                self.calibration.apply(fixture.league_id, options)
             
         except Exception as e:
             logger.error(f"Extract error: {e}")
         
         return options
     
-    def _find_best_combination(self, bets: List[Dict]) -> Optional[Dict]:
+    def _find_best_combination(self, bets: List[BetOption]) -> Optional[Dict]:
+        METRICS.inc('bet_options_evaluated_total', len(bets))
+        if self.calibration is None:
+            combos = self._find_top_combinations(bets, top_k=1)
+            return combos[0] if combos else None
+        
+        # С калибрирани вероятности: първата по score комбинация с достатъчна очаквана стойност
+        for combo in itertools.islice(self._iter_combinations(bets), CALIBRATION_MAX_CANDIDATES):
+            if combo['ev'] >= CALIBRATION_MIN_EV:
+                return combo
+        logger.info(f"No combination with EV >= {CALIBRATION_MIN_EV:+.0%} among the top candidates")
+        return None
+    
+    def _find_top_combinations(self, bets: List[BetOption], top_k: int = COMBO_TOP_K) -> List[Dict]:
+        return list(itertools.islice(self._iter_combinations(bets), top_k))
+    
+    def _iter_combinations(self, bets: List[BetOption]) -> Iterator[Dict]:
+        """Поток от комбинации в намаляващ ред на score за глобалния прозорец"""
+        window = (TARGET_ODD_MIN, TARGET_ODD_MAX, ODD_SWEET_SPOT, ODD_BONUS_RANGE)
+        for _, combo in self._iter_window_combinations(bets, [window]):
+            yield combo
+    
+    def _find_profile_combinations(self, bets: List[BetOption], profiles: List[BettingProfile],
+                                   used: Dict[str, Iterable[int]]) -> Dict[str, Optional[Dict]]:
+        """Едно обхождане за всички профили. Профилите с еднакъв прозорец делят поток;
+        всеки взима първата комбинация без свои използвани мачове (при калибрация -
+        и с достатъчна очаквана стойност сред първите CALIBRATION_MAX_CANDIDATES)."""
+        chosen: Dict[str, Optional[Dict]] = {profile.name: None for profile in profiles}
+        if not profiles:
+            return chosen
+        METRICS.inc('bet_options_evaluated_total', len(bets))
+        
+        windows = list(dict.fromkeys(profile.window for profile in profiles))
+        waiting = [[p for p in profiles if p.window == window] for window in windows]
+        rejected = dict.fromkeys(chosen, 0)
+        closed = set()
+        
+        for w, combo in self._iter_window_combinations(bets, windows, closed):
+            fixture_ids = {b.fixture_id for b in combo['bets']}
+            for profile in list(waiting[w]):
+                if not fixture_ids.isdisjoint(used.get(profile.name, ())):
+                    continue
+                if self.calibration is not None and combo['ev'] < CALIBRATION_MIN_EV:
+                    rejected[profile.name] += 1
+                    if rejected[profile.name] < CALIBRATION_MAX_CANDIDATES:
+                        continue
+                else:
+                    chosen[profile.name] = combo
+                waiting[w].remove(profile)
+            if not waiting[w]:
+                closed.add(w)
+        
+        return chosen
+    
+    def _iter_window_combinations(self, bets: List[BetOption],
+                                  windows: List[Tuple[float, float, float, float]],
+                                  closed: Optional[set] = None) -> Iterator[Tuple[int, Dict]]:
+        """Поток от (прозорец, комбинация) в намаляващ ред на score за всеки прозорец
+        (odd_min, odd_max, sweet_spot, bonus_range) - branch and bound.
+        
+        Всеки елемент на frontier-а е (prefix, start) - всички комбинации prefix + опция
+        от start нататък + продължения. Изваждането му дава комбинацията с първата
+        допустима опция m и два нови елемента: (prefix + m, m + 1) и (prefix, m + 1),
+        така че всяка комбинация се генерира точно веднъж.
+        
+        Границата на елемента идва от таблица (виж _bound_tables): най-голямата сума
+        на увереността на j опции от опашката по кофа на сумата от log-коефициентите.
+        Така тя отчита и odd_bonus-а, който още е постижим, а не само средната
+        увереност - при много опции с еднаква увереност (Over, BTTS) средната не реже
+        нищо. Комбинация се пуска навън, щом score-ът ѝ + COMBO_SCORE_TOLERANCE е >=
+        най-добрата граница във frontier-а - нищо забележимо по-добро не може да се
+        появи след нея.
+        
+        Всички прозорци се обхождат наведнъж: рязането е по обединението им, а
+        всеки прозорец има своя купчина с намерени комбинации. Консуматорът
+        добавя в closed прозорците, които вече не го интересуват.
+        """
         if not bets:
+            return
+        if closed is None:
+            closed = set()
+        
+        bets.sort(key=attrgetter('confidence'), reverse=True)
+        
+        conf = np.array([b.confidence for b in bets], dtype=np.float64)
+        fixture_ids = [b.fixture_id for b in bets]
+        log_odds = np.log(np.array([b.odd for b in bets], dtype=np.float64))
+        log_odds[~np.isfinite(log_odds) | (log_odds < 0)] = np.inf  # невалидни коефициенти
+        bounds = [(np.log(odd_min) - COMBO_EPSILON, np.log(odd_max) + COMBO_EPSILON, sweet_spot, bonus_range)
+                  for odd_min, odd_max, sweet_spot, bonus_range in windows]
+        log_min = min(bound[0] for bound in bounds)
+        log_max = max(bound[1] for bound in bounds)
+        
+        # suffix_max[m] / suffix_min[m] = най-големият / най-малкият log-odd от m нататък
+        finite = np.where(np.isfinite(log_odds), log_odds, 0.0)
+        suffix_max = np.append(np.maximum.accumulate(finite[::-1])[::-1], 0.0)
+        suffix_min = np.append(np.minimum.accumulate(log_odds[::-1])[::-1], np.inf)
+        n = len(bets)
+        log_list = log_odds.tolist()
+        suffix_max_list = suffix_max.tolist()
+        
+        def next_option(prefix: Tuple[int, ...], prefix_log: float, start: int) -> Optional[int]:
+            """Първата опция >= start, с която prefix остава под горната граница,
+            без повтарящ се мач и с шанс да стигне долната граница.
+            
+            Търсим на блокове с удвояващ се размер, затова цената зависи от
+            разстоянието до намерената опция, а не от дължината на опашката.
+            """
+            remaining = COMBO_MAX_LEGS - len(prefix) - 1
+            upper = log_max - prefix_log
+            lower = log_min - prefix_log
+            # Нито една опция нататък не става - без да обхождаме опашката
+            if start >= n or suffix_min[start] > upper or (remaining + 1) * suffix_max[start] < lower:
+                return None
+            
+            used = {fixture_ids[i] for i in prefix}
+            # Обикновено търсената опция е съвсем близо - първо без numpy
+            for m in range(start, min(n, start + 8)):
+                odd = log_list[m]
+                if (odd <= upper and odd + remaining * suffix_max_list[m + 1] >= lower
+                        and fixture_ids[m] not in used):
+                    return m
+            start = min(n, start + 8)
+            block = 32
+            while start < n:
+                end = min(n, start + block)
+                window = log_odds[start:end]
+                mask = (window <= upper) & (window + remaining * suffix_max[start + 1:end + 1] >= lower)
+                for offset in np.flatnonzero(mask):
+                    m = start + int(offset)
+                    if fixture_ids[m] not in used:
+                        return m
+                if suffix_min[end] > upper or (remaining + 1) * suffix_max[end] < lower:
+                    return None
+                start = end
+                block *= 2
             return None
         
-        bets.sort(key=lambda x: x['confidence'], reverse=True)
-        
-        best_combo = None
-        best_score = 0
-        
-        # Single bet
-        for bet in bets:
-            if TARGET_ODD_MIN <= bet['odd'] <= TARGET_ODD_MAX:
-                score = bet['confidence']
-                if score > best_score:
-                    best_score = score
-                    best_combo = {
-                        'bets': [bet],
-                        'total_odd': round(bet['odd'], 2),
-                        'avg_confidence': bet['confidence']
-                    }
-        
-        # Double
-        for i in range(min(15, len(bets))):
-            for j in range(i+1, min(15, len(bets))):
-                if bets[i]['fixture_id'] == bets[j]['fixture_id']:
+        tables, every = self._bound_tables(conf, log_odds, log_max)
+        step = COMBO_BOUND_STEP
+        size = tables[0].shape[1]
+        # edges[b] = коефициентът в началото на кофа b
+        edges = np.exp(np.arange(size + COMBO_MAX_LEGS) * step)
+        legs_range = np.arange(1, COMBO_MAX_LEGS + 1)[:, None]
+        
+        def upper_bound(legs: int, conf_sum: float, log_sum: float, start: int) -> float:
+            """Горна граница за score-а на prefix (legs мача) + поне една опция от start"""
+            remaining = COMBO_MAX_LEGS - legs
+            if remaining <= 0 or start >= n:
+                return 0.0
+            # Само кофите, от които сумата може да попадне в някой прозорец
+            first = max(0, int((log_min - log_sum) / step) - COMBO_MAX_LEGS)
+            last = min(size, int((log_max - log_sum) / step) + 1)
+            if last <= first:
+                return 0.0
+            added = tables[start // every][1:remaining + 1, first:last]
+            j = legs_range[:remaining]
+            avg_conf = (conf_sum + added) / (legs + j)
+            # Истинската сума на кофа b с j опции е в [b, b + j) стъпки
+            columns = np.arange(first, last)
+            low = np.exp(log_sum) * edges[columns]
+            high = np.exp(log_sum) * edges[j + columns]
+            best = 0.0
+            for w, (w_min, w_max, sweet_spot, bonus_range) in enumerate(bounds):
+                if w in closed:
                     continue
+                odd_min, odd_max = np.exp(w_min), np.exp(w_max)
+                reach_low = np.maximum(low, odd_min)
+                reach_high = np.minimum(high, odd_max)
+                gap = np.maximum(np.maximum(reach_low - sweet_spot, sweet_spot - reach_high), 0.0)
+                odd_bonus = 1 - gap / bonus_range
+                if legs == 0:
+                    odd_bonus[0] = 1.0  # единичните залози са без бонус
+                score = np.where((high >= odd_min) & (low <= odd_max), avg_conf * odd_bonus, -np.inf)
+                best = max(best, float(score.max()))
+            return best
+        
+        # (-граница, -seq, ...): при равни граници първо най-новото - обхождането
+        # слиза до пълна комбинация, вместо да разширява всички равни възли.
+        # Новите елементи наследяват границата на родителя (те са подмножество на
+        # неговите комбинации); точната се смята чак когато стигнат до върха.
+        frontier = []  # (-граница, -seq, точна?, prefix, log_sum, conf_sum, start)
+        found = [[] for _ in windows]  # по прозорец: (-score, seq, indices)
+        seq = itertools.count()
+        
+        def push(prefix: Tuple[int, ...], log_sum: float, conf_sum: float, start: int,
+                 bound: Optional[float] = None, exact: bool = False):
+            if bound is None:
+                bound, exact = upper_bound(len(prefix), conf_sum, log_sum, start), True
+            if bound > 0:
+                heapq.heappush(frontier, (-bound, -next(seq), exact, prefix, log_sum, conf_sum, start))
+        
+        push((), 0.0, 0.0, 0)
+        
+        expansions = 0
+        try:
+            while frontier:
+                # Пускаме всичко, което вече е сигурно по-добро от неизследваното
+                for w, heap in enumerate(found):
+                    while (heap and w not in closed
+                           and -heap[0][0] + COMBO_SCORE_TOLERANCE >= -frontier[0][0]):
+                        _, _, indices = heapq.heappop(heap)
+                        yield w, self._make_combo([bets[i] for i in indices])
+                if len(closed) == len(windows):
+                    return
                 
-                combined_odd = bets[i]['odd'] * bets[j]['odd']
-                if TARGET_ODD_MIN <= combined_odd <= TARGET_ODD_MAX:
-                    avg_conf = (bets[i]['confidence'] + bets[j]['confidence']) / 2
-                    odd_bonus = 1 - abs(combined_odd - 2.2) / 0.5
-                    score = avg_conf * odd_bonus
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_combo = {
-                            'bets': [bets[i], bets[j]],
-                            'total_odd': round(combined_odd, 2),
-                            'avg_confidence': avg_conf
-                        }
-        
-        # Triple
-        for i in range(min(10, len(bets))):
-            for j in range(i+1, min(10, len(bets))):
-                for k in range(j+1, min(10, len(bets))):
-                    ids = {bets[i]['fixture_id'], bets[j]['fixture_id'], 
-                          bets[k]['fixture_id']}
-                    if len(ids) < 3:
+                neg_bound, _, exact, prefix, prefix_log, prefix_conf, start = heapq.heappop(frontier)
+                if not exact:
+                    push(prefix, prefix_log, prefix_conf, start)
+                    continue
+                
+                expansions += 1
+                if expansions > COMBO_MAX_EXPANSIONS:
+                    logger.warning(f"⚠️ Combination search stopped after {COMBO_MAX_EXPANSIONS} "
+                                   f"expansions, results may be incomplete")
+                    break
+                
+                m = next_option(prefix, prefix_log, start)
+                if m is None:
+                    continue
+                
+                indices = prefix + (m,)
+                log_sum = prefix_log + log_list[m]
+                conf_sum = prefix_conf + float(conf[m])
+                avg_conf = conf_sum / len(indices)
+                for w, (w_min, w_max, sweet_spot, bonus_range) in enumerate(bounds):
+                    if w in closed or not w_min <= log_sum <= w_max:
                         continue
-                    
-                    combined_odd = bets[i]['odd'] * bets[j]['odd'] * bets[k]['odd']
-                    if TARGET_ODD_MIN <= combined_odd <= TARGET_ODD_MAX:
-                        avg_conf = (bets[i]['confidence'] + bets[j]['confidence'] + 
-                                   bets[k]['confidence']) / 3
-                        odd_bonus = 1 - abs(combined_odd - 2.2) / 0.5
+                    if len(indices) == 1:
+                        score = avg_conf
+                    else:
+                        odd_bonus = 1 - abs(np.exp(log_sum) - sweet_spot) / bonus_range
                         score = avg_conf * odd_bonus
-                        
-                        if score > best_score:
-                            best_score = score
-                            best_combo = {
-                                'bets': [bets[i], bets[j], bets[k]],
-                                'total_odd': round(combined_odd, 2),
-                                'avg_confidence': avg_conf
-                            }
+                    if score > 0:
+                        heapq.heappush(found[w], (-score, next(seq), indices))
+                
+                # Продълженията на новата комбинация и останалите опции след m
+                if len(indices) < COMBO_MAX_LEGS:
+                    push(indices, log_sum, conf_sum, m + 1, -neg_bound)
+                # Със същата таблица границата на prefix не се променя
+                push(prefix, prefix_log, prefix_conf, m + 1, -neg_bound, (m + 1) // every == start // every)
+            
+            for w, heap in enumerate(found):
+                while heap and w not in closed:
+                    _, _, indices = heapq.heappop(heap)
+                    yield w, self._make_combo([bets[i] for i in indices])
+        finally:
+            # Броят се отчита веднъж, и когато потокът е прекъснат по-рано (islice)
+            METRICS.inc('bet_combinations_evaluated_total', expansions)
+    
+    @staticmethod
+    def _bound_tables(conf: 'np.ndarray', log_odds: 'np.ndarray',
+                      log_max: float) -> Tuple[List['np.ndarray'], int]:
+        """Таблици table[j, b] - най-голямата сума на увереността на j опции от опашката,
+        чиито log-коефициенти, закръглени надолу до COMBO_BOUND_STEP, дават сума b стъпки.
+        
+        Пази се таблица на всеки every-та опция (най-много ~COMBO_BOUND_TABLES); за
+        опашка от start се ползва таблицата на tables[start // every] - тя покрива
+        повече опции, така че границата остава валидна.
+        """
+        n = len(conf)
+        size = int(log_max / COMBO_BOUND_STEP) + 2
+        every = max(1, -(-n // COMBO_BOUND_TABLES))
+        buckets = np.where(np.isfinite(log_odds), log_odds / COMBO_BOUND_STEP, size).astype(np.int64)
+        
+        table = np.full((COMBO_MAX_LEGS + 1, size), -np.inf)
+        table[0, 0] = 0.0
+        tables = [table.copy() for _ in range(n // every + 1)]
+        for i in range(n - 1, -1, -1):
+            b = buckets[i]
+            if b < size:
+                # Дясната страна се смята изцяло преди присвояването - опцията влиза най-много веднъж
+                table[1:, b:] = np.maximum(table[1:, b:], table[:-1, :size - b] + conf[i])
+            if i % every == 0:
+                tables[i // every] = table.copy()
+        return tables, every
+    
+    def _make_combo(self, combo_bets: List[BetOption]) -> Dict:
+        total_odd = 1.0
+        probability = 1.0
+        for bet in combo_bets:
+            total_odd *= bet.odd
+            probability *= bet.confidence / 100
+        return {
+            'bets': combo_bets,
+            'total_odd': round(total_odd, 2),
+            'avg_confidence': sum(b.confidence for b in combo_bets) / len(combo_bets),
+            # Мачовете се приемат за независими
+            'probability': probability,
+            'ev': probability * total_odd - 1,
+            'fixtures': {b.fixture_id: self.fixture_table.get(b.fixture_id) for b in combo_bets}
+        }
+
+class FixturePipeline:
+    """Фонов индекс на предстоящите мачове с готови опции; търсенето само комбинира"""
+    
+    def __init__(self, api: FootballAPI, selector: 'AdvancedBetSelector',
+                 db: Optional[AsyncDatabase] = None,
+                 clock: Optional[Callable[[], datetime]] = None):
+        self.api = api
+        self.selector = selector
+        # Всяко опресняване на odds се записва в историята на коефициентите
+        self.db = db
+        self.clock = clock or (lambda: datetime.now(BG_TZ))
+        self.fixture_table: Dict[int, FixtureInfo] = {}
+        self.kickoffs: Dict[int, datetime] = {}
+        # fixture_id -> само 'predictions' частта; None = API-то няма прогноза
+        self.predictions: Dict[int, Optional[Dict]] = {}
+        # fixture_id -> кога да се опита отново неуспешна заявка за predictions
+        self.retry_at: Dict[int, datetime] = {}
+        self.odds_at: Dict[int, datetime] = {}
+        self.options: Dict[int, List[BetOption]] = {}
+        self.fixtures_at: Optional[datetime] = None
+    
+    @property
+    def ready(self) -> bool:
+        return self.fixtures_at is not None
+    
+    async def refresh_fixtures(self):
+        """Обновява списъка с мачове; започналите и изчезналите отпадат.
+        След първото зареждане се тегли само утрешният списък."""
+        days = (1,) if self.ready else (0, 1)
+        fixtures = await self.api.get_live_fixtures(days=days)
+        if not fixtures:
+            return
+        
+        now = self.clock()
+        seen = set()
+        for fixture in fixtures:
+            try:
+                if fixture['fixture']['status']['short'] not in ['NS', 'TBD']:
+                    continue
+                kickoff = datetime.fromisoformat(
+                    fixture['fixture']['date'].replace('Z', '+00:00')
+                ).astimezone(BG_TZ)
+                if kickoff <= now:
+                    continue
+                
+                info = FixtureInfo.from_api(fixture)
+                self.fixture_table[info.id] = info
+                self.kickoffs[info.id] = kickoff
+                seen.add(info.id)
+            except Exception as e:
+                logger.error(f"Error indexing fixture: {e}")
+        
+        # Изчезналите се знаят само за изтеглените дати
+        dates = {(now + timedelta(days=offset)).date() for offset in days}
+        for fixture_id in [f for f, kickoff in self.kickoffs.items()
+                           if kickoff <= now or (f not in seen and kickoff.date() in dates)]:
+            self._drop(fixture_id)
+        
+        self.fixtures_at = now
+        logger.info(f"📥 Pipeline: {len(self.fixture_table)} upcoming fixtures indexed, "
+                    f"{sum(len(o) for o in self.options.values())} options ready")
+    
+    def _drop(self, fixture_id: int):
+        for table in (self.fixture_table, self.kickoffs, self.predictions, self.retry_at,
+                      self.odds_at, self.options):
+            table.pop(fixture_id, None)
+    
+    @staticmethod
+    def _odds_max_age(hours_until: float) -> timedelta:
+        for hours, max_age in PIPELINE_ODDS_MAX_AGE:
+            if hours_until <= hours:
+                return max_age
+        return PIPELINE_ODDS_MAX_AGE[-1][1]
+    
+    def _next_task(self, now: datetime) -> Optional[Tuple[str, int]]:
+        """Първо липсващи predictions, после най-остарелите odds; по-близките мачове с приоритет"""
+        upcoming = []
+        for fixture_id, kickoff in sorted(self.kickoffs.items(), key=lambda item: item[1]):
+            hours_until = (kickoff - now).total_seconds() / 3600
+            if 1 < hours_until < PIPELINE_HORIZON_HOURS:
+                upcoming.append((fixture_id, hours_until))
+        
+        for fixture_id, _ in upcoming:
+            if fixture_id not in self.predictions and self.retry_at.get(fixture_id, now) <= now:
+                return 'predictions', fixture_id
+        
+        for fixture_id, hours_until in upcoming:
+            if self.predictions.get(fixture_id) is None:
+                continue
+            fetched = self.odds_at.get(fixture_id)
+            if fetched is None or now - fetched >= self._odds_max_age(hours_until):
+                return 'odds', fixture_id
+        return None
+    
+    async def step(self) -> Optional[bool]:
+        """Една задача от опашката; None ако няма работа, иначе дали е струвала заявка"""
+        now = self.clock()
+        task = self._next_task(now)
+        if task is None:
+            return None
+        
+        kind, fixture_id = task
+        quota_before = self.api.limiter.remaining_today()
+        
+        if kind == 'predictions':
+            prediction = await self.api.get_predictions(fixture_id)
+            if prediction is None:
+                # Заявката не е минала - мачът остава в опашката за по-късно
+                self.retry_at[fixture_id] = now + PIPELINE_RETRY_DELAY
+            else:
+                self.retry_at.pop(fixture_id, None)
+                self.predictions[fixture_id] = (
+                    {'predictions': prediction.get('predictions', {})} if prediction else None
+                )
+        else:
+            odds_data = await self.api.get_odds(fixture_id)
+            self.odds_at[fixture_id] = now
+            info = self.fixture_table.get(fixture_id)
+            if odds_data and info is not None:
+                options = self.selector._extract_all_bet_types(
+                    self.predictions[fixture_id], odds_data, info
+                )
+                if self.db is not None:
+                    await self._track_odds(fixture_id, odds_data, options, now)
+                self.options[fixture_id] = options
+            else:
+                self.options.pop(fixture_id, None)
         
-        return best_combo
+        return self.api.limiter.remaining_today() < quota_before
+    
+    async def _track_odds(self, fixture_id: int, odds_data: Dict,
+                          options: List[BetOption], now: datetime):
+        """Записва точка в историята и попълва drift на опциите"""
+        book = FootballAPI.best_prices(odds_data)
+        samples = [(market, outcome, odd)
+                   for market in ODDS_HISTORY_MARKETS
+                   for outcome, (odd, _) in book.get(market, {}).items()]
+        if not samples:
+            return
+        
+        try:
+            await self.db.record_odds(fixture_id, int(self.kickoffs[fixture_id].timestamp()),
+                                      int(now.timestamp()), samples)
+            drift = await self.db.get_odds_drift(
+                [fixture_id], int((now - ODDS_DRIFT_WINDOW).timestamp())
+            )
+        except Exception as e:
+            logger.error(f"Odds history error: {e}")
+            return
+        
+        for option in options:
+            option.drift = drift.get((fixture_id, *option.series_key()), 0.0)
+    
+    def _delay(self) -> float:
+        """Оставащата квота (без резерва и предстоящите опреснявания на списъка)
+        се разпределя равномерно до 00:00 UTC"""
+        now = datetime.now(pytz.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), dt_time(0), tzinfo=pytz.utc)
+        seconds_left = (midnight - now).total_seconds()
+        listings = int(seconds_left // PIPELINE_FIXTURES_REFRESH.total_seconds()) + 1
+        budget = self.api.limiter.remaining_today() - PIPELINE_QUOTA_RESERVE - listings
+        if budget <= 0:
+            return PIPELINE_MAX_DELAY
+        return min(PIPELINE_MAX_DELAY, max(60 / API_REQUESTS_PER_MINUTE, seconds_left / budget))
+    
+    def options_for(self, excluded_ids: List[int]) -> List[BetOption]:
+        """Готовите опции за мачовете между 1 и 24 часа от сега, без тези с рязко растящ коефициент"""
+        now = self.clock()
+        excluded = set(excluded_ids)
+        result = []
+        drifting = 0
+        for fixture_id, options in self.options.items():
+            hours_until = (self.kickoffs[fixture_id] - now).total_seconds() / 3600
+            if 1 < hours_until < 24 and fixture_id not in excluded:
+                for option in options:
+                    # Пазарът се движи срещу прогнозата
+                    if option.drift > ODDS_DRIFT_LIMIT:
+                        drifting += 1
+                    else:
+                        result.append(option)
+        
+        if drifting:
+            logger.info(f"📉 Skipped {drifting} options with odds drifting out by more than {ODDS_DRIFT_LIMIT:.0%}")
+        return result
+    
+    async def run(self):
+        while True:
+            delay = 60
+            try:
+                if self.fixtures_at is None or self.clock() - self.fixtures_at >= PIPELINE_FIXTURES_REFRESH:
+                    await self.refresh_fixtures()
+                
+                charged = await self.step()
+                if charged is not None:
+                    # Без квота заявките не се таксуват, но и не минават - чакаме
+                    exhausted = self.api.limiter.remaining_today() <= 0
+                    delay = self._delay() if charged or exhausted else 0
+            except Exception as e:
+                logger.error(f"Pipeline error: {e}")
+            
+            await asyncio.sleep(delay)
 
 class ResultChecker:
-    def __init__(self, api: FootballAPI, db: DatabaseManager):
+    def __init__(self, api: FootballAPI, db: AsyncDatabase):
         self.api = api
         self.db = db
     
+    @staticmethod
+    def settle_due(bet_fixtures: List[Dict]) -> Optional[datetime]:
+        """Кога залогът може да се провери - SETTLE_DELAY след началото на последния
+        мач; None за стари залози без час на мача (проверяват се веднага)"""
+        kickoffs = [datetime.fromisoformat(f['date'].replace('Z', '+00:00')).astimezone(BG_TZ)
+                    for f in bet_fixtures if f.get('date')]
+        if not kickoffs or len(kickoffs) != len(bet_fixtures):
+            return None
+        return max(kickoffs) + SETTLE_DELAY
+    
+    @classmethod
+    def is_due(cls, bet: Dict, now: datetime) -> bool:
+        due = cls.settle_due(bet['fixtures'])
+        return due is None or due <= now
+    
     async def check_pending_bets(self) -> List[Tuple[int, str, float]]:
-        """Проверява всички чакащи залози"""
-        pending = self.db.get_pending_bets()
+        """Проверява всички чакащи залози от една обща снимка на мачовете.
+        Залози, чиито мачове още не са стигнали SETTLE_DELAY, не се теглят."""
+        now = datetime.now(BG_TZ)
+        pending = [bet for bet in await self.db.get_pending_bets() if self.is_due(bet, now)]
+        if not pending:
+            return []
+        
+        fixture_ids = {f['fixture_id'] for bet in pending for f in bet['fixtures']}
+        snapshot = await self.api.get_fixture_results(list(fixture_ids))
+        logger.info(f"Fetched {len(snapshot)}/{len(fixture_ids)} fixtures for "
+                    f"{len(pending)} pending bets")
+        
         results = []
         
         for bet in pending:
             try:
                 all_finished = True
                 all_won = True
+                leg_odds = []  # коефициентите на неанулираните мачове
                 
                 for fixture_info in bet['fixtures']:
-                    fixture_id = fixture_info['fixture_id']
-                    result = await self.api.get_fixture_result(fixture_id)
+                    result = snapshot.get(fixture_info['fixture_id'])
                     
                     if not result:
                         all_finished = False
                         break
                     
+                    if self._is_void(result, fixture_info, now):
+                        logger.info(f"Bet {bet['id']}: fixture {fixture_info['fixture_id']} "
+                                    f"({result['fixture']['status']['short']}) is void")
+                        continue
+                    
                     status = result['fixture']['status']['short']
-                    if status not in ['FT', 'AET', 'PEN']:
+                    if status not in FINISHED_STATUSES:
                         all_finished = False
                         break
                     
@@ -546,21 +2503,42 @@ class ResultChecker:
                     won = self._check_bet_result(result, fixture_info)
                     if not won:
                         all_won = False
+                    leg_odds.append(fixture_info.get('odd'))
                 
                 if all_finished:
-                    if all_won:
-                        profit = bet['amount'] * bet['odd'] - bet['amount']
-                        results.append((bet['id'], 'won', profit))
+                    if len(leg_odds) == len(bet['fixtures']):
+                        odd = bet['odd']
+                    elif leg_odds and None not in leg_odds:
+                        odd = round(float(np.prod(leg_odds)), 2)
                     else:
+                        # Всички мачове са анулирани или стар залог без коефициент по мач
+                        odd = None
+                    
+                    if not all_won:
                         results.append((bet['id'], 'lost', -bet['amount']))
-                
-                await asyncio.sleep(1)
+                    elif odd is None:
+                        results.append((bet['id'], 'void', 0.0))
+                    else:
+                        profit = bet['amount'] * odd - bet['amount']
+                        results.append((bet['id'], 'won', profit))
                 
             except Exception as e:
                 logger.error(f"Check error: {e}")
         
         return results
     
+    @staticmethod
+    def _is_void(result: Dict, bet_info: Dict, now: datetime) -> bool:
+        """Анулиран мач: отменен/прекратен/присъден, или отложен и неизигран
+        POSTPONED_VOID_AFTER след първоначалния си час"""
+        status = result['fixture']['status']['short']
+        if status in VOID_STATUSES:
+            return True
+        if status not in POSTPONED_STATUSES:
+            return False
+        kickoff = datetime.fromisoformat((bet_info.get('date') or result['fixture']['date']).replace('Z', '+00:00'))
+        return now - kickoff >= POSTPONED_VOID_AFTER
+    
     def _check_bet_result(self, result: Dict, bet_info: Dict) -> bool:
         """Проверява дали конкретен залог е спечелен"""
         try:
@@ -589,15 +2567,222 @@ class ResultChecker:
         
         return False
 
+class Scheduler:
+    """Cron задачи (всеки ден в дадени часове) и еднократни таймери.
+    
+    Последният изпълнен слот на всяка cron задача се пази в базата, така че
+    всеки слот се изпълнява точно веднъж, а пропуснат слот (рестарт) се
+    наваксва при старт, ако е в рамките на grace периода на задачата.
+    """
+    
+    def __init__(self, db: AsyncDatabase, clock: Optional[Callable[[], datetime]] = None):
+        self.db = db
+        self.clock = clock or (lambda: datetime.now(BG_TZ))
+        self._cron: Dict[str, Tuple[List[int], int, Callable, timedelta]] = {}
+        self._timers = []  # heap (when, seq, name, fn)
+        self._timer_names = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+    
+    def add_cron(self, name: str, hours: List[int], fn: Callable, minute: int = 0,
+                 grace: timedelta = timedelta(hours=1)):
+        self._cron[name] = (sorted(hours), minute, fn, grace)
+    
+    def schedule_at(self, name: str, when: datetime, fn: Callable):
+        """Еднократен таймер; таймер със същото име, който още чака, не се дублира"""
+        if name in self._timer_names:
+            return
+        self._timer_names.add(name)
+        heapq.heappush(self._timers, (when, next(self._seq), name, fn))
+        self._wakeup.set()
+    
+    def _slots(self, name: str, day) -> List[datetime]:
+        hours, minute, _, _ = self._cron[name]
+        return [BG_TZ.localize(datetime.combine(day, dt_time(hour, minute))) for hour in hours]
+    
+    def _next_slot(self, name: str, after: datetime) -> datetime:
+        day = after.date()
+        while True:
+            for slot in self._slots(name, day):
+                if slot > after:
+                    return slot
+            day += timedelta(days=1)
+    
+    def _previous_slot(self, name: str, now: datetime) -> Optional[datetime]:
+        for day in (now.date(), now.date() - timedelta(days=1)):
+            slots = [slot for slot in self._slots(name, day) if slot <= now]
+            if slots:
+                return slots[-1]
+        return None
+    
+    def _schedule_cron(self, name: str, slot: datetime, when: Optional[datetime] = None):
+        async def run_slot():
+            try:
+                await self._cron[name][2]()
+            finally:
+                # Слотът се брои за изпълнен и при грешка - не го повтаряме безкрайно
+                self._schedule_cron(name, self._next_slot(name, max(slot, self.clock())))
+                await self.db.set_job_run(name, slot.isoformat())
+        
+        self.schedule_at(f"{name}@{slot.isoformat()}", when or slot, run_slot)
+    
+    async def start(self):
+        now = self.clock()
+        last_runs = await self.db.get_job_runs()
+        
+        for name, (_, _, _, grace) in self._cron.items():
+            previous = self._previous_slot(name, now)
+            last_run = last_runs.get(name)
+            
+            if previous is not None and now - previous <= grace and \
+                    (last_run is None or datetime.fromisoformat(last_run) < previous):
+                logger.info(f"⏰ Catching up missed {name} slot {previous.strftime('%d.%m %H:%M')}")
+                self._schedule_cron(name, previous, when=now)
+            else:
+                self._schedule_cron(name, self._next_slot(name, now))
+    
+    async def run(self):
+        await self.start()
+        
+        while True:
+            now = self.clock()
+            
+            if self._timers and self._timers[0][0] <= now:
+                _, _, name, fn = heapq.heappop(self._timers)
+                self._timer_names.discard(name)
+                try:
+                    await fn()
+                except Exception as e:
+                    logger.error(f"Job {name} error: {e}")
+                    logger.error(traceback.format_exc())
+                continue
+            
+            # Спим до следващия таймер (най-много минута - часовникът може да скочи)
+            timeout = 60.0
+            if self._timers:
+                timeout = min(timeout, max(0.0, (self._timers[0][0] - now).total_seconds()))
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
 # Telegram Notification System with buttons
 class TelegramNotifier:
-    def __init__(self, token: str, channel_id: str, db: DatabaseManager):
+    """Съобщенията влизат в outbox таблицата, а run() ги изпраща във фонов режим"""
+    
+    def __init__(self, token: str, channel_id: str, db: AsyncDatabase):
         self.bot = Bot(token=token)
         self.channel_id = channel_id
         self.db = db
+        self._wakeup = asyncio.Event()
+        # chat_id -> най-ранното време (time.time()) за следващо съобщение
+        self._next_send: Dict[str, float] = {}
+    
+    async def _enqueue(self, kind: str, texts: List[str], chat_id: Optional[str] = None):
+        chat_id = chat_id or self.channel_id
+        await self.db.enqueue_messages([(chat_id, kind, text) for text in texts])
+        self._wakeup.set()
+    
+    async def run(self):
+        """Изпраща опашката; събужда се при ново съобщение или когато изтече изчакване"""
+        while True:
+            self._wakeup.clear()
+            try:
+                delay = await self._flush()
+            except Exception as e:
+                logger.error(f"Telegram queue error: {e}")
+                delay = 30
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _flush(self) -> float:
+        """Изпраща всичко, което може сега; връща след колко секунди да се опита пак"""
+        messages = await self.db.get_outbox()
+        METRICS.set('telegram_queue_size', len(messages))
+        delay = 300.0
+        blocked = set()  # чатове с чакащо съобщение - пазим реда
+        
+        i = 0
+        while i < len(messages):
+            message = messages[i]
+            chat_id = message['chat_id']
+            i += 1
+            if chat_id in blocked:
+                continue
+            
+            wait = max(message['next_attempt'], self._next_send.get(chat_id, 0)) - time.time()
+            if wait > 0:
+                blocked.add(chat_id)
+                delay = min(delay, wait)
+                continue
+            
+            # Поредните резултати за един чат излизат като едно съобщение
+            batch = [message]
+            length = len(message['text'])
+            while (message['kind'] == 'result' and i < len(messages)
+                   and messages[i]['chat_id'] == chat_id and messages[i]['kind'] == 'result'
+                   and length + len(messages[i]['text']) + 2 <= TELEGRAM_MESSAGE_LIMIT):
+                length += len(messages[i]['text']) + 2
+                batch.append(messages[i])
+                i += 1
+            
+            if not await self._deliver(batch):
+                blocked.add(chat_id)
+            delay = min(delay, max(0.0, self._next_send.get(chat_id, 0) - time.time()))
+        
+        return delay
+    
+    async def _deliver(self, batch: List[Dict]) -> bool:
+        chat_id = batch[0]['chat_id']
+        kind = batch[0]['kind']
+        ids = [message['id'] for message in batch]
+        
+        try:
+            with METRICS.time('telegram_send_seconds', kind=kind):
+                await self.bot.send_message(
+                    chat_id=chat_id,
+                    text='\n\n'.join(message['text'] for message in batch),
+                    parse_mode='HTML'
+                )
+        except RetryAfter as e:
+            retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) \
+                else e.retry_after.total_seconds()
+            self._next_send[chat_id] = time.time() + retry_after
+            logger.warning(f"Telegram flood control: {kind} message retried in {retry_after}s")
+            return False
+        except BadRequest as e:
+            # Наследява NetworkError, но повторението няма да помогне
+            logger.error(f"Telegram rejected {kind} message: {e}")
+            await self.db.delete_messages(ids)
+            return True
+        except NetworkError as e:
+            attempts = batch[0]['attempts'] + 1
+            if attempts >= TELEGRAM_MAX_ATTEMPTS:
+                logger.error(f"Telegram {kind} message dropped after {attempts} attempts: {e}")
+                await self.db.delete_messages(ids)
+                return True
+            backoff = min(TELEGRAM_MAX_BACKOFF, 5 * 2 ** attempts)
+            logger.warning(f"Telegram network error ({e}), {kind} message retried in {backoff}s")
+            await self.db.defer_messages(ids, attempts, time.time() + backoff)
+            return False
+        except TelegramError as e:
+            # Forbidden и т.н.
+            logger.error(f"Telegram rejected {kind} message: {e}")
+            await self.db.delete_messages(ids)
+            return True
+        
+        await self.db.delete_messages(ids)
+        self._next_send[chat_id] = time.time() + TELEGRAM_CHAT_INTERVAL
+        logger.info(f"Sent {kind} message" + (f" ({len(batch)} merged)" if len(batch) > 1 else ""))
+        return True
     
     async def send_bet_notification(self, combination: Dict, bet_amount: float, 
-                                    bet_number: int):
+                                    bet_number: int, chat_id: Optional[str] = None):
         message = f"🎯 <b>ЗАЛОГ #{bet_number}</b>\n\n"
         message += f"💰 Сума: {bet_amount:.2f} EUR\n"
         message += f"📊 Коефициент: {combination['total_odd']:.2f}\n"
@@ -607,13 +2792,13 @@ class TelegramNotifier:
         message += "<b>══════════════</b>\n"
         
         for idx, bet in enumerate(combination['bets'], 1):
-            fixture = bet['fixture']
-            home = fixture['teams']['home']['name']
-            away = fixture['teams']['away']['name']
+            fixture = combination['fixtures'][bet.fixture_id]
+            home = fixture.home
+            away = fixture.away
             
             try:
                 time = datetime.fromisoformat(
-                    fixture['fixture']['date'].replace('Z', '+00:00')
+                    fixture.date.replace('Z', '+00:00')
                 ).astimezone(BG_TZ)
                 time_str = time.strftime('%H:%M')
             except:
@@ -621,38 +2806,35 @@ class TelegramNotifier:
             
             message += f"<b>{idx}. {home} vs {away}</b>\n"
             message += f"   🕐 {time_str}\n"
-            message += f"   🎲 {bet['type']}\n"
-            message += f"   📈 @ {bet['odd']:.2f}\n\n"
+            message += f"   🎲 {bet.type}\n"
+            message += f"   📈 @ {bet.odd:.2f}" + (f" ({bet.bookmaker})" if bet.bookmaker else "") + "\n\n"
         
-        try:
-            await self.bot.send_message(
-                chat_id=self.channel_id,
-                text=message,
-                parse_mode='HTML'
-            )
-            logger.info(f"Sent bet #{bet_number}")
-        except TelegramError as e:
-            logger.error(f"Telegram error: {e}")
+        await self._enqueue('bet', [message], chat_id)
     
-    async def send_result_notification(self, bet_id: int, result: str, profit: float):
-        emoji = "🎉" if result == "won" else "😔"
-        message = f"{emoji} <b>РЕЗУЛТАТ ЗАЛОГ #{bet_id}</b>\n\n"
-        
-        if result == "won":
-            message += f"✅ СПЕЧЕЛЕН!\n💰 Печалба: +{profit:.2f} EUR"
-        else:
-            message += f"❌ ЗАГУБЕН\n💸 Загуба: {profit:.2f} EUR"
+    async def send_result_notification(self, bet_id: int, result: str, profit: float,
+                                       chat_id: Optional[str] = None):
+        await self.send_result_notifications([(bet_id, result, profit)], chat_id)
+    
+    async def send_result_notifications(self, results: List[Tuple[int, str, float]],
+                                        chat_id: Optional[str] = None):
+        """Резултатите от една проверка влизат заедно и се изпращат като едно съобщение"""
+        messages = []
+        for bet_id, result, profit in results:
+            emoji = {"won": "🎉", "void": "↩️"}.get(result, "😔")
+            message = f"{emoji} <b>РЕЗУЛТАТ ЗАЛОГ #{bet_id}</b>\n\n"
+            
+            if result == "won":
+                message += f"✅ СПЕЧЕЛЕН!\n💰 Печалба: +{profit:.2f} EUR"
+            elif result == "void":
+                message += "⚪ АНУЛИРАН - мачовете не се изиграха, сумата се връща"
+            else:
+                message += f"❌ ЗАГУБЕН\n💸 Загуба: {profit:.2f} EUR"
+            messages.append(message)
         
-        try:
-            await self.bot.send_message(
-                chat_id=self.channel_id,
-                text=message,
-                parse_mode='HTML'
-            )
-        except:
-            pass
+        if messages:
+            await self._enqueue('result', messages, chat_id)
     
-    async def send_daily_summary(self, stats: Dict):
+    async def send_daily_summary(self, stats: Dict, chat_id: Optional[str] = None):
         message = f"📊 <b>ДНЕВЕН ОТЧЕТ</b>\n\n"
         message += f"🎲 Общо залози: {stats['total_bets']}\n"
         message += f"✅ Спечелени: {stats['won_bets']}\n"
@@ -662,14 +2844,7 @@ class TelegramNotifier:
         message += f"💵 Печалба/Загуба: {stats['total_profit']:.2f} EUR\n"
         message += f"📈 Success Rate: {stats['success_rate']:.1f}%"
         
-        try:
-            await self.bot.send_message(
-                chat_id=self.channel_id,
-                text=message,
-                parse_mode='HTML'
-            )
-        except:
-            pass
+        await self._enqueue('summary', [message], chat_id)
 
 # Web endpoints
 async def health_check(request):
@@ -678,12 +2853,46 @@ async def health_check(request):
 
 async def status(request):
     now = datetime.now(BG_TZ)
+    api = request.app.get('api')
     return web.json_response({
         "status": "active",
         "version": "2.0",
-        "bg_time": now.strftime('%Y-%m-%d %H:%M:%S')
+        "bg_time": now.strftime('%Y-%m-%d %H:%M:%S'),
+        "api_quota_left": api.limiter.remaining_today() if api else None,
+        "api_cache": api.cache.stats() if api and api.cache else None
     })
 
+async def metrics(request):
+    """Prometheus scrape; броячите на кеша и квотата се четат в момента на заявката"""
+    api = request.app.get('api')
+    if api is not None:
+        METRICS.set('api_quota_remaining', api.limiter.remaining_today())
+        if api.cache is not None:
+            stats = api.cache.stats()
+            METRICS.set('api_cache_hits_total', stats['hits'])
+            METRICS.set('api_cache_misses_total', stats['misses'])
+            METRICS.set('api_cache_hit_ratio', stats['hit_rate'] / 100)
+    return web.Response(text=METRICS.render(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def telegram_webhook(request):
+    """Update от Telegram; влиза в опашката на Application, за да отговорим веднага"""
+    telegram_app = request.app.get('telegram')
+    if telegram_app is None or telegram_app.updater is not None:
+        raise web.HTTPNotFound()
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not secrets.compare_digest(token, TELEGRAM_WEBHOOK_SECRET):
+        raise web.HTTPForbidden()
+    
+    try:
+        update = Update.de_json(await request.json(), telegram_app.bot)
+    except ValueError:
+        raise web.HTTPBadRequest()
+    
+    METRICS.inc('telegram_updates_total')
+    await telegram_app.update_queue.put(update)
+    return web.Response()
+
 async def keep_alive():
     while True:
         try:
@@ -695,15 +2904,26 @@ async def keep_alive():
             pass
 
 # Main bot loop
-async def bot_loop():
-    api = FootballAPI(API_FOOTBALL_KEY)
-    db = DatabaseManager()
-    selector = AdvancedBetSelector(api)
-    strategy = BettingStrategy(db)
+async def bot_loop(api: FootballAPI, db: AsyncDatabase, selector: AdvancedBetSelector,
+                   profiles: List[BettingProfile]):
+    # Всеки профил има своя прогресия; мачовете, опциите и търсенето са общи
+    strategies = {profile.name: BettingStrategy(db, profile) for profile in profiles}
+    channels = {profile.name: profile.channel_id for profile in profiles}
     notifier = TelegramNotifier(TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, db)
     result_checker = ResultChecker(api, db)
+    scheduler = Scheduler(db, clock=api.clock)
+    selector.calibration = Calibration.load()
+    if selector.calibration is not None:
+        logger.info(f"Calibration loaded: {len(selector.calibration.table)} cells "
+                    f"from {selector.calibration.samples} settled legs")
+    pipeline = FixturePipeline(api, selector, db, clock=api.clock) if PIPELINE_ENABLED else None
+    selector.pipeline = pipeline
     
     logger.info("Advanced Bot v2.0 Starting!")
+    for profile in profiles:
+        logger.info(f"Profile {profile.name}: odds {profile.odd_min}-{profile.odd_max}, "
+                    f"stake {profile.initial_bet} x{profile.multiplier}, "
+                    f"{profile.max_bets_per_day} bets/day -> {profile.channel_id}")
     
     # Test API connection at start
     try:
@@ -713,95 +2933,145 @@ async def bot_loop():
     except Exception as e:
         logger.error(f"❌ API test failed: {e}")
     
-    used_fixture_ids = []
-    last_check_date = None
-    last_result_check = datetime.now(BG_TZ)
-    last_daily_summary = None
+    # След рестарт не залагаме отново на мачове, използвани днес от същия профил
+    today = str(datetime.now(BG_TZ).date())
+    used_fixture_ids = {profile.name: set(await db.get_daily_fixture_ids(today, profile.name))
+                        for profile in profiles}
     
-    while True:
-        try:
-            now = datetime.now(BG_TZ)
-            current_date = now.date()
-            current_hour = now.hour
-            
-            # New day reset
-            if last_check_date != current_date:
-                strategy.reset_daily()
-                used_fixture_ids = []
-                last_check_date = current_date
-                logger.info(f"NEW DAY: {current_date}")
-            
-            # Check results every 30 minutes
-            if (now - last_result_check).seconds > 1800:
-                logger.info("Checking pending bet results...")
-                results = await result_checker.check_pending_bets()
-                
-                for bet_id, result, profit in results:
-                    db.update_bet_result(bet_id, result, profit)
-                    await notifier.send_result_notification(bet_id, result, profit)
-                    
-                    # Update martingale
-                    strategy.calculate_next_bet(result == 'won')
-                
-                last_result_check = now
+    def schedule_settlement(bet_fixtures: List[Dict]):
+        """Проверка на резултатите SETTLE_DELAY след началото на последния мач"""
+        now = datetime.now(BG_TZ)
+        due = ResultChecker.settle_due(bet_fixtures)
+        when = now if due is None else max(now, due)
+        scheduler.schedule_at(f"settle@{when.strftime('%Y%m%d%H%M')}", when, check_results)
+    
+    async def new_day():
+        for strategy in strategies.values():
+            strategy.reset_daily()
+        for fixture_ids in used_fixture_ids.values():
+            fixture_ids.clear()
+        logger.info(f"NEW DAY: {datetime.now(BG_TZ).date()}")
+        
+        downsampled, removed = await db.compact_odds_history(int(time.time()))
+        logger.info(f"Odds history compacted: {downsampled} downsampled, {removed} expired samples removed")
+    
+    settle_retries = [0]  # поредни проверки без приключил залог
+    
+    async def check_results():
+        logger.info("Checking pending bet results...")
+        profile_of = {bet['id']: bet['profile'] for bet in await db.get_pending_bets()}
+        results = await result_checker.check_pending_bets()
+        
+        by_channel: Dict[str, List[Tuple[int, str, float]]] = {}
+        for bet_id, result, profit in results:
+            await db.update_bet_result(bet_id, result, profit)
+            
+            # Update martingale (профил, махнат от конфигурацията, вече няма прогресия)
+            # Анулиран залог връща сумата и не мести прогресията
+            strategy = strategies.get(profile_of.get(bet_id))
+            if strategy is not None and result != 'void':
+                strategy.calculate_next_bet(result == 'won')
+            
+            clv = await db.get_bet_clv(bet_id)
+            if clv is not None:
+                logger.info(f"Bet {bet_id} closing-line value: {clv:+.1%}")
+            
+            channel = channels.get(profile_of.get(bet_id), TELEGRAM_CHANNEL_ID)
+            by_channel.setdefault(channel, []).append((bet_id, result, profit))
+        
+        for channel, channel_results in by_channel.items():
+            await notifier.send_result_notifications(channel_results, channel)
+        
+        # Отложени или още неприключили мачове - нов опит по-късно, с удвояваща се пауза
+        # докато нищо не приключва. Залозите, които още не са на ред, имат собствен
+        # таймер от schedule_settlement.
+        settled = {bet_id for bet_id, _, _ in results}
+        settle_retries[0] = 0 if settled else settle_retries[0] + 1
+        now = datetime.now(BG_TZ)
+        if any(bet['id'] not in settled and ResultChecker.is_due(bet, now)
+               for bet in await db.get_pending_bets()):
+            when = now + min(SETTLE_RETRY * 2 ** max(settle_retries[0] - 1, 0), SETTLE_RETRY_MAX)
+            scheduler.schedule_at(f"settle@{when.strftime('%Y%m%d%H%M')}", when, check_results)
+    
+    async def daily_summary():
+        today = str(datetime.now(BG_TZ).date())
+        for profile in profiles:
+            stats = await db.get_daily_stats(today, profile.name)
+            await notifier.send_daily_summary(stats, profile.channel_id)
+    
+    async def smart_search():
+        active = [profile for profile in profiles
+                  if len(strategies[profile.name].bets_today) < profile.max_bets_per_day]
+        if not active:
+            return
+        
+        now = datetime.now(BG_TZ)
+        logger.info(f"Smart search at {now.strftime('%H:%M')} for {len(active)} profile(s)")
+        
+        combinations = await selector.find_profile_combinations(active, used_fixture_ids)
+        
+        for profile in active:
+            combination = combinations.get(profile.name)
+            if not combination:
+                logger.info(f"[{profile.name}] No suitable combination found")
+                continue
             
-            # Daily summary at 23:00
-            if current_hour == 23 and last_daily_summary != current_date:
-                stats = db.get_daily_stats(str(current_date))
-                await notifier.send_daily_summary(stats)
-                last_daily_summary = current_date
+            strategy = strategies[profile.name]
+            bet_number = len(strategy.bets_today) + 1
+            bet_amount = strategy.current_bet
             
-            # Smart betting - every 2 hours or when we have < 3 bets
-            should_search = False
+            # Save to DB
+            bet_data = {
+                'bet_number': bet_number,
+                'profile': profile.name,
+                'date': str(now.date()),
+                'amount': bet_amount,
+                'odd': combination['total_odd'],
+                'potential_win': bet_amount * combination['total_odd'],
+                'bet_type': ', '.join([b.bet_category for b in combination['bets']]),
+                'fixtures': [{
+                    'fixture_id': b.fixture_id,
+                    'home': combination['fixtures'][b.fixture_id].home,
+                    'away': combination['fixtures'][b.fixture_id].away,
+                    'date': combination['fixtures'][b.fixture_id].date,
+                    'prediction_key': b.prediction_key,
+                    'market': b.series_key()[0],
+                    'outcome': b.series_key()[1],
+                    'odd': b.odd,
+                    'bet_category': b.bet_category,
+                    'league_id': combination['fixtures'][b.fixture_id].league_id,
+                    'confidence': b.confidence if b.raw_confidence is None else b.raw_confidence
+                } for b in combination['bets']]
+            }
             
-            if current_hour in [8, 10, 12, 14, 16, 18, 20]:
-                if len(strategy.bets_today) < MAX_BETS_PER_DAY:
-                    should_search = True
+            await db.save_bet(bet_data)
             
-            if should_search:
-                logger.info(f"Smart search at {now.strftime('%H:%M')}")
-                
-                combination = await selector.find_smart_combination(used_fixture_ids)
-                
-                if combination:
-                    bet_number = len(strategy.bets_today) + 1
-                    bet_amount = strategy.current_bet
-                    
-                    # Save to DB
-                    bet_data = {
-                        'bet_number': bet_number,
-                        'date': str(current_date),
-                        'amount': bet_amount,
-                        'odd': combination['total_odd'],
-                        'potential_win': bet_amount * combination['total_odd'],
-                        'bet_type': ', '.join([b['bet_category'] for b in combination['bets']]),
-                        'fixtures': [{
-                            'fixture_id': b['fixture_id'],
-                            'home': b['fixture']['teams']['home']['name'],
-                            'away': b['fixture']['teams']['away']['name'],
-                            'prediction_key': b['prediction_key']
-                        } for b in combination['bets']]
-                    }
-                    
-                    db.save_bet(bet_data)
-                    
-                    await notifier.send_bet_notification(combination, bet_amount, bet_number)
-                    
-                    strategy.bets_today.append(combination)
-                    
-                    for bet in combination['bets']:
-                        used_fixture_ids.append(bet['fixture_id'])
-                    
-                    logger.info(f"Bet #{bet_number} placed!")
-                else:
-                    logger.info("No suitable combination found")
+            await notifier.send_bet_notification(combination, bet_amount, bet_number, profile.channel_id)
             
-            await asyncio.sleep(300)  # 5 minutes
+            strategy.bets_today.append(combination)
             
-        except Exception as e:
-            logger.error(f"Main loop error: {e}")
-            logger.error(traceback.format_exc())
-            await asyncio.sleep(60)
+            for bet in combination['bets']:
+                used_fixture_ids[profile.name].add(bet.fixture_id)
+            
+            schedule_settlement(bet_data['fixtures'])
+            
+            logger.info(f"[{profile.name}] Bet #{bet_number} placed!")
+    
+    scheduler.add_cron('new_day', [0], new_day, grace=timedelta(0))
+    scheduler.add_cron('smart_search', SEARCH_HOURS, smart_search, grace=timedelta(minutes=90))
+    scheduler.add_cron('daily_summary', [23], daily_summary, grace=timedelta(minutes=59))
+    
+    for bet in await db.get_pending_bets():
+        schedule_settlement(bet['fixtures'])
+    
+    pipeline_task = asyncio.create_task(pipeline.run()) if pipeline else None
+    notifier_task = asyncio.create_task(notifier.run())
+    try:
+        await scheduler.run()
+    finally:
+        notifier_task.cancel()
+        if pipeline_task:
+            pipeline_task.cancel()
 
 # Telegram bot commands handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -822,11 +3092,11 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    db = DatabaseManager()
+    db = context.bot_data['db']
     
     if query.data == 'stats':
         today = datetime.now(BG_TZ).date()
-        stats = db.get_daily_stats(str(today))
+        stats = await db.get_daily_stats(str(today))
         
         message = f"📊 <b>СТАТИСТИКИ ЗА ДНЕС</b>\n\n"
         message += f"🎲 Залози: {stats['total_bets']}\n"
@@ -845,12 +3115,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Моля изчакайте 1-2 минути..."
         )
         
-        # Trigger manual search
-        api = FootballAPI(API_FOOTBALL_KEY)
-        selector = AdvancedBetSelector(api)
+        # Същият селектор и ключ като bot_loop: едновременните натискания чакат едно търсене
+        selector = context.bot_data['selector']
+        profile = context.bot_data['profiles'][0]
         
         try:
-            combination = await selector.find_smart_combination([])
+            used_fixture_ids = await db.get_daily_fixture_ids(str(datetime.now(BG_TZ).date()), profile.name)
+            combinations = await selector.find_profile_combinations([profile], {profile.name: used_fixture_ids})
+            combination = combinations[profile.name]
             
             if combination:
                 message = "✅ Намерена комбинация!\n\n"
@@ -858,10 +3130,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 message += f"Вероятност: {combination['avg_confidence']:.1f}%\n\n"
                 
                 for idx, bet in enumerate(combination['bets'], 1):
-                    fixture = bet['fixture']
-                    message += f"{idx}. {fixture['teams']['home']['name']} vs "
-                    message += f"{fixture['teams']['away']['name']}\n"
-                    message += f"   {bet['type']} @ {bet['odd']:.2f}\n\n"
+                    fixture = combination['fixtures'][bet.fixture_id]
+                    message += f"{idx}. {fixture.home} vs {fixture.away}\n"
+                    message += f"   {bet.type} @ {bet.odd:.2f}\n\n"
                 
                 await query.edit_message_text(message)
             else:
@@ -872,18 +3143,20 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text(f"Грешка: {str(e)}")
     
     elif query.data == 'settings':
-        message = "⚙️ <b>НАСТРОЙКИ</b>\n\n"
-        message += f"💰 Начална сума: {INITIAL_BET} EUR\n"
-        message += f"📊 Целеви коефициент: {TARGET_ODD_MIN}-{TARGET_ODD_MAX}\n"
-        message += f"🎲 Макс залози/ден: {MAX_BETS_PER_DAY}\n"
-        message += f"📈 Мартингейл: x{MARTINGALE_MULTIPLIER}"
+        message = "⚙️ <b>НАСТРОЙКИ</b>"
+        for profile in context.bot_data['profiles']:
+            message += f"\n\n<b>{profile.name}</b>\n"
+            message += f"💰 Начална сума: {profile.initial_bet} EUR\n"
+            message += f"📊 Целеви коефициент: {profile.odd_min}-{profile.odd_max}\n"
+            message += f"🎲 Макс залози/ден: {profile.max_bets_per_day}\n"
+            message += f"📈 Мартингейл: x{profile.multiplier}"
         
         await query.edit_message_text(message, parse_mode='HTML')
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db = DatabaseManager()
+    db = context.bot_data['db']
     today = datetime.now(BG_TZ).date()
-    stats = db.get_daily_stats(str(today))
+    stats = await db.get_daily_stats(str(today))
     
     message = f"📊 <b>ДНЕВНИ СТАТИСТИКИ</b>\n\n"
     message += f"🎲 Общо залози: {stats['total_bets']}\n"
@@ -896,11 +3169,77 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message, parse_mode='HTML')
 
+async def telegram_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    logger.error(f"Telegram handler error: {context.error}")
+    logger.error(''.join(traceback.format_exception(context.error)))
+
+async def start_telegram(app):
+    """Командите и бутоните: webhook към TELEGRAM_WEBHOOK_PATH или polling локално"""
+    if TELEGRAM_UPDATES == 'off':
+        return
+    
+    # Ръчното търсене трае минути - другите updates не бива да чакат зад него
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(True)
+    if TELEGRAM_UPDATES == 'webhook':
+        builder = builder.updater(None)
+    telegram_app = builder.build()
+    telegram_app.add_handler(CommandHandler('start', start_command))
+    telegram_app.add_handler(CommandHandler('stats', stats_command))
+    telegram_app.add_handler(CallbackQueryHandler(button_handler))
+    telegram_app.add_error_handler(telegram_error)
+    telegram_app.bot_data['db'] = app['db']
+    telegram_app.bot_data['selector'] = app['selector']
+    telegram_app.bot_data['profiles'] = app['profiles']
+    
+    try:
+        await telegram_app.initialize()
+        if TELEGRAM_UPDATES == 'webhook':
+            url = TELEGRAM_WEBHOOK_URL.rstrip('/') + TELEGRAM_WEBHOOK_PATH
+            await telegram_app.bot.set_webhook(url, allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+                                               secret_token=TELEGRAM_WEBHOOK_SECRET)
+            logger.info(f"Telegram webhook set to {url}")
+        else:
+            await telegram_app.updater.start_polling(allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+                                                     bootstrap_retries=3)
+            logger.info("Telegram polling started")
+        await telegram_app.start()
+    except TelegramError as e:
+        logger.error(f"Telegram updates disabled: {e}")
+        await telegram_app.shutdown()
+        return
+    app['telegram'] = telegram_app
+
+async def stop_telegram(app):
+    telegram_app = app.get('telegram')
+    if telegram_app is None:
+        return
+    if telegram_app.updater is not None and telegram_app.updater.running:
+        await telegram_app.updater.stop()
+    await telegram_app.stop()
+    await telegram_app.shutdown()
+
 async def start_background_tasks(app):
-    app['bot_task'] = asyncio.create_task(bot_loop())
+    app['profiles'] = BettingProfile.load_all()
+    app['db'] = AsyncDatabase(DatabaseManager())
+    cache = ResponseCache(db=app['db'] if CACHE_PERSIST else None)
+    await cache.load()
+    store = ApiRecordStore() if API_MODE != 'live' else None
+    if store is not None and API_MODE == 'record':
+        logger.info(f"API cache warmed with {cache.warm(store.records())} recorded responses")
+    clock = None
+    if API_MODE == 'replay' and API_REPLAY_START:
+        offset = BG_TZ.localize(datetime.fromisoformat(API_REPLAY_START)) - datetime.now(BG_TZ)
+        clock = lambda: datetime.now(BG_TZ) + offset
+        logger.info(f"Replay clock starts at {API_REPLAY_START}")
+    app['api'] = FootballAPI(API_FOOTBALL_KEY, cache=cache, mode=API_MODE, store=store, clock=clock)
+    await app['api'].start()
+    app['selector'] = AdvancedBetSelector(app['api'], clock=app['api'].clock)
+    app['bot_task'] = asyncio.create_task(bot_loop(app['api'], app['db'], app['selector'], app['profiles']))
     app['keepalive_task'] = asyncio.create_task(keep_alive())
+    await start_telegram(app)
 
 async def cleanup_background_tasks(app):
+    await stop_telegram(app)
     app['bot_task'].cancel()
     app['keepalive_task'].cancel()
     try:
@@ -908,12 +3247,16 @@ async def cleanup_background_tasks(app):
         await app['keepalive_task']
     except:
         pass
+    await app['api'].close()
+    await app['db'].close()
 
 if __name__ == '__main__':
     # Web server
     app = web.Application()
     app.router.add_get('/', health_check)
     app.router.add_get('/status', status)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post(TELEGRAM_WEBHOOK_PATH, telegram_webhook)
     app.on_startup.append(start_background_tasks)
     app.on_cleanup.append(cleanup_background_tasks)
     
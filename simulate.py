@@ -0,0 +1,152 @@
+"""Monte Carlo оценка на риска от мартингейл прогресията.
+
+Симулира милиони поредици от залози (по MAX_BETS_PER_DAY на ден, залогът се
+нулира всеки ден и след печалба, а след загуба се умножава по
+MARTINGALE_MULTIPLIER). Вероятността за печалба и коефициентите се калибрират
+от приключилите залози в bets таблицата, освен ако не са зададени ръчно.
+Поредиците се смятат векторизирано с NumPy, на парчета в process pool.
+
+    python simulate.py --bankroll 200
+    python simulate.py --bankroll 500 --hit-rate 0.42 --odd 2.2 --sequences 5000000 --days 60
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import numpy as np
+
+from main import (DatabaseManager, DB_PATH, INITIAL_BET, MARTINGALE_MULTIPLIER,
+                  MAX_BETS_PER_DAY, TARGET_ODD_MIN, TARGET_ODD_MAX)
+
+CHUNK_SIZE = 250_000
+
+def calibrate(db_path: str = DB_PATH) -> Tuple[float, np.ndarray, int]:
+    """Hit rate и коефициенти от историята; без история - неутрална оценка от целевия коефициент"""
+    rows = []
+    if os.path.exists(db_path):
+        rows = [(odd, result) for odd, result in DatabaseManager(db_path, readonly=True).get_settled_bets()
+                if odd and result in ('won', 'lost')]
+    
+    if not rows:
+        odd = (TARGET_ODD_MIN + TARGET_ODD_MAX) / 2
+        return 1 / odd, np.array([odd]), 0
+    
+    won = sum(1 for _, result in rows if result == 'won')
+    return won / len(rows), np.array([odd for odd, _ in rows], dtype=np.float64), len(rows)
+
+def simulate_chunk(args: Tuple) -> Dict[str, np.ndarray]:
+    n, seed, hit_rate, odds, bankroll, initial_bet, multiplier, bets_per_day, days = args
+    rng = np.random.default_rng(seed)
+    
+    balance = np.full(n, bankroll, dtype=np.float64)
+    peak = balance.copy()
+    max_drawdown = np.zeros(n)
+    max_stake = np.zeros(n)
+    ruined = np.zeros(n, dtype=bool)
+    
+    for _ in range(days):
+        stake = np.full(n, initial_bet)
+        for _ in range(bets_per_day):
+            # Фалит: следващият залог не може да бъде покрит
+            placed = ~ruined & (stake <= balance + 1e-9)
+            ruined |= ~ruined & ~placed
+            
+            won = rng.random(n) < hit_rate
+            odd = odds[0] if len(odds) == 1 else rng.choice(odds, n)
+            balance += np.where(placed, np.where(won, stake * (odd - 1), -stake), 0.0)
+            max_stake = np.where(placed, np.maximum(max_stake, stake), max_stake)
+            
+            np.maximum(peak, balance, out=peak)
+            np.maximum(max_drawdown, peak - balance, out=max_drawdown)
+            
+            # Същото като BettingStrategy.calculate_next_bet
+            stake = np.where(placed, np.where(won, initial_bet, np.round(stake * multiplier, 2)), stake)
+    
+    return {
+        'max_stake': max_stake.astype(np.float32),
+        'max_drawdown': max_drawdown.astype(np.float32),
+        'final': balance.astype(np.float32),
+        'ruined': ruined
+    }
+
+def run(sequences: int, bankroll: float, hit_rate: float, odds: np.ndarray,
+        days: int = 30, bets_per_day: int = MAX_BETS_PER_DAY,
+        initial_bet: float = INITIAL_BET, multiplier: float = MARTINGALE_MULTIPLIER,
+        workers: int = None, seed: int = 0) -> Dict:
+    sizes = [CHUNK_SIZE] * (sequences // CHUNK_SIZE)
+    if sequences % CHUNK_SIZE:
+        sizes.append(sequences % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(n, s, hit_rate, odds, bankroll, initial_bet, multiplier, bets_per_day, days)
+            for n, s in zip(sizes, seeds)]
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = list(pool.map(simulate_chunk, jobs))
+    
+    merged = {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+    percentiles = [50, 90, 99, 99.9]
+    
+    def distribution(values: np.ndarray) -> Dict:
+        return {
+            'mean': round(float(values.mean()), 2),
+            **{f"p{p:g}": round(float(v), 2) for p, v in zip(percentiles, np.percentile(values, percentiles))},
+            'max': round(float(values.max()), 2)
+        }
+    
+    return {
+        'sequences': sequences,
+        'days': days,
+        'bets_per_day': bets_per_day,
+        'bankroll': bankroll,
+        'hit_rate': round(hit_rate, 4),
+        'ruin_probability': round(float(merged['ruined'].mean()), 6),
+        'max_stake': distribution(merged['max_stake']),
+        'max_drawdown': distribution(merged['max_drawdown']),
+        'final_bankroll': distribution(merged['final'])
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Monte Carlo risk of the martingale progression')
+    parser.add_argument('--bankroll', type=float, required=True)
+    parser.add_argument('--sequences', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=30, help='days per simulated sequence')
+    parser.add_argument('--bets-per-day', type=int, default=MAX_BETS_PER_DAY)
+    parser.add_argument('--initial-bet', type=float, default=INITIAL_BET)
+    parser.add_argument('--multiplier', type=float, default=MARTINGALE_MULTIPLIER)
+    parser.add_argument('--hit-rate', type=float, help='override the calibrated win probability')
+    parser.add_argument('--odd', type=float, help='override the calibrated odds with a fixed odd')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    
+    hit_rate, odds, history = calibrate(args.db)
+    if args.hit_rate is not None:
+        hit_rate = args.hit_rate
+    if args.odd is not None:
+        odds = np.array([args.odd])
+    
+    started = time.perf_counter()
+    report = run(args.sequences, args.bankroll, hit_rate, odds, days=args.days,
+                 bets_per_day=args.bets_per_day, initial_bet=args.initial_bet,
+                 multiplier=args.multiplier, workers=args.workers, seed=args.seed)
+    report['calibrated_from'] = history
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    
+    print(f"{report['sequences']:,} sequences x {report['days']} days x {report['bets_per_day']} bets "
+          f"in {report['seconds']}s (hit rate {report['hit_rate']:.1%}, "
+          f"{'from ' + str(history) + ' settled bets' if history else 'no history - implied from target odds'})")
+    print(f"Ruin probability with {args.bankroll:.2f} EUR: {report['ruin_probability']:.4%}")
+    for name in ('max_stake', 'max_drawdown', 'final_bankroll'):
+        print(f"  {name:15} " + '  '.join(f"{k}={v}" for k, v in report[name].items()))
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,61 @@
+"""api_requests_total/api_request_seconds и при грешки, timeout и повреден отговор"""
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from main import METRICS, FootballAPI
+
+def count(name: str, **labels) -> float:
+    return METRICS._values[name].get(tuple(sorted(labels.items())), 0.0)
+
+def observations(endpoint: str) -> float:
+    counts = METRICS._histograms['api_request_seconds'].get((('endpoint', endpoint),))
+    return sum(counts[:-1]) if counts else 0.0  # последната клетка е сумата
+
+async def handler(request: web.Request) -> web.Response:
+    endpoint = request.match_info['endpoint']
+    if endpoint == 'fail':
+        return web.Response(status=500, text='boom')
+    if endpoint == 'errors':
+        return web.json_response({'errors': {'token': 'invalid'}, 'response': []})
+    if endpoint == 'broken':
+        return web.Response(text='{"response": [', content_type='application/json')
+    if endpoint == 'slow':
+        await asyncio.sleep(1)
+    return web.json_response({'errors': [], 'response': []})
+
+async def run(calls):
+    app = web.Application()
+    app.router.add_get('/{endpoint}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    
+    api = FootballAPI('test')
+    api.BASE_URL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    api.limiter.per_minute = api.limiter.tokens = 1000
+    await api.start()
+    api._session._timeout = aiohttp.ClientTimeout(total=0.2)
+    try:
+        for endpoint in calls:
+            try:
+                await api._request(endpoint, {'n': len(calls)})
+            except Exception:
+                pass
+    finally:
+        await api.close()
+        await runner.cleanup()
+
+@pytest.mark.parametrize('endpoint, status', [
+    ('ok', 200), ('fail', 500), ('errors', 'api_error'), ('broken', 'error'), ('slow', 'timeout')
+])
+def test_every_request_is_counted_and_timed(endpoint, status):
+    before, timed = count('api_requests_total', endpoint=endpoint, status=status), observations(endpoint)
+    
+    asyncio.run(run([endpoint]))
+    
+    assert count('api_requests_total', endpoint=endpoint, status=status) == before + 1
+    assert observations(endpoint) == timed + 1
@@ -0,0 +1,73 @@
+"""Branch and bound търсенето при много опции с еднаква увереност (Over = 50, BTTS = 45)"""
+import itertools
+import logging
+import math
+import random
+
+import pytest
+
+import main
+from main import AdvancedBetSelector, BetOption
+
+def option(fixture_id: int, odd: float, confidence: float) -> BetOption:
+    return BetOption('Goals Over/Under', 'Over', odd, confidence, fixture_id, 'Over 2.5')
+
+def score(bets) -> float:
+    odd = math.prod(b.odd for b in bets)
+    avg_conf = sum(b.confidence for b in bets) / len(bets)
+    if len(bets) == 1:
+        return avg_conf
+    return avg_conf * (1 - abs(odd - main.ODD_SWEET_SPOT) / main.ODD_BONUS_RANGE)
+
+def brute_force(bets) -> float:
+    best = 0.0
+    for legs in range(1, main.COMBO_MAX_LEGS + 1):
+        for combo in itertools.combinations(bets, legs):
+            if len({b.fixture_id for b in combo}) < legs:
+                continue
+            odd = math.prod(b.odd for b in combo)
+            if main.TARGET_ODD_MIN - 1e-9 <= odd <= main.TARGET_ODD_MAX + 1e-9:
+                best = max(best, score(combo))
+    return best
+
+@pytest.fixture
+def selector():
+    return AdvancedBetSelector(None)
+
+def test_low_odds_with_top_confidence_do_not_hide_the_double(selector, caplog):
+    # 1.08^5 не стига прозореца - средната увереност 80 не бива да държи търсенето там
+    bets = [option(i, 1.08, 80.0) for i in range(60)] + [option(100 + i, 1.5, 60.0) for i in range(2)]
+    
+    with caplog.at_level(logging.WARNING, logger='main'):
+        combo = selector._find_best_combination(bets)
+    
+    assert combo is not None
+    assert [b.odd for b in combo['bets']] == [1.5, 1.5]
+    assert 'incomplete' not in caplog.text
+
+@pytest.mark.parametrize('legs', [3, 4])
+@pytest.mark.parametrize('seed', range(5))
+def test_tied_confidences_match_brute_force(selector, monkeypatch, legs, seed):
+    monkeypatch.setattr(main, 'COMBO_MAX_LEGS', legs)
+    rng = random.Random(seed)
+    bets = [option(i // 2, round(rng.uniform(1.1, 1.95), 2), rng.choice([50.0, 50.0, 45.0]))
+            for i in range(24)]
+    
+    combo = selector._find_best_combination(list(bets))
+    
+    assert combo is not None
+    assert score(combo['bets']) >= brute_force(bets) - main.COMBO_SCORE_TOLERANCE
+
+@pytest.mark.parametrize('seed', range(3))
+def test_tied_confidences_finish_without_the_expansion_cap(selector, monkeypatch, caplog, seed):
+    # 30 мача по 8 опции, без единичен залог в прозореца
+    monkeypatch.setattr(main, 'COMBO_MAX_LEGS', 5)
+    rng = random.Random(seed)
+    bets = [option(i // 8, round(rng.uniform(1.1, 1.95), 2), rng.choice([50.0, 50.0, 45.0]))
+            for i in range(240)]
+    
+    with caplog.at_level(logging.WARNING, logger='main'):
+        combo = selector._find_best_combination(bets)
+    
+    assert combo is not None
+    assert 'incomplete' not in caplog.text
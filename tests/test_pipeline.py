@@ -0,0 +1,50 @@
+"""FixturePipeline: списъкът с мачове при ограничена дневна квота"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytz
+
+import main
+from main import BG_TZ, FixturePipeline, ResponseCache
+
+NOW = BG_TZ.localize(datetime(2026, 3, 14, 10))
+
+def fixture(fixture_id: int, kickoff: datetime) -> dict:
+    return {'fixture': {'id': fixture_id, 'date': kickoff.astimezone(pytz.utc).isoformat(),
+                        'status': {'short': 'NS'}},
+            'teams': {'home': {'name': f'Home {fixture_id}'}, 'away': {'name': f'Away {fixture_id}'}},
+            'league': {'id': 39, 'name': 'Premier League'}}
+
+class FakeAPI:
+    def __init__(self, listings):
+        self.listings = listings
+        self.calls = []
+    
+    async def get_live_fixtures(self, excluded_ids=None, days=(0, 1)):
+        self.calls.append(tuple(days))
+        return [f for offset in days for f in self.listings.get(offset, [])]
+
+def test_only_tomorrow_is_refreshed_after_the_first_load():
+    now = {'at': NOW}
+    api = FakeAPI({0: [fixture(1, NOW + timedelta(hours=2)), fixture(2, NOW + timedelta(hours=8))],
+                   1: [fixture(3, NOW + timedelta(days=1)), fixture(4, NOW + timedelta(days=1, hours=2))]})
+    pipeline = FixturePipeline(api, None, clock=lambda: now['at'])
+    
+    asyncio.run(pipeline.refresh_fixtures())
+    assert set(pipeline.fixture_table) == {1, 2, 3, 4}
+    
+    # Мач 1 е започнал, мач 4 е изчезнал от утрешния списък - днешният не се тегли
+    now['at'] = NOW + timedelta(hours=3)
+    api.listings[1] = api.listings[1][:1]
+    asyncio.run(pipeline.refresh_fixtures())
+    
+    assert api.calls == [(0, 1), (1,)]
+    assert set(pipeline.fixture_table) == {2, 3}
+
+def test_listing_refreshes_fit_the_daily_quota():
+    refreshes = timedelta(days=1) / main.PIPELINE_FIXTURES_REFRESH
+    assert refreshes <= main.API_REQUESTS_PER_DAY * main.PIPELINE_FIXTURES_QUOTA_SHARE + 1e-9
+    
+    # Кешът на списъка не изтича преди следващото опресняване
+    ttl = ResponseCache().ttl_for('fixtures', {'date': '2026-03-14'}, {})
+    assert main.PIPELINE_FIXTURES_REFRESH.total_seconds() - 60 <= ttl < main.PIPELINE_FIXTURES_REFRESH.total_seconds()
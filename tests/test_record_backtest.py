@@ -0,0 +1,109 @@
+"""Записан live трафик (API_MODE=record) -> корпус -> backtest, без външна мрежа"""
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta, time as dt_time
+
+import pytz
+from aiohttp import web
+
+from backtest import Backtester, ReplayCorpus
+from main import ApiRecordStore, BG_TZ, FootballAPI
+
+FIXTURE_IDS = range(1000, 1012)
+
+def make_fixture(fixture_id: int, finished: bool) -> dict:
+    # Утре вечер - мачът е в бъдещето при записа и в прозореца на търсенето в backtest-а
+    tomorrow = datetime.now(BG_TZ).date() + timedelta(days=1)
+    kickoff = BG_TZ.localize(datetime.combine(tomorrow, dt_time(20, fixture_id % 60)))
+    return {
+        'fixture': {'id': fixture_id, 'date': kickoff.astimezone(pytz.utc).isoformat(),
+                    'status': {'short': 'FT' if finished else 'NS'}},
+        'league': {'id': 39, 'name': 'Premier League', 'country': 'England'},
+        'teams': {'home': {'id': fixture_id, 'name': f'Home {fixture_id}'},
+                  'away': {'id': fixture_id + 500, 'name': f'Away {fixture_id}'}},
+        'goals': {'home': fixture_id % 3, 'away': fixture_id % 2} if finished else {'home': None, 'away': None}
+    }
+
+def make_prediction(fixture_id: int) -> dict:
+    return {'predictions': {'percent': {'home': '70%', 'draw': '20%', 'away': '10%'}}}
+
+def make_odds(fixture_id: int) -> dict:
+    return {'fixture': {'id': fixture_id}, 'bookmakers': [{'id': 8, 'name': 'Bet365', 'bets': [
+        {'id': 1, 'name': 'Match Winner', 'values': [
+            {'value': 'Home', 'odd': f"{2.0 + fixture_id % 5 / 10:.2f}"},
+            {'value': 'Draw', 'odd': '3.40'}, {'value': 'Away', 'odd': '4.50'}]}
+    ]}]}
+
+async def record(directory: str):
+    state = {'finished': False}
+    
+    async def handler(request: web.Request) -> web.Response:
+        endpoint, query = request.match_info['endpoint'], request.query
+        if endpoint == 'fixtures':
+            response = [make_fixture(fid, state['finished']) for fid in FIXTURE_IDS]
+        elif endpoint == 'predictions':
+            response = [make_prediction(int(query['fixture']))]
+        else:
+            response = [make_odds(int(query['fixture']))]
+        return web.json_response({'errors': [], 'results': len(response), 'response': response})
+    
+    app = web.Application()
+    app.router.add_get('/{endpoint}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    
+    store = ApiRecordStore(directory)
+    api = FootballAPI('test', mode='record', store=store)
+    api.BASE_URL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    api.limiter.per_minute = api.limiter.tokens = 1000
+    try:
+        upcoming = await api.get_live_fixtures()
+        assert {f['fixture']['id'] for f in upcoming} == set(FIXTURE_IDS)
+        for fixture in upcoming:
+            await api.get_predictions(fixture['fixture']['id'])
+            await api.get_odds(fixture['fixture']['id'])
+        
+        # Мачовете приключват - следващото опресняване вече няма предстоящи,
+        # но записът пази пълния списък с крайните резултати
+        state['finished'] = True
+        assert await api.get_live_fixtures() == []
+    finally:
+        await api.close()
+        store.close()
+        await runner.cleanup()
+
+def test_recorded_traffic_backtests(tmp_path):
+    asyncio.run(record(str(tmp_path)))
+    
+    corpus = ReplayCorpus.load(str(tmp_path))
+    assert set(corpus.final) == set(FIXTURE_IDS)
+    assert all(f['fixture']['status']['short'] == 'FT' for f in corpus.final.values())
+    assert set(corpus.predictions) == set(corpus.odds) == set(FIXTURE_IDS)
+    
+    report = Backtester(corpus).run()
+    assert report['bets'] > 0
+    assert report['won'] + report['lost'] == report['bets']
+
+def test_replay_follows_its_clock_and_filter(tmp_path):
+    # Запис от друг ден: списъкът за 14.03 е взет в 09:00, когато единият мач е приключил
+    recorded_at = BG_TZ.localize(datetime(2026, 3, 14, 9))
+    listing = [make_fixture(1000, True), make_fixture(1001, False)]
+    for fixture, hour in zip(listing, (8, 20)):
+        fixture['fixture']['date'] = BG_TZ.localize(datetime(2026, 3, 14, hour)).astimezone(pytz.utc).isoformat()
+    record = {'t': recorded_at.timestamp(), 'e': 'fixtures', 'p': {'date': '2026-03-14', 'timezone': 'Europe/Sofia'},
+              'd': {'errors': [], 'results': 2, 'response': listing}}
+    with gzip.open(tmp_path / 'api-20260314.jsonl.gz', 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+    
+    now = {'at': recorded_at + timedelta(hours=1)}
+    api = FootballAPI('test', mode='replay', store=ApiRecordStore(str(tmp_path)), clock=lambda: now['at'])
+    
+    upcoming = asyncio.run(api.get_live_fixtures())
+    assert [f['fixture']['id'] for f in upcoming] == [1001]
+    
+    # Преди момента на записа списъкът още не съществува
+    now['at'] = recorded_at - timedelta(hours=1)
+    assert asyncio.run(api.get_live_fixtures()) == []
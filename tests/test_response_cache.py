@@ -0,0 +1,36 @@
+"""Персистентният ResponseCache минава само през writer нишката на AsyncDatabase"""
+import asyncio
+import threading
+import time
+
+from main import AsyncDatabase, DatabaseManager, ResponseCache
+
+def test_cache_survives_restart_through_the_writer_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bets.db')
+    threads = set()
+    for name in ('load_api_cache', 'save_api_cache'):
+        original = getattr(DatabaseManager, name)
+        def spy(self, *args, _original=original):
+            threads.add(threading.current_thread().name)
+            return _original(self, *args)
+        monkeypatch.setattr(DatabaseManager, name, spy)
+    
+    async def session(fill: bool) -> ResponseCache:
+        db = AsyncDatabase(DatabaseManager(path))
+        cache = ResponseCache(db=db)
+        await cache.load()
+        if fill:
+            cache.set('fixtures?date=2026-03-14', {'response': [1, 2]}, 3600)
+            cache.set('odds?fixture=1', {'response': []}, 3600)
+            cache.set('odds?fixture=2', {'response': []}, 0.01)
+        await db.close()
+        return cache
+    
+    asyncio.run(session(fill=True))
+    time.sleep(0.02)
+    cache = asyncio.run(session(fill=False))
+    
+    assert cache.get('fixtures?date=2026-03-14') == {'response': [1, 2]}
+    assert cache.get('odds?fixture=1') == {'response': []}
+    assert cache.stats()['entries'] == 2
+    assert threads == {'db-writer'}
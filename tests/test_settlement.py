@@ -0,0 +1,62 @@
+"""ResultChecker при отменени и отложени мачове"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytz
+
+from main import BG_TZ, POSTPONED_VOID_AFTER, SETTLE_DELAY, ResultChecker
+
+class FakeAPI:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+    
+    async def get_fixture_results(self, fixture_ids):
+        return {fid: self.snapshot[fid] for fid in fixture_ids if fid in self.snapshot}
+
+class FakeDB:
+    def __init__(self, bets):
+        self.bets = bets
+    
+    async def get_pending_bets(self):
+        return self.bets
+
+def kickoff(hours_ago: float) -> str:
+    when = datetime.now(BG_TZ) - timedelta(hours=hours_ago)
+    return when.astimezone(pytz.utc).isoformat()
+
+def result(fixture_id: int, status: str, home: int = 0, away: int = 0, hours_ago: float = 3) -> dict:
+    return {'fixture': {'id': fixture_id, 'date': kickoff(hours_ago), 'status': {'short': status}},
+            'goals': {'home': home, 'away': away}}
+
+def leg(fixture_id: int, odd: float, hours_ago: float = 3) -> dict:
+    return {'fixture_id': fixture_id, 'prediction_key': 'home', 'odd': odd, 'date': kickoff(hours_ago)}
+
+def check(bets, snapshot):
+    checker = ResultChecker(FakeAPI({r['fixture']['id']: r for r in snapshot}), FakeDB(bets))
+    return asyncio.run(checker.check_pending_bets())
+
+def test_cancelled_leg_is_settled_at_the_remaining_odd():
+    bet = {'id': 1, 'amount': 10.0, 'odd': 3.0, 'fixtures': [leg(1, 1.5), leg(2, 2.0)]}
+    
+    assert check([bet], [result(1, 'FT', 2, 0), result(2, 'CANC')]) == [(1, 'won', 5.0)]
+    assert check([bet], [result(1, 'FT', 0, 2), result(2, 'ABD')]) == [(1, 'lost', -10.0)]
+
+def test_all_legs_void_returns_the_stake():
+    bet = {'id': 1, 'amount': 10.0, 'odd': 3.0, 'fixtures': [leg(1, 1.5), leg(2, 2.0)]}
+    
+    assert check([bet], [result(1, 'AWD'), result(2, 'WO')]) == [(1, 'void', 0.0)]
+
+def test_postponed_leg_waits_then_is_voided():
+    hours = (POSTPONED_VOID_AFTER - timedelta(hours=1)) / timedelta(hours=1)
+    recent = {'id': 1, 'amount': 10.0, 'odd': 3.0, 'fixtures': [leg(1, 1.5), leg(2, 2.0, hours)]}
+    assert check([recent], [result(1, 'FT', 2, 0), result(2, 'PST', hours_ago=hours)]) == []
+    
+    hours = (POSTPONED_VOID_AFTER + SETTLE_DELAY) / timedelta(hours=1)
+    stale = {'id': 1, 'amount': 10.0, 'odd': 3.0, 'fixtures': [leg(1, 1.5), leg(2, 2.0, hours)]}
+    assert check([stale], [result(1, 'FT', 2, 0), result(2, 'PST', hours_ago=hours)]) == [(1, 'won', 5.0)]
+
+def test_old_bet_without_leg_odds_is_voided_when_a_leg_is_cancelled():
+    bet = {'id': 1, 'amount': 10.0, 'odd': 3.0,
+           'fixtures': [{'fixture_id': 1, 'prediction_key': 'home'}, {'fixture_id': 2, 'prediction_key': 'home'}]}
+    
+    assert check([bet], [result(1, 'FT', 2, 0), result(2, 'CANC')]) == [(1, 'void', 0.0)]
@@ -0,0 +1,82 @@
+"""StreamingJsonParser срещу json.loads при всякакво нарязване на отговора"""
+import json
+import random
+
+import pytest
+
+from main import StreamingJsonParser
+
+DOCUMENT = {
+    'get': 'fixtures', 'results': 3, 'paging': {'current': 1, 'total': 1},
+    'ratio': 12.5, 'small': -3e-2, 'big': 1e+20, 'zero': 0, 'flag': True, 'none': None,
+    'response': [
+        {'fixture': {'id': 1, 'referee': 'Иван Петров'}, 'odd': '1.85'},
+        {'fixture': {'id': 2, 'referee': None}, 'goals': [0, -1, 2.25]},
+        7, -0.5, 'текст', [], {}
+    ],
+    'errors': [], 'tail': 1.5e-7
+}
+
+def parse(chunks, item_filter=None) -> dict:
+    parser = StreamingJsonParser('response', item_filter)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(8 if depth < 3 else 5)
+    if kind == 0:
+        return rng.randint(-10 ** rng.randint(0, 12), 10 ** rng.randint(0, 12))
+    if kind == 1:
+        return rng.choice([rng.uniform(-1e3, 1e3), rng.uniform(-1, 1) * 10 ** rng.randint(-30, 30), 0.5, -0.0])
+    if kind == 2:
+        return ''.join(rng.choice('ab"\\/é€😀 \n') for _ in range(rng.randint(0, 8)))
+    if kind == 3:
+        return rng.choice([True, False, None])
+    if kind == 4:
+        return rng.randint(0, 9)
+    if kind == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {f'k{i}': random_value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+
+@pytest.mark.parametrize('text', [
+    '{"a": 12.5, "response": []}',
+    '{"a": -3e-2, "response": [1.25, 2E+3]}',
+    json.dumps(DOCUMENT, ensure_ascii=False),
+    json.dumps(DOCUMENT, ensure_ascii=False, indent=2)
+])
+def test_every_split_point(text):
+    # Включително точно след '.', 'e' и по средата на многобайтов UTF-8 символ
+    raw = text.encode('utf-8')
+    expected = json.loads(text)
+    for split in range(len(raw) + 1):
+        assert parse([raw[:split], raw[split:]]) == expected, raw[:split]
+
+def test_split_inside_top_level_number():
+    assert parse([b'{"a": 12.', b'5, "response": []}']) == {'a': 12.5, 'response': []}
+    assert parse([b'{"a": 1e', b'5, "response": [3.', b'0]}']) == {'a': 1e5, 'response': [3.0]}
+
+def test_byte_by_byte_with_filter():
+    raw = json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8')
+    keep_objects = lambda item: item if isinstance(item, dict) else None
+    
+    result = parse([raw[i:i + 1] for i in range(len(raw))], keep_objects)
+    
+    assert result['response'] == [item for item in DOCUMENT['response'] if isinstance(item, dict)]
+    assert result['tail'] == DOCUMENT['tail']
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fuzz_random_documents_and_chunks(seed):
+    rng = random.Random(seed)
+    document = {f'key{i}': random_value(rng) for i in range(rng.randint(0, 6))}
+    document['response'] = [random_value(rng) for _ in range(rng.randint(0, 10))]
+    raw = json.dumps(document, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 1])).encode('utf-8')
+    
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(len(raw) + 1), min(len(raw) + 1, rng.randint(1, 12))))
+        chunks = [raw[a:b] for a, b in zip([0] + cuts, cuts + [len(raw)])]
+        assert parse(chunks) == json.loads(raw)
+
+def test_truncated_document_raises():
+    with pytest.raises(ValueError):
+        parse([b'{"a": 12.5, "response": [1, 2'])